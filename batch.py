@@ -0,0 +1,200 @@
+"""SelfTool 批处理入口 - JSONL 请求离线执行
+
+输入 (文件或 stdin)，每行一个请求:
+    {"id": "r1", "request": "现在几点了", "thread_id": "s1"}
+id 缺省时使用行号；thread_id 可选，同一会话的请求按输入顺序串行执行。
+
+输出 (文件或 stdout)，每完成一个请求写一行:
+    {"id": "r1", "thread_id": "s1", "request": "...", "ok": true, "result": {...}, "error": null, "elapsed_ms": 123.4}
+result 字段与交互模式 run_demo 的结果一致 (summarize_result)。
+
+指定 --output 时以追加方式写入，中断后重新运行会跳过输出文件中已有的 id
+(--retry-failed 时重跑失败的请求)。执行过程的打印输出和控制台日志转到 stderr。
+
+运行: python batch.py requests.jsonl --output results.jsonl --concurrency 8
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from typing import Iterator, Optional, TextIO, Tuple
+from src.infra import config, connection_manager, console_to
+from src.execution import process_sandbox
+from src.workflow.runner import SessionScheduler, run_request, summarize_result, warm_up_executor
+
+
+def read_requests(stream: TextIO) -> Iterator[Tuple[Optional[dict], Optional[str]]]:
+    """逐行读取请求，返回 (请求, 错误信息)"""
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"id": f"line-{line_no}"}, f"JSON 格式错误: {e}"
+            continue
+        if isinstance(item, str):
+            item = {"request": item}
+        if not isinstance(item, dict) or not isinstance(item.get("request"), str) or not item["request"].strip():
+            yield {"id": f"line-{line_no}"}, "缺少 request 字段"
+            continue
+        item.setdefault("id", f"line-{line_no}")
+        yield item, None
+
+
+def load_finished_ids(path: str, retry_failed: bool = False) -> set:
+    """读取已有输出中完成的请求 id (用于断点续跑)"""
+    finished = set()
+    if not path or not os.path.exists(path):
+        return finished
+    
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 中断时写了一半的行
+            if record.get("ok") or not retry_failed:
+                finished.add(str(record.get("id")))
+    return finished
+
+
+def open_output(path: str) -> TextIO:
+    """以追加方式打开结果文件；上次中断留下半行时先换行，避免与新记录粘连"""
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+        if needs_newline:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n")
+    return open(path, "a", encoding="utf-8")
+
+
+class BatchRunner:
+    """批量执行请求并流式写出结果"""
+    
+    def __init__(self, output: TextIO, concurrency: int):
+        self.output = output
+        self.concurrency = concurrency
+        self._scheduler = SessionScheduler(concurrency)
+        self._latencies = []
+        self.counts = {"ok": 0, "failed": 0, "skipped": 0}
+    
+    def _write(self, record: dict):
+        """写出一行结果并立即刷新，保证中断时已完成的结果不丢失"""
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.output.flush()
+    
+    async def _run_one(self, item: dict):
+        thread_id = item.get("thread_id")
+        start = time.perf_counter()
+        try:
+            async with self._scheduler.slot(thread_id):
+                result = summarize_result(await run_request(item["request"], thread_id))
+            error = result["error"]
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+        ok = error is None
+        self.counts["ok" if ok else "failed"] += 1
+        self._latencies.append(elapsed_ms)
+        self._write({
+            "id": item["id"],
+            "thread_id": thread_id,
+            "request": item["request"],
+            "ok": ok,
+            "result": result,
+            "error": error,
+            "elapsed_ms": elapsed_ms,
+        })
+    
+    async def run(self, items: Iterator[Tuple[Optional[dict], Optional[str]]], finished: set):
+        """按输入顺序调度请求 (在途数量受并发上限约束)"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        
+        async def worker():
+            while True:
+                item = await queue.get()
+                try:
+                    await self._run_one(item)
+                finally:
+                    queue.task_done()
+        
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            for item, error in items:
+                if str(item["id"]) in finished:
+                    self.counts["skipped"] += 1
+                    continue
+                if error:
+                    self.counts["failed"] += 1
+                    self._write({"id": item["id"], "ok": False, "result": None, "error": error, "elapsed_ms": 0})
+                    continue
+                await queue.put(item)
+            await queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    
+    def summary(self, wall_seconds: float) -> dict:
+        """汇总统计"""
+        latencies = sorted(self._latencies)
+        
+        def percentile(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+        
+        return {
+            **self.counts,
+            "wall_seconds": round(wall_seconds, 3),
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+        }
+
+
+async def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="SelfTool 批处理 (JSONL 输入/输出)")
+    parser.add_argument("input", nargs="?", default="-", help="请求文件 (JSONL)，缺省或 - 表示 stdin")
+    parser.add_argument("--output", "-o", help="结果文件 (JSONL，追加写入并支持断点续跑)，缺省输出到 stdout")
+    parser.add_argument("--concurrency", "-c", type=int, default=config.SERVER_MAX_CONCURRENCY, help="并发请求数")
+    parser.add_argument("--retry-failed", action="store_true", help="续跑时重新执行失败的请求")
+    args = parser.parse_args()
+    
+    result_stream = sys.stdout
+    # 节点执行过程的打印输出和控制台日志转到 stderr，stdout 只输出结果
+    with contextlib.redirect_stdout(sys.stderr), console_to(sys.stderr):
+        connection_manager.connect_all()
+        warm_up_executor()
+        finished = load_finished_ids(args.output, args.retry_failed)
+        if finished:
+            print(f"断点续跑: 跳过已完成的 {len(finished)} 个请求")
+        
+        input_stream = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+        output_stream = open_output(args.output) if args.output else result_stream
+        start = time.perf_counter()
+        runner = BatchRunner(output_stream, args.concurrency)
+        try:
+            await runner.run(read_requests(input_stream), finished)
+        finally:
+            if input_stream is not sys.stdin:
+                input_stream.close()
+            if output_stream is not result_stream:
+                output_stream.close()
+            connection_manager.close_all()
+            process_sandbox.close()
+            print(f"\n批处理完成: {json.dumps(runner.summary(time.perf_counter() - start), ensure_ascii=False)}")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n已中断，重新运行将从断点继续", file=sys.stderr)
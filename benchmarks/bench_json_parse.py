@@ -0,0 +1,99 @@
+"""JSON 解析基准: 原 _extract_json 与流式解析器对比
+
+统计两类指标:
+1. 解析失败数 (结果与期望不一致) 和单次解析耗时
+2. 流式场景下关键字段 (need_tool / code) 可用时已接收的文本比例
+
+运行: python benchmarks/bench_json_parse.py [--rounds 2000] [--chunk 8]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.workflow.json_stream import StreamingJSONParser, parse_json
+
+
+def extract_json_legacy(text: str) -> dict:
+    """原实现: 取第一个 '{' 到最后一个 '}' 之间的文本整体解析"""
+    try:
+        start = text.find('{')
+        end = text.rfind('}') + 1
+        if start >= 0 and end > start:
+            return json.loads(text[start:end])
+    except json.JSONDecodeError:
+        pass
+    return {}
+
+
+ANALYSIS = {"need_tool": True, "task_description": "计算 123*456", "task_category": "math", "direct_answer": ""}
+SPEC = {
+    "name": "calculate_result",
+    "description": "计算数学表达式",
+    "parameters": {},
+    "return_type": "str",
+    "category": "math",
+    "code": "def calculate_result() -> str:\n    data = {'a': 1}\n    return str(123 * 456)",
+}
+
+# (名称, 模型输出, 期望结果) —— 覆盖 LLM 输出中常见的格式问题
+CASES = [
+    ("纯 JSON", json.dumps(ANALYSIS, ensure_ascii=False), ANALYSIS),
+    ("代码块包裹", "```json\n" + json.dumps(SPEC, ensure_ascii=False, indent=2) + "\n```", SPEC),
+    ("前置说明含花括号", "示例格式为 {key: value}，结果如下:\n" + json.dumps(ANALYSIS, ensure_ascii=False), ANALYSIS),
+    ("后缀说明含花括号", json.dumps(SPEC, ensure_ascii=False) + "\n说明: 返回值形如 {result}", SPEC),
+    ("重复输出两个对象", json.dumps(ANALYSIS, ensure_ascii=False) + "\n" + json.dumps(ANALYSIS, ensure_ascii=False), ANALYSIS),
+    ("响应被截断", json.dumps(ANALYSIS, ensure_ascii=False)[:-12], {k: ANALYSIS[k] for k in ("need_tool", "task_description", "task_category")}),
+]
+
+
+def bench_parse(rounds: int):
+    print(f"{'用例':<14}{'原实现':>10}{'流式解析':>10}{'原实现 us':>12}{'流式 us':>10}")
+    failures = {"legacy": 0, "stream": 0}
+    for name, text, expected in CASES:
+        row = []
+        for key, func in (("legacy", extract_json_legacy), ("stream", parse_json)):
+            ok = func(text) == expected
+            failures[key] += not ok
+            start = time.perf_counter()
+            for _ in range(rounds):
+                func(text)
+            row.append(("OK" if ok else "FAIL", (time.perf_counter() - start) / rounds * 1e6))
+        print(f"{name:<14}{row[0][0]:>10}{row[1][0]:>10}{row[0][1]:>12.1f}{row[1][1]:>10.1f}")
+    print(f"解析失败: 原实现 {failures['legacy']}/{len(CASES)}, 流式解析 {failures['stream']}/{len(CASES)}")
+    return failures
+
+
+def bench_streaming(chunk_size: int):
+    """按固定块大小模拟 Token 流，统计关键字段可用时已接收的文本比例"""
+    print(f"\n流式字段可用时机 (块大小 {chunk_size} 字符):")
+    for name, payload, field in (("需求分析", ANALYSIS, "need_tool"), ("代码生成", SPEC, "code")):
+        text = json.dumps(payload, ensure_ascii=False)
+        parser = StreamingJSONParser()
+        received = 0
+        available_at = None
+        for i in range(0, len(text), chunk_size):
+            chunk = text[i:i + chunk_size]
+            received += len(chunk)
+            if any(key == field for key, _ in parser.feed(chunk)) and available_at is None:
+                available_at = received
+        # 原实现必须等到完整响应
+        print(f"  {name}.{field}: 流式 {available_at}/{len(text)} 字符 ({available_at / len(text):.0%}), 原实现 100%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON 解析基准")
+    parser.add_argument("--rounds", type=int, default=2000, help="每个用例的解析次数")
+    parser.add_argument("--chunk", type=int, default=8, help="流式模拟的块大小 (字符)")
+    args = parser.parse_args()
+    
+    bench_parse(args.rounds)
+    bench_streaming(args.chunk)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""沙箱执行与安全检查基准
+
+以代表性生成工具为语料 (内置样例 + 冻结的日志工具语料 corpus_sandbox.json)，统计:
+1. SafeExecutor.execute 冷启动 (新执行器，需编译) 与热执行 (命中编译缓存) 的延迟
+2. CodeSafetyChecker.check_all 的吞吐 (KB/s)、每 KB 代码的检查耗时，以及命中判定缓存时的单次耗时
+3. 单次执行的内存峰值 (tracemalloc，冷/热分别统计)
+
+结果写入 JSON 文件，指定 --baseline 时与上一版本的结果对比，
+延迟或吞吐退化超过容忍度时以非零状态退出，便于发布前检查。
+语料固定在已提交的 corpus_sandbox.json 中，保证不同版本的结果基于同一语料可比；
+从日志提取新语料需显式执行 --refresh-corpus (语料变更后应重新生成基线)。
+
+运行: python benchmarks/bench_sandbox.py [--rounds 200] [--output ...] [--baseline ...]
+刷新语料: python benchmarks/bench_sandbox.py --refresh-corpus [--log-dir src/logs]
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.execution.process_pool import ProcessSandbox
+from src.execution.safety import CodeSafetyChecker
+from src.execution.sandbox import SafeExecutor
+
+# 冻结的日志工具语料 (--refresh-corpus 生成)
+CORPUS_FILE = os.path.join(ROOT, "benchmarks", "corpus_sandbox.json")
+
+
+# (名称, 代码, 实参) —— 覆盖生成工具的常见形态
+CORPUS = [
+    ("算术常量", "def calculate_result() -> str:\n    result = 123 * 456\n    return str(result)", {}),
+    ("带参数算术", "def multiply_numbers(a: int, b: int) -> str:\n    return str(a * b)", {"a": 123, "b": 456}),
+    ("日期格式化", "def get_date() -> str:\n    from datetime import datetime\n    return datetime.now().strftime('%Y-%m-%d')", {}),
+    ("日历计算", "import calendar\ndef days_in_month(year: int, month: int) -> str:\n    return str(calendar.monthrange(year, month)[1])", {"year": 2024, "month": 2}),
+    ("字符串处理", "def reverse_words(text: str) -> str:\n    return ' '.join(w[::-1] for w in text.split())", {"text": "hello sandbox world"}),
+    ("正则提取", "import re\ndef extract_numbers(text: str) -> str:\n    return ','.join(re.findall(r'\\d+', text))", {"text": "a1b22c333"}),
+    ("JSON 处理", "import json\ndef pretty(data: str) -> str:\n    return json.dumps(json.loads(data), sort_keys=True)", {"data": '{"b": 1, "a": [1, 2, 3]}'}),
+    ("循环求和", "def sum_squares(n: int) -> str:\n    total = 0\n    for i in range(n):\n        total += i * i\n    return str(total)", {"n": 1000}),
+    ("数学函数", "import math\ndef hypot_sum(x: float, y: float) -> str:\n    return f'{math.sqrt(x ** 2 + y ** 2):.4f}'", {"x": 3.0, "y": 4.0}),
+    ("随机数", "import random\ndef roll_dice(seed: int) -> str:\n    rng = random.Random(seed)\n    return str([rng.randint(1, 6) for _ in range(5)])", {"seed": 42}),
+]
+
+# 日志中 LLM 响应的 "code": "..." 字段 (JSON 字符串)
+_LOG_CODE_PATTERN = re.compile(r'"code":\s*("(?:[^"\\]|\\.)*")')
+
+
+def harvest_log_corpus(log_dir: str) -> list:
+    """从日志中提取出现过的工具代码，只保留无必填参数且可解析的函数"""
+    if not log_dir or not os.path.isdir(log_dir):
+        return []
+    seen = {code for _, code, _ in CORPUS}
+    corpus = []
+    for filename in sorted(os.listdir(log_dir)):
+        if not filename.endswith(".log"):
+            continue
+        with open(os.path.join(log_dir, filename), encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+        for match in _LOG_CODE_PATTERN.finditer(text):
+            try:
+                code = json.loads(match.group(1))
+                tree = ast.parse(code)
+            except (json.JSONDecodeError, SyntaxError):
+                continue
+            func = next((n for n in tree.body if isinstance(n, ast.FunctionDef)), None)
+            if func is None or code in seen or len(func.args.args) > len(func.args.defaults):
+                continue
+            seen.add(code)
+            name = f"日志:{func.name}"
+            names = {n for n, _, _ in corpus}
+            if name in names:  # 同名工具的不同版本按出现顺序编号
+                name += f"#{sum(n.split('#')[0] == name for n in names) + 1}"
+            corpus.append((name, code, {}))
+    return corpus
+
+
+def load_corpus(path: str = CORPUS_FILE) -> list:
+    """读取冻结的日志工具语料，文件不存在时为空"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [(entry["name"], entry["code"], entry["args"]) for entry in json.load(f)]
+
+
+def refresh_corpus(log_dir: str, path: str = CORPUS_FILE) -> list:
+    """从日志重新提取语料并写入冻结文件"""
+    corpus = harvest_log_corpus(log_dir)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{"name": n, "code": c, "args": a} for n, c, a in corpus], f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return corpus
+
+
+def corpus_digest(corpus: list) -> str:
+    """语料指纹: 基线与当前结果的指纹不同时两者基于不同语料，对比不可靠"""
+    data = json.dumps([[name, code, args] for name, code, args in corpus], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+def _func_name(code: str) -> str:
+    return next(n.name for n in ast.parse(code).body if isinstance(n, ast.FunctionDef))
+
+
+def executable_corpus(corpus: list) -> list:
+    """可执行的语料: 通过安全检查且在进程池沙箱中 (超时/内存限制) 试运行成功
+    
+    日志中包含被拒绝、执行失败或超时的代码，只参与安全检查基准，不进入进程内执行的计时。
+    """
+    checker = CodeSafetyChecker()
+    safe = [(name, code, args) for name, code, args in corpus if not checker.check_all(code)]
+    sandbox = ProcessSandbox(pool_size=1)
+    try:
+        outcomes = sandbox.execute_batch_sync([(code, _func_name(code), args) for _, code, args in safe])
+    finally:
+        sandbox.close()
+    return [entry for entry, (_, error) in zip(safe, outcomes) if error is None]
+
+
+def _percentiles(samples: list) -> dict:
+    """延迟分布 (微秒)"""
+    ordered = sorted(samples)
+    return {
+        "median_us": round(statistics.median(ordered), 2),
+        "p95_us": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+    }
+
+
+def bench_execute(corpus: list, rounds: int) -> dict:
+    """冷启动与热执行延迟: 冷启动每次使用新执行器，热执行复用同一执行器"""
+    print(f"{'工具':<24}{'冷启动 us':>12}{'热执行 us':>12}{'加速':>8}")
+    results = {}
+    for name, code, args in corpus:
+        func_name = _func_name(code)
+        cold, warm = [], []
+        for _ in range(max(1, rounds // 10)):
+            executor = SafeExecutor()
+            start = time.perf_counter()
+            executor.execute(code, func_name, args)
+            cold.append((time.perf_counter() - start) * 1e6)
+        executor = SafeExecutor()
+        executor.execute(code, func_name, args)
+        for _ in range(rounds):
+            start = time.perf_counter()
+            executor.execute(code, func_name, args)
+            warm.append((time.perf_counter() - start) * 1e6)
+        
+        results[name] = {"cold": _percentiles(cold), "warm": _percentiles(warm)}
+        cold_us, warm_us = results[name]["cold"]["median_us"], results[name]["warm"]["median_us"]
+        print(f"{name:<24}{cold_us:>12.1f}{warm_us:>12.1f}{cold_us / warm_us:>7.1f}x")
+    return results
+
+
+def bench_checker(corpus: list, rounds: int) -> dict:
+    """安全检查吞吐: 整个语料循环检查，按代码总字节数折算 (关闭判定缓存)；另测命中缓存时的单次耗时"""
+    checker = CodeSafetyChecker(cache_size=0)
+    total_bytes = sum(len(code.encode("utf-8")) for _, code, _ in corpus)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _, code, _ in corpus:
+            checker.check_all(code)
+    elapsed = time.perf_counter() - start
+    
+    cached_checker = CodeSafetyChecker()
+    for _, code, _ in corpus:
+        cached_checker.check_all(code)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for _, code, _ in corpus:
+            cached_checker.check_all(code)
+    cached_elapsed = time.perf_counter() - start
+    
+    kb = total_bytes * rounds / 1024
+    result = {
+        "corpus_bytes": total_bytes,
+        "kb_per_second": round(kb / elapsed, 1),
+        "us_per_kb": round(elapsed / kb * 1e6, 1),
+        "cached_us_per_check": round(cached_elapsed / (rounds * len(corpus)) * 1e6, 2),
+    }
+    print(
+        f"\n安全检查: {result['kb_per_second']} KB/s, {result['us_per_kb']} us/KB (语料 {total_bytes} 字节), "
+        f"命中判定缓存 {result['cached_us_per_check']} us/次"
+    )
+    return result
+
+
+def bench_memory(corpus: list) -> dict:
+    """单次执行的内存峰值 (KB): 冷启动含编译，热执行含命名空间构建与函数调用"""
+    results = {}
+    for name, code, args in corpus:
+        func_name = _func_name(code)
+        executor = SafeExecutor()
+        peaks = []
+        for _ in range(2):  # 第一次为冷启动，第二次命中编译缓存
+            tracemalloc.start()
+            executor.execute(code, func_name, args)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        results[name] = {"cold_kb": round(peaks[0] / 1024, 1), "warm_kb": round(peaks[1] / 1024, 1)}
+    
+    cold = [r["cold_kb"] for r in results.values()]
+    warm = [r["warm_kb"] for r in results.values()]
+    print(f"内存峰值: 冷启动中位数 {statistics.median(cold)} KB, 热执行中位数 {statistics.median(warm)} KB")
+    return results
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> list:
+    """与基线对比，返回退化超过容忍度的指标"""
+    regressions = []
+    if baseline.get("meta", {}).get("corpus_sha256") != current["meta"]["corpus_sha256"]:
+        regressions.append("语料与基线不一致 (corpus_sha256 不同)，请用当前语料重新生成基线")
+    for name, entry in current["execute"].items():
+        base = baseline.get("execute", {}).get(name)
+        if not base:
+            continue
+        for phase in ("cold", "warm"):
+            now, before = entry[phase]["median_us"], base[phase]["median_us"]
+            if before and now > before * (1 + tolerance):
+                regressions.append(f"{name} {phase}: {before} -> {now} us")
+    
+    base_checker = baseline.get("checker", {}).get("kb_per_second")
+    now_checker = current["checker"]["kb_per_second"]
+    if base_checker and now_checker < base_checker * (1 - tolerance):
+        regressions.append(f"安全检查吞吐: {base_checker} -> {now_checker} KB/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="沙箱执行与安全检查基准")
+    parser.add_argument("--rounds", type=int, default=200, help="每个工具的热执行次数 (冷启动为其 1/10)")
+    parser.add_argument("--refresh-corpus", action="store_true", help="从日志重新提取语料写入 corpus_sandbox.json 后退出")
+    parser.add_argument("--log-dir", default=os.path.join(ROOT, "src", "logs"), help="--refresh-corpus 提取工具代码的日志目录")
+    parser.add_argument("--output", default=os.path.join(ROOT, "benchmarks", "results", "bench_sandbox.json"), help="结果 JSON 文件")
+    parser.add_argument("--baseline", help="对比的基线结果 JSON 文件")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例")
+    args = parser.parse_args()
+    
+    if args.refresh_corpus:
+        harvested = refresh_corpus(args.log_dir)
+        print(f"已从 {args.log_dir} 提取 {len(harvested)} 个工具写入 {CORPUS_FILE}，请重新生成基线")
+        return
+    
+    corpus = CORPUS + load_corpus()
+    executable = executable_corpus(corpus)
+    print(f"语料: 内置 {len(CORPUS)} 个, 日志 {len(corpus) - len(CORPUS)} 个, 可执行 {len(executable)} 个\n")
+    
+    result = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "rounds": args.rounds,
+            "corpus_size": len(corpus),
+            "corpus_sha256": corpus_digest(corpus),
+            "executable_size": len(executable),
+        },
+        "execute": bench_execute(executable, args.rounds),
+        "checker": bench_checker(corpus, args.rounds),
+        "memory": bench_memory(executable),
+    }
+    
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n性能退化 (超过 {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n与基线相比无明显退化")
+
+
+if __name__ == "__main__":
+    main()
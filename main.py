@@ -3,9 +3,12 @@
 import asyncio
 import atexit
 import uuid
-from src.workflow import self_tool_graph, create_initial_state
-from src.infra import connection_manager
-from src.storage import tool_registry, TOOLS_DIR, checkpointer
+from src.workflow import create_initial_state
+from src.infra import connection_manager, llm_gateway
+from src.storage import tool_registry, TOOLS_DIR, checkpointer, llm_cache, generation_flight, tool_result_cache, negative_cache, blob_store
+from src.execution import process_sandbox, safe_executor, safety_repairer, safety_checker
+from src.workflow.speculation import speculation_stats
+from src.workflow.runner import run_request, warm_up_executor
 
 
 # 全局会话 ID
@@ -27,6 +30,10 @@ def init_connections():
     print(f"  MongoDB: {'OK' if status['mongodb'] else 'FAIL (将使用内存存储)'}")
     print(f"  Redis:   {'OK' if status['redis'] else 'FAIL (将禁用缓存)'}")
     
+    warmed = warm_up_executor()
+    if warmed:
+        print(f"  预编译工具: {warmed} 个")
+    
     return status['mongodb'] or status['redis']
 
 
@@ -40,6 +47,7 @@ def close_connections():
     """关闭所有连接"""
     print("\n[关闭连接]")
     connection_manager.close_all()
+    process_sandbox.close()
     print("  所有连接已关闭")
 
 
@@ -49,22 +57,22 @@ async def run_demo(user_request: str, thread_id: str = None):
     print(f"会话 ID: {thread_id}")
     print("-" * 50)
     
-    # 只传入当前请求，checkpoint 会自动恢复历史状态
-    # 重置迭代计数和任务列表（每个新请求都是新的执行）
-    input_state = {
-        "user_request": user_request,
-        "iteration_count": 0,
-        "task_list": [],
-        "task_results": [],
-        "current_task_index": 0,
-    }
-    
-    # 运行图（带会话配置）
-    config = {
-        "configurable": {"thread_id": thread_id},
-        "recursion_limit": 100  # 增加递归限制，支持多任务多迭代
-    } if thread_id else {"recursion_limit": 100}
-    result = await self_tool_graph.ainvoke(input_state, config=config)
+    # 流式运行图: custom 事件实时推送工具原始结果和润色 token，返回最终状态
+    streaming = False
+    
+    async def on_event(event: dict):
+        nonlocal streaming
+        if event.get("type") == "tool_result":
+            print(f"\n>>> 任务{event['task_id']} 工具结果: {event['result']}")
+        elif event.get("type") == "token":
+            if not streaming:
+                print("\n>>> 回复: ", end="")
+                streaming = True
+            print(event["content"], end="", flush=True)
+    
+    result = await run_request(user_request, thread_id, on_event=on_event)
+    if streaming:
+        print()
     
     # 输出结果
     print("\n" + "=" * 50)
@@ -122,6 +130,91 @@ def show_history():
         print(f"  [{i}] 请求: {request[:30]}... -> 结果: {str(result)[:30]}...")
 
 
+def show_stats():
+    """显示 LLM 网关指标和缓存命中统计"""
+    metrics = llm_gateway.metrics()
+    print("\nLLM 网关指标:")
+    print(
+        f"  调用={metrics['calls']} 重试={metrics['retries']} 失败={metrics['failures']} "
+        f"超时={metrics['timeouts']} 执行中={metrics['in_flight']}"
+    )
+    print(
+        f"  队列深度={metrics['queue_depth']} (峰值 {metrics['max_queue_depth']}) "
+        f"平均等待={metrics['avg_wait_ms']:.1f}ms 最大等待={metrics['max_wait_ms']:.1f}ms "
+        f"限流等待={metrics['rate_limit_wait_ms']:.1f}ms"
+    )
+    
+    stats = llm_cache.stats()
+    if stats:
+        print("\nLLM 缓存统计:")
+        for node, counters in stats.items():
+            print(
+                f"  {node:<16} 内存命中={counters['memory_hit']} Redis命中={counters['redis_hit']} "
+                f"未命中={counters['miss']} 跳过={counters['bypass']} 命中率={counters['hit_rate']:.1%}"
+            )
+    
+    speculation = speculation_stats.stats()
+    if speculation:
+        print("\n推测生成统计:")
+        for category, counters in speculation.items():
+            print(
+                f"  {category:<16} 启动={counters['launched']} 采用={counters['paid_off']} "
+                f"浪费={counters['wasted']} 命中率={counters['payoff_rate']:.1%}"
+            )
+    
+    results = tool_result_cache.stats()
+    if results.get("hit") or results.get("miss"):
+        print("\n纯工具结果缓存:")
+        print(f"  命中={results.get('hit', 0)} 未命中={results.get('miss', 0)} 写入={results.get('store', 0)} 命中率={results['hit_rate']:.1%}")
+    
+    flight = generation_flight.stats()
+    if flight:
+        print("\n生成去重统计:")
+        print(
+            f"  自行生成={flight.get('leader', 0)} 进程内复用={flight.get('local_follower', 0)} "
+            f"跨进程复用={flight.get('remote_follower', 0)} 等待超时={flight.get('fallback', 0)}"
+        )
+    
+    compiled = safe_executor.stats()
+    if compiled.get("hit") or compiled.get("compile"):
+        print("\n工具编译缓存:")
+        print(f"  命中={compiled.get('hit', 0)} 编译={compiled.get('compile', 0)} 缓存工具数={compiled['entries']}")
+    
+    sandbox = process_sandbox.stats()
+    if sandbox:
+        print("\n进程池沙箱:")
+        print(
+            f"  执行={sandbox.get('runs', 0)} 超时={sandbox.get('timeouts', 0)} "
+            f"崩溃={sandbox.get('crashes', 0)} 替换进程={sandbox.get('recycled', 0)}"
+        )
+    
+    checks = safety_checker.stats()
+    if checks.get("check") or checks.get("hit"):
+        print("\n安全检查判定缓存:")
+        print(
+            f"  分析={checks.get('check', 0)} 缓存命中={checks.get('hit', 0)} "
+            f"复用工具文档判定={checks.get('stored_verdict', 0)}"
+        )
+    
+    repair = safety_repairer.stats()
+    if repair:
+        print("\n安全问题自动修复:")
+        print(f"  尝试={repair.get('attempted', 0)} 修复成功 (节省重新生成)={repair.get('saved', 0)} 无法修复={repair.get('failed', 0)}")
+    
+    negative = negative_cache.stats()
+    if negative.get("record") or negative.get("hit"):
+        print("\n生成失败负缓存:")
+        print(f"  快速拒绝={negative.get('hit', 0)} 记录失败={negative.get('record', 0)} 当前条目={negative['entries']}")
+    
+    blobs = blob_store.stats()
+    if blobs:
+        print("\n大结果外置存储:")
+        print(
+            f"  写入={blobs.get('stored', 0)} 内容重复跳过={blobs.get('dedup', 0)} "
+            f"读取={blobs.get('fetched', 0)} 缺失={blobs.get('missing', 0)}"
+        )
+
+
 async def interactive_mode():
     """交互模式"""
     global current_thread_id
@@ -153,7 +246,7 @@ async def interactive_mode():
     print("\n" + "=" * 50)
     print("  交互模式已启动")
     print(f"  当前会话: {current_thread_id}")
-    print("  命令: new(新会话), session(会话信息), history(历史)")
+    print("  命令: new(新会话), session(会话信息), history(历史), stats(调用统计)")
     print("  输入 'exit' 或 'quit' 退出")
     print("=" * 50)
     
@@ -199,8 +292,13 @@ async def interactive_mode():
                 show_history()
                 continue
             
-            await run_demo(user_input, current_thread_id)
+            if user_input.lower() == 'stats':
+                # 显示缓存统计
+                show_stats()
+                continue
             
+            await run_demo(user_input, current_thread_id)
+        
         except KeyboardInterrupt:
             print("\n\n中断，再见!")
             break
@@ -0,0 +1,207 @@
+"""SelfTool 服务端入口 - 行分隔 JSON over TCP
+
+每行一个请求:   {"id": "r1", "thread_id": "s1", "request": "现在几点了", "stream": false}
+每行一个响应:   {"id": "r1", "thread_id": "s1", "ok": true, "result": {...}, "elapsed_ms": 123.4}
+stream 为 true 时先推送事件行: {"id": "r1", "event": {"type": "tool_result", ...}}
+查询统计:       {"op": "stats"}
+
+多个会话并发执行 (受并发上限约束)，同一会话的请求按到达顺序串行执行。
+收到 SIGINT/SIGTERM 后停止接收新请求，等待在途请求完成后关闭数据库连接。
+"""
+
+import argparse
+import asyncio
+import json
+import signal
+import time
+from collections import Counter
+from typing import Optional
+from src.infra import config, connection_manager, llm_gateway, workflow_logger
+from src.execution import process_sandbox
+from src.workflow.runner import SessionScheduler, run_request, summarize_result, warm_up_executor
+
+
+class SelfToolServer:
+    """多会话并发服务"""
+    
+    def __init__(self, host: str = None, port: int = None, max_concurrency: int = None):
+        self.host = host or config.SERVER_HOST
+        self.port = config.SERVER_PORT if port is None else port
+        self._scheduler = SessionScheduler(max_concurrency or config.SERVER_MAX_CONCURRENCY)
+        self._requests: set = set()      # 在途请求任务
+        self._writers: set = set()       # 活动连接
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._stop = asyncio.Event()
+        self._stats = Counter()          # received / completed / failed / rejected
+    
+    async def start(self):
+        """开始监听"""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        workflow_logger.info(f"服务已启动: {self.host}:{self.port}")
+        print(f"SelfTool 服务已启动: {self.host}:{self.port}")
+    
+    async def serve_forever(self):
+        """运行直到收到停止信号，然后优雅关闭"""
+        await self.start()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self._stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows 不支持，依赖 KeyboardInterrupt 取消
+        try:
+            await self._stop.wait()
+        finally:
+            await self.shutdown()
+    
+    def request_shutdown(self):
+        """请求停止服务"""
+        self._stop.set()
+    
+    async def shutdown(self):
+        """停止接收新请求，等待在途请求完成 (超时则取消)，关闭连接"""
+        self._stop.set()
+        if self._server:
+            self._server.close()
+        
+        if self._requests:
+            print(f"等待 {len(self._requests)} 个在途请求完成...")
+            _, pending = await asyncio.wait(self._requests, timeout=config.SERVER_DRAIN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            if pending:
+                workflow_logger.warning(f"关闭超时，取消 {len(pending)} 个请求")
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+        for writer in list(self._writers):
+            writer.close()
+        if self._server:
+            await self._server.wait_closed()
+        
+        connection_manager.close_all()
+        process_sandbox.close()
+        workflow_logger.info(f"服务已关闭: {dict(self._stats)}")
+        print("SelfTool 服务已关闭")
+    
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个连接: 逐行读取请求，每个请求独立执行，响应按完成顺序写回"""
+        self._writers.add(writer)
+        write_lock = asyncio.Lock()
+        
+        async def send(message: dict):
+            async with write_lock:
+                if writer.is_closing():
+                    return
+                writer.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+        
+        tasks = set()
+        try:
+            while not self._stop.is_set():
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        raise ValueError("请求必须是 JSON 对象")
+                except ValueError as e:
+                    await send({"ok": False, "error": f"请求格式错误: {e}"})
+                    continue
+                
+                if message.get("op") == "stats":
+                    await send({"ok": True, "stats": self.stats()})
+                    continue
+                
+                if self._stop.is_set():
+                    self._stats["rejected"] += 1
+                    await send({"id": message.get("id"), "ok": False, "error": "服务正在关闭"})
+                    continue
+                
+                task = asyncio.create_task(self._process(message, send))
+                tasks.add(task)
+                self._requests.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(self._requests.discard)
+            
+            # 客户端发送完毕: 等待本连接的请求完成后再关闭
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+    
+    async def _process(self, message: dict, send):
+        """执行单个请求"""
+        request_id = message.get("id")
+        thread_id = message.get("thread_id")
+        user_request = message.get("request", "")
+        self._stats["received"] += 1
+        
+        if not isinstance(user_request, str) or not user_request.strip():
+            self._stats["failed"] += 1
+            await send({"id": request_id, "thread_id": thread_id, "ok": False, "error": "request 不能为空"})
+            return
+        
+        on_event = None
+        if message.get("stream"):
+            async def on_event(event: dict):
+                await send({"id": request_id, "event": event})
+        
+        start = time.perf_counter()
+        try:
+            async with self._scheduler.slot(thread_id):
+                result = await run_request(user_request, thread_id, on_event=on_event)
+        except Exception as e:
+            self._stats["failed"] += 1
+            workflow_logger.error(f"请求 {request_id} 执行失败: {e}")
+            await send({"id": request_id, "thread_id": thread_id, "ok": False, "error": str(e)})
+            return
+        
+        self._stats["completed"] += 1
+        await send({
+            "id": request_id,
+            "thread_id": thread_id,
+            "ok": True,
+            "result": summarize_result(result),
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+        })
+    
+    def stats(self) -> dict:
+        """获取服务统计"""
+        return {
+            **self._stats,
+            "in_flight": len(self._requests),
+            "sessions": self._scheduler.active_sessions,
+            "llm": llm_gateway.metrics(),
+        }
+
+
+async def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="SelfTool 服务端 (行分隔 JSON over TCP)")
+    parser.add_argument("--host", default=config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVER_PORT)
+    parser.add_argument("--concurrency", type=int, default=config.SERVER_MAX_CONCURRENCY, help="同时执行的请求数上限")
+    args = parser.parse_args()
+    
+    status = connection_manager.connect_all()
+    print(f"MongoDB: {'OK' if status['mongodb'] else 'FAIL (将使用内存存储)'}")
+    print(f"Redis:   {'OK' if status['redis'] else 'FAIL (将禁用缓存)'}")
+    print(f"预编译工具: {warm_up_executor()} 个")
+    
+    server = SelfToolServer(args.host, args.port, args.concurrency)
+    await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,4 +1,8 @@
 """执行模块"""
 
-from .safety import CodeSafetyChecker
-from .sandbox import SafeExecutor
+from .safety import CodeSafetyChecker, safety_checker
+from .sandbox import SafeExecutor, safe_executor
+from .process_pool import ProcessSandbox, process_sandbox
+from .purity import PurityAnalyzer
+from .cost import CostAnalyzer
+from .repair import SafetyRepairer, safety_repairer
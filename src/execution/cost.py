@@ -0,0 +1,442 @@
+"""工具执行成本分析模块
+
+基于 AST 静态估计工具的执行成本，决定在当前进程内直接执行还是交给隔离的工作进程:
+- trivial: 无循环或循环次数为小常量，直接执行
+- moderate: 循环次数或正则匹配受输入数据约束，或为中等常量
+- heavy: 常量循环次数、序列重复、格式宽度或幂运算规模过大
+- unknown: while 循环、递归、非常量规模的 range/序列重复/格式宽度/幂运算、
+  输入决定的正则或嵌套量词正则、循环中按自身倍增的变量 (x = x + x、x *= x)、
+  sleep (含别名导入) 等无法静态估计的情况
+只有 trivial 的工具在进程内执行 (没有超时和内存限制)，其余交给进程池沙箱。
+"""
+
+import ast
+import re
+import string
+from typing import List, Optional, Tuple
+from ..infra.config import config
+
+
+class CostAnalyzer(ast.NodeVisitor):
+    """工具执行成本分析器"""
+    
+    # 成本类别 (按严重程度排序)
+    COST_CLASSES = ("trivial", "moderate", "unknown", "heavy")
+    
+    # 耗时与参数规模相关的函数 (math.factorial 等)
+    SCALING_CALLS = {"factorial", "comb", "perm", "pow"}
+    
+    # 阻塞调用 (在进程内执行会阻塞事件循环)
+    BLOCKING_CALLS = {"sleep"}
+    
+    # 变量与自身做这些运算时每次迭代规模成倍增长 (x = x * 2、x **= 2、x <<= 1)
+    COMPOUNDING_OPS = (ast.Mult, ast.Pow, ast.LShift)
+    
+    # 正则匹配 (re 模块函数及编译后模式的同名方法)
+    REGEX_CALLS = {"match", "search", "fullmatch", "findall", "finditer", "sub", "subn", "split"}
+    
+    # 按宽度填充的字符串方法 (宽度即输出长度)
+    PADDING_CALLS = {"ljust", "rjust", "center", "zfill"}
+    
+    # 返回序列的内置函数和方法 (结果参与 * 运算时按序列重复计)
+    SEQUENCE_CALLS = {
+        "str", "list", "tuple", "bytes", "bytearray", "sorted", "repr",
+        "split", "join", "upper", "lower", "strip", "replace", "splitlines", "encode", "format",
+    }
+    SEQUENCE_ANNOTATIONS = {"str", "list", "tuple", "bytes", "List", "Tuple"}
+    
+    # 量词作用于含量词的分组 (如 (a+)+)，不匹配的输入会导致指数级回溯
+    NESTED_QUANTIFIER = re.compile(r"\([^()]*[+*][^()]*\)[+*{]")
+    
+    # % 格式化的转换说明中的宽度和精度
+    PERCENT_SPEC = re.compile(r"%(?:\([^)]*\))?[-#0 +]*(\*|\d+)?(?:\.(\*|\d+))?")
+    
+    def analyze(self, code: str) -> Tuple[str, List[str]]:
+        """分析代码成本，返回 (成本类别, 原因)"""
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            return "unknown", [f"代码语法错误: {e}"]
+        
+        self._reasons = {name: [] for name in self.COST_CLASSES}
+        self._iterations = [1]  # 外层循环累计的常量迭代次数 (None 表示受数据约束)
+        self._loop_ranges = set()  # 作为循环迭代对象的 range 调用，避免重复计数
+        self._collect_bindings(tree)
+        self.visit(tree)
+        self._check_recursion(tree)
+        
+        for cost_class in reversed(self.COST_CLASSES):
+            if self._reasons[cost_class]:
+                return cost_class, self._reasons[cost_class]
+        return "trivial", []
+    
+    def cost_class(self, code: str) -> str:
+        """成本类别"""
+        return self.analyze(code)[0]
+    
+    # ===== 循环 =====
+    
+    def visit_For(self, node: ast.For):
+        self._mark_loop_range(node.iter)
+        self.visit(node.target)
+        self.visit(node.iter)
+        self._enter_loop(node.iter)
+        for stmt in node.body + node.orelse:
+            self.visit(stmt)
+        self._iterations.pop()
+    
+    visit_AsyncFor = visit_For
+    
+    def visit_While(self, node: ast.While):
+        self._reasons["unknown"].append("while 循环")
+        self._iterations.append(None)
+        self.generic_visit(node)
+        self._iterations.pop()
+    
+    def _visit_comprehension(self, node):
+        depth = len(self._iterations)
+        for generator in node.generators:
+            self._mark_loop_range(generator.iter)
+            self.visit(generator.iter)
+            self._enter_loop(generator.iter)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for field in ("elt", "key", "value"):
+            child = getattr(node, field, None)
+            if child is not None:
+                self.visit(child)
+        del self._iterations[depth:]
+    
+    visit_ListComp = visit_SetComp = visit_GeneratorExp = visit_DictComp = _visit_comprehension
+    
+    def _enter_loop(self, iterable: ast.AST):
+        """进入一层循环: 累计迭代次数并按阈值记录成本"""
+        count = self._iteration_count(iterable)
+        outer = self._iterations[-1]
+        if count is None or outer is None:
+            total = None
+            if outer is None and count is None:
+                self._reasons["unknown"].append("嵌套的数据相关循环")
+            else:
+                self._reasons["moderate"].append("循环次数取决于输入数据")
+        else:
+            total = outer * count
+            self._record_iterations(total)
+        self._iterations.append(total)
+    
+    def _iteration_count(self, iterable: ast.AST) -> Optional[int]:
+        """常量规模的可迭代对象的元素数 (range 常量参数、字面量)，无法确定时返回 None"""
+        if isinstance(iterable, (ast.List, ast.Tuple, ast.Set)):
+            return len(iterable.elts)
+        if isinstance(iterable, ast.Constant) and isinstance(iterable.value, str):
+            return len(iterable.value)
+        if self._is_range(iterable):
+            return self._range_size(iterable)
+        return None
+    
+    def _mark_loop_range(self, iterable: ast.AST):
+        if self._is_range(iterable):
+            self._loop_ranges.add(id(iterable))
+    
+    def _record_iterations(self, total: int):
+        if total >= config.COST_HEAVY_ITERATIONS:
+            self._reasons["heavy"].append(f"循环约 {total} 次")
+        elif total > config.COST_TRIVIAL_ITERATIONS:
+            self._reasons["moderate"].append(f"循环约 {total} 次")
+    
+    # ===== 循环中的累积赋值 =====
+    
+    def visit_Assign(self, node: ast.Assign):
+        self.generic_visit(node)
+        if isinstance(node.value, ast.BinOp):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    self._check_growth(target.id, node.value.op, node.value, 0)
+    
+    def visit_AugAssign(self, node: ast.AugAssign):
+        self.generic_visit(node)
+        if isinstance(node.target, ast.Name):
+            self._check_growth(node.target.id, node.op, node.value, 1)
+    
+    def _check_growth(self, name: str, op: ast.operator, value: ast.AST, implicit_refs: int):
+        """循环中变量按自身倍增 (x = x + x、x = x * x、x += x、x *= k)，少量迭代即可耗尽内存或 CPU
+        
+        x += k 等与自身无关的累加为线性增长，仍按循环次数分类。
+        """
+        if len(self._iterations) <= 1:
+            return
+        refs = implicit_refs + sum(isinstance(n, ast.Name) and n.id == name for n in ast.walk(value))
+        if (isinstance(op, self.COMPOUNDING_OPS) and refs >= 1) or (isinstance(op, ast.Add) and refs >= 2):
+            self._reasons["unknown"].append(f"循环中 {name} 按自身倍增")
+    
+    # ===== 调用与运算 =====
+    
+    def visit_Call(self, node: ast.Call):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name):
+            name = self._aliases.get(node.func.id, node.func.id)  # from time import sleep as nap
+        else:
+            name = getattr(node.func, "attr", None)
+        
+        # sum(range(n)) 等不在循环语法中的 range 也按循环计数
+        if self._is_range(node) and id(node) not in self._loop_ranges:
+            size = self._range_size(node)
+            if size is None:
+                self._reasons["moderate"].append("range 规模取决于输入数据")
+            elif self._iterations[-1] is not None:
+                self._record_iterations(self._iterations[-1] * size)
+        
+        regex = self._regex_call(node)
+        if regex is not None:
+            self._check_regex(*regex)
+        elif name in self.BLOCKING_CALLS:
+            self._reasons["unknown"].append(f"阻塞调用: {name}")
+        elif name in self.SCALING_CALLS:
+            values = [self._const_int(arg) for arg in node.args]
+            if any(v is None for v in values):
+                self._reasons["unknown"].append(f"{name} 参数规模未知")
+            elif any(abs(v) > config.COST_MAX_CONSTANT_OPERAND for v in values):
+                self._reasons["heavy"].append(f"{name} 参数过大")
+        elif name in self.PADDING_CALLS and isinstance(node.func, ast.Attribute) and node.args:
+            self._record_output_size(self._const_int(node.args[0]), "填充宽度")
+        elif name == "format":
+            self._check_format_call(node)
+    
+    def _check_format_call(self, node: ast.Call):
+        """'{:>{}}'.format(...) / format(value, spec) 的格式宽度"""
+        if isinstance(node.func, ast.Attribute):
+            template = node.func.value
+            if not self._is_str_constant(template):
+                self._reasons["unknown"].append("格式模板取决于输入数据")
+                return
+            try:
+                specs = [spec for _, _, spec, _ in string.Formatter().parse(template.value) if spec]
+            except ValueError:
+                return
+            for spec in specs:
+                self._check_format_spec(spec)
+        elif len(node.args) >= 2:
+            if self._is_str_constant(node.args[1]):
+                self._check_format_spec(node.args[1].value)
+            else:
+                self._reasons["unknown"].append("格式宽度取决于输入数据")
+    
+    def visit_FormattedValue(self, node: ast.FormattedValue):
+        self.generic_visit(node)
+        if node.format_spec is None:
+            return
+        parts = node.format_spec.values
+        if any(isinstance(part, ast.FormattedValue) for part in parts):
+            self._reasons["unknown"].append("格式宽度取决于输入数据")
+        else:
+            self._check_format_spec("".join(part.value for part in parts if isinstance(part, ast.Constant)))
+    
+    def _check_format_spec(self, spec: str):
+        """格式说明中的宽度/精度决定输出长度，嵌套字段 ({:{}}) 的宽度来自实参"""
+        if "{" in spec:
+            self._reasons["unknown"].append("格式宽度取决于输入数据")
+            return
+        sizes = [int(digits) for digits in re.findall(r"\d+", spec)]
+        if sizes:
+            self._record_output_size(max(sizes), "格式宽度")
+    
+    def _record_output_size(self, size: Optional[int], what: str):
+        if size is None:
+            self._reasons["unknown"].append(f"{what}取决于输入数据")
+        elif size >= config.COST_HEAVY_ITERATIONS:
+            self._reasons["heavy"].append(f"{what}过大: {size}")
+        elif size > config.COST_TRIVIAL_ITERATIONS:
+            self._reasons["moderate"].append(f"{what} {size}")
+    
+    def visit_BinOp(self, node: ast.BinOp):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Mult):
+            # 字符串/列表重复: 'a' * n、x = [0]; x * n
+            for seq, factor in ((node.left, node.right), (node.right, node.left)):
+                if self._is_sequence(seq):
+                    size = self._const_int(factor)
+                    if size is None:
+                        self._reasons["unknown"].append("重复次数取决于输入数据")
+                    elif size >= config.COST_HEAVY_ITERATIONS:
+                        self._reasons["heavy"].append(f"序列重复 {size} 次")
+        elif isinstance(node.op, ast.Mod) and self._is_str_constant(node.left):
+            # '%*d' % (n, 1)、'%900000000d' % 1
+            for match in self.PERCENT_SPEC.finditer(node.left.value):
+                for size in filter(None, match.groups()):
+                    self._record_output_size(None if size == "*" else int(size), "格式宽度")
+        elif isinstance(node.op, ast.Pow):
+            if isinstance(node.right, ast.Constant) and isinstance(node.right.value, float):
+                return  # 浮点幂 (如开方) 为常数时间
+            exponent = self._const_int(node.right)
+            if exponent is None:
+                self._reasons["unknown"].append("幂运算指数取决于输入数据")
+            elif exponent > config.COST_MAX_CONSTANT_OPERAND:
+                self._reasons["heavy"].append(f"幂运算指数过大: {exponent}")
+    
+    # ===== 正则 =====
+    
+    def _regex_call(self, node: ast.Call) -> Optional[tuple]:
+        """正则匹配调用，返回 (模式, 被匹配的字符串)；不是正则匹配时返回 None
+        
+        编译后模式的方法调用使用 re.compile 时的模式，无法确定时模式为 None。
+        """
+        func, args = node.func, list(node.args)
+        name, pattern = None, None
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+            if func.value.id in self._re_modules:
+                name, pattern, args = func.attr, (args[0] if args else None), args[1:]
+            elif func.value.id in self._patterns:
+                name, pattern = func.attr, self._patterns[func.value.id]
+        elif isinstance(func, ast.Name) and func.id in self._re_functions:
+            name, pattern, args = self._re_functions[func.id], (args[0] if args else None), args[1:]
+        if name not in self.REGEX_CALLS:
+            return None
+        
+        keywords = {kw.arg: kw.value for kw in node.keywords}
+        index = 1 if name in ("sub", "subn") else 0  # sub(pattern, repl, string)
+        subject = keywords.get("string", args[index] if len(args) > index else None)
+        return keywords.get("pattern", pattern), subject
+    
+    def _check_regex(self, pattern: Optional[ast.AST], subject: Optional[ast.AST]):
+        if not self._is_str_constant(pattern):
+            self._reasons["unknown"].append("正则表达式取决于输入数据")
+        elif subject is not None and not isinstance(subject, ast.Constant):
+            if self.NESTED_QUANTIFIER.search(pattern.value):
+                self._reasons["unknown"].append(f"嵌套量词的正则可能指数级回溯: {pattern.value}")
+            else:
+                self._reasons["moderate"].append("正则匹配耗时取决于输入数据")
+    
+    # ===== 递归 =====
+    
+    def _check_recursion(self, tree: ast.AST):
+        """函数之间 (含自身) 的调用成环视为递归"""
+        functions = {node.name: node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+        calls = {
+            name: {
+                n.func.id for n in ast.walk(func)
+                if isinstance(n, ast.Call) and isinstance(n.func, ast.Name) and n.func.id in functions
+            }
+            for name, func in functions.items()
+        }
+        
+        def reaches(start: str, target: str, seen: set) -> bool:
+            for callee in calls[start]:
+                if callee == target or (callee not in seen and reaches(callee, target, seen | {callee})):
+                    return True
+            return False
+        
+        for name in functions:
+            if reaches(name, name, {name}):
+                self._reasons["unknown"].append(f"递归调用: {name}")
+    
+    # ===== 常量求值 =====
+    
+    @staticmethod
+    def _is_range(node: ast.AST) -> bool:
+        return isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "range"
+    
+    def _range_size(self, node: ast.Call) -> Optional[int]:
+        values = [self._const_int(arg) for arg in node.args]
+        if not values or any(v is None for v in values):
+            return None
+        start, stop, step = (0, values[0], 1) if len(values) == 1 else (values + [1])[:3]
+        if step == 0:
+            return 0
+        return max(0, (stop - start + step - (1 if step > 0 else -1)) // step)
+    
+    @staticmethod
+    def _is_str_constant(node: Optional[ast.AST]) -> bool:
+        return isinstance(node, ast.Constant) and isinstance(node.value, str)
+    
+    def _collect_bindings(self, tree: ast.AST):
+        """预先收集序列变量、函数别名、re 模块别名和编译后的正则模式 (按名称，不区分作用域)"""
+        self._sequence_names = set()
+        self._aliases = {}  # 局部名称 -> 原函数名 (from time import sleep as nap、nap = time.sleep)
+        self._re_modules, self._re_functions, self._patterns = set(), {}, {}
+        assignments = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                self._re_modules.update(alias.asname or alias.name for alias in node.names if alias.name == "re")
+            elif isinstance(node, ast.ImportFrom):
+                names = {alias.asname or alias.name: alias.name for alias in node.names}
+                self._aliases.update(names)
+                if node.module == "re":
+                    self._re_functions.update(names)
+            elif isinstance(node, ast.arg) and self._is_sequence_annotation(node.annotation):
+                self._sequence_names.add(node.arg)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign, ast.AugAssign)) and node.value is not None:
+                targets = node.targets if isinstance(node, ast.Assign) else [node.target]
+                assignments.append(([t.id for t in targets if isinstance(t, ast.Name)], node))
+        
+        # y = x * 2 依赖 x 的判定，迭代到不再变化
+        changed = True
+        while changed:
+            changed = False
+            for names, node in assignments:
+                if all(name in self._sequence_names for name in names):
+                    continue
+                if self._is_sequence(node.value) or (
+                    isinstance(node, ast.AnnAssign) and self._is_sequence_annotation(node.annotation)
+                ):
+                    self._sequence_names.update(names)
+                    changed = True
+        
+        for names, node in assignments:
+            if isinstance(node, ast.Assign) and isinstance(node.value, ast.Attribute):
+                self._aliases.update({name: node.value.attr for name in names})
+            if isinstance(node.value, ast.Call) and self._is_regex_compile(node.value):
+                call = node.value
+                pattern = call.args[0] if call.args else next((kw.value for kw in call.keywords if kw.arg == "pattern"), None)
+                self._patterns.update({name: pattern for name in names})
+    
+    def _is_regex_compile(self, node: ast.Call) -> bool:
+        func = node.func
+        if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+            return func.value.id in self._re_modules and func.attr == "compile"
+        return isinstance(func, ast.Name) and self._re_functions.get(func.id) == "compile"
+    
+    def _is_sequence_annotation(self, node: Optional[ast.AST]) -> bool:
+        if isinstance(node, ast.Subscript):
+            node = node.value
+        return isinstance(node, ast.Name) and node.id in self.SEQUENCE_ANNOTATIONS
+    
+    def _is_sequence(self, node: ast.AST) -> bool:
+        """表达式是否为序列: 字面量、推导式、f-string、返回序列的调用、序列变量及其拼接/重复/切片"""
+        if isinstance(node, (ast.List, ast.Tuple, ast.ListComp, ast.JoinedStr)):
+            return True
+        if isinstance(node, ast.Constant):
+            return isinstance(node.value, (str, bytes))
+        if isinstance(node, ast.Name):
+            return node.id in self._sequence_names
+        if isinstance(node, ast.Call):
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+            return name in self.SEQUENCE_CALLS
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mult)):
+            return self._is_sequence(node.left) or self._is_sequence(node.right)
+        if isinstance(node, ast.Subscript):
+            return isinstance(node.slice, ast.Slice) and self._is_sequence(node.value)
+        return False
+    
+    def _const_int(self, node: ast.AST) -> Optional[int]:
+        """整数常量表达式求值 (支持 + - * ** 和负号)，非常量返回 None"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, int) and not isinstance(node.value, bool):
+            return node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            value = self._const_int(node.operand)
+            return None if value is None else (-value if isinstance(node.op, ast.USub) else value)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Pow)):
+            left, right = self._const_int(node.left), self._const_int(node.right)
+            if left is None or right is None:
+                return None
+            if isinstance(node.op, ast.Add):
+                return left + right
+            if isinstance(node.op, ast.Sub):
+                return left - right
+            if isinstance(node.op, ast.Mult):
+                return left * right
+            if right < 0:
+                return None
+            # 只需判断是否超过阈值，指数过大时返回上界，避免计算超大整数
+            return left ** right if right <= 64 else 2 ** 64
+        return None
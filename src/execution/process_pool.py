@@ -0,0 +1,269 @@
+"""进程池沙箱模块
+
+生成的代码在预先启动的工作进程中执行，死循环或资源耗尽不会阻塞事件循环和其他会话:
+- 工作进程由单线程的 forkserver 派生 (不从持有事件循环、线程池的主进程 fork)，
+  forkserver 预先导入白名单模块，派生工作进程 (含回收后的替换进程) 无需重新导入；各工作进程各自持有编译缓存
+- 墙钟超时: 父进程等待结果超时后杀死工作进程
+- CPU 超时: 每次执行前在工作进程内设置 RLIMIT_CPU，超限由 SIGXCPU 终止
+- 内存上限: 工作进程启动时设置 RLIMIT_AS (在当前地址空间基础上增加配额)
+- 工作进程执行 N 次后或崩溃/超时后替换为新进程
+resource 模块不可用的平台 (Windows) 仅有墙钟超时。
+"""
+
+import asyncio
+import atexit
+import importlib
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
+from ..infra.config import config
+from ..infra.logger import sandbox_logger
+from .sandbox import SafeExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class SandboxTimeoutError(TimeoutError):
+    """工具执行超时 (墙钟或 CPU 时间)"""
+
+
+class SandboxCrashError(RuntimeError):
+    """工作进程异常退出 (如超出内存上限)"""
+
+
+def _apply_memory_limit(limit_mb: int):
+    """限制工作进程地址空间: 当前大小 + 配额 (当前大小即 forkserver 预加载模块后的地址空间)"""
+    if resource is None or not limit_mb:
+        return
+    try:
+        with open("/proc/self/statm") as f:
+            baseline = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        limit = baseline + limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (OSError, ValueError):
+        pass  # 无法获取当前地址空间大小时不限制内存
+
+
+def _set_cpu_limit(seconds: float):
+    """本次执行的 CPU 时间上限 (RLIMIT_CPU 按进程累计，需在已用时间上叠加)"""
+    if resource is None:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime + seconds) + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    except (OSError, ValueError):
+        pass
+
+
+def _worker_main(conn, memory_limit_mb: int):
+    """工作进程主循环: 接收 ([(代码, 函数名, 参数)], 单项 CPU 时限)，逐项返回 ("ok", 结果) 或 ("error", 错误信息)"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 终端 Ctrl+C 由主进程处理
+    _apply_memory_limit(memory_limit_mb)
+    for name in SafeExecutor.ALLOWED_MODULE_NAMES:
+        importlib.import_module(name)
+    executor = SafeExecutor()
+    
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        
+        calls, cpu_seconds = request
+        replies = []
+        for code, func_name, args in calls:
+            _set_cpu_limit(cpu_seconds)
+            try:
+                replies.append(("ok", executor.execute(code, func_name, args)))
+            except BaseException as e:  # 含 MemoryError / RecursionError
+                replies.append(("error", str(e) or type(e).__name__))
+        try:
+            conn.send(replies)
+        except Exception:
+            conn.send([(status, str(value)) for status, value in replies])  # 结果无法序列化时返回字符串
+
+
+class _Worker:
+    """单个工作进程及其管道"""
+    
+    def __init__(self, context, memory_limit_mb: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.runs = 0
+    
+    def stop(self):
+        """通知退出，未及时退出则强制结束"""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(1)
+        self.kill()
+    
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(1)
+        self.conn.close()
+
+
+class ProcessSandbox:
+    """进程池沙箱执行器"""
+    
+    def __init__(self, pool_size: int = None, timeout: float = None, memory_limit_mb: int = None, max_runs: int = None):
+        self.pool_size = pool_size or config.SANDBOX_POOL_SIZE
+        self.timeout = timeout or config.EXECUTION_TIMEOUT
+        self.memory_limit_mb = config.SANDBOX_MEMORY_LIMIT_MB if memory_limit_mb is None else memory_limit_mb
+        self.max_runs = max_runs or config.SANDBOX_MAX_RUNS_PER_WORKER
+        self._context = self._make_context()
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._threads: Optional[ThreadPoolExecutor] = None  # 每个线程占用一个工作进程等待结果
+        self._lock = threading.Lock()
+        self._stats = Counter()  # runs / batches / batch_fallbacks / timeouts / crashes / recycled
+    
+    @staticmethod
+    def _make_context():
+        """工作进程的启动方式: 优先 forkserver (预加载白名单模块)，不支持的平台使用 spawn
+        
+        主进程在首次使用沙箱时已运行事件循环和各类线程，直接 fork 可能继承其他线程持有的锁，
+        forkserver 进程在启动时只有单个线程，从它派生工作进程是安全的。
+        """
+        if "forkserver" not in multiprocessing.get_all_start_methods():
+            return multiprocessing.get_context("spawn")
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(sorted(SafeExecutor.ALLOWED_MODULE_NAMES) + [__name__])
+        return context
+    
+    def _ensure_started(self) -> ThreadPoolExecutor:
+        """首次使用时启动工作进程 (由 forkserver 派生，首次启动时同时启动 forkserver)"""
+        with self._lock:
+            if self._threads is None:
+                for _ in range(self.pool_size):
+                    self._idle.put(_Worker(self._context, self.memory_limit_mb))
+                self._threads = ThreadPoolExecutor(self.pool_size, thread_name_prefix="sandbox")
+                atexit.register(self.close)
+                sandbox_logger.info(f"进程池沙箱已启动: {self.pool_size} 个工作进程")
+            return self._threads
+    
+    async def execute(self, code: str, func_name: str, args: Optional[dict] = None) -> Any:
+        """在工作进程中执行工具 (不阻塞事件循环)"""
+        threads = self._ensure_started()
+        return await asyncio.get_running_loop().run_in_executor(threads, self.execute_sync, code, func_name, args)
+    
+    def execute_sync(self, code: str, func_name: str, args: Optional[dict] = None) -> Any:
+        """占用一个工作进程执行工具，超时或崩溃时替换该进程"""
+        status, value = self._submit([(code, func_name, args)])[0]
+        if status == "error":
+            raise RuntimeError(value)  # 工具自身抛出的异常，工作进程仍可继续使用
+        return value
+    
+    async def execute_batch(self, calls: List[Tuple[str, str, Optional[dict]]]) -> List[Tuple[Any, Optional[str]]]:
+        """在一个工作进程中一次往返执行多个工具，返回每项的 (结果, 错误信息)"""
+        threads = self._ensure_started()
+        return await asyncio.get_running_loop().run_in_executor(threads, self.execute_batch_sync, calls)
+    
+    def execute_batch_sync(self, calls: List[Tuple[str, str, Optional[dict]]]) -> List[Tuple[Any, Optional[str]]]:
+        """批量执行；整批超时或崩溃时逐项单独执行，只有出问题的工具失败"""
+        try:
+            replies = self._submit(calls)
+        except (SandboxTimeoutError, SandboxCrashError) as e:
+            sandbox_logger.warning(f"批量执行失败 ({e})，逐项重新执行")
+            self._stats["batch_fallbacks"] += 1
+            results = []
+            for code, func_name, args in calls:
+                try:
+                    results.append((self.execute_sync(code, func_name, args), None))
+                except Exception as item_error:
+                    results.append((None, str(item_error)))
+            return results
+        self._stats["batches"] += 1
+        return [(value, None) if status == "ok" else (None, value) for status, value in replies]
+    
+    def _submit(self, calls: List[Tuple[str, str, Optional[dict]]]) -> List[tuple]:
+        """占用一个工作进程执行一组调用，之后归还或替换该进程"""
+        self._ensure_started()
+        worker = self._idle.get()
+        healthy = False
+        try:
+            replies = self._run(worker, calls)
+            healthy = True
+        finally:
+            self._release(worker, healthy)
+        return replies
+    
+    def _run(self, worker: _Worker, calls: List[Tuple[str, str, Optional[dict]]]) -> List[tuple]:
+        """返回每项的 (状态, 结果或错误信息)；超时 (按调用数累计) 或进程崩溃时抛出异常"""
+        self._stats["runs"] += len(calls)
+        worker.runs += len(calls)
+        timeout = self.timeout * len(calls)
+        try:
+            worker.conn.send(([(code, func_name, args or {}) for code, func_name, args in calls], self.timeout))
+            finished = worker.conn.poll(timeout)
+            if finished:
+                replies = worker.conn.recv()
+        except (EOFError, OSError):
+            worker.process.join(1)
+            exitcode = worker.process.exitcode
+            if resource is not None and exitcode == -signal.SIGXCPU:
+                self._stats["timeouts"] += 1
+                raise SandboxTimeoutError(f"CPU 时间超限 (超过 {self.timeout} 秒)")
+            self._stats["crashes"] += 1
+            raise SandboxCrashError(f"沙箱进程异常退出 (exit code {exitcode})")
+        
+        if not finished:
+            self._stats["timeouts"] += 1
+            raise SandboxTimeoutError(f"执行超时 (超过 {timeout} 秒)")
+        return replies
+    
+    def _release(self, worker: _Worker, healthy: bool):
+        """归还工作进程: 异常或达到执行次数上限时替换为新进程"""
+        if healthy and worker.runs < self.max_runs and worker.process.is_alive():
+            self._idle.put(worker)
+            return
+        
+        if healthy:
+            worker.stop()
+        else:
+            worker.kill()
+        self._stats["recycled"] += 1
+        with self._lock:
+            if self._threads is not None:
+                self._idle.put(_Worker(self._context, self.memory_limit_mb))
+    
+    def close(self):
+        """停止所有工作进程 (可再次使用，届时重新启动)"""
+        with self._lock:
+            threads, self._threads = self._threads, None
+        if threads is None:
+            return
+        threads.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+        atexit.unregister(self.close)
+    
+    def stats(self) -> dict:
+        """执行统计"""
+        return dict(self._stats)
+
+
+# 全局进程池沙箱实例
+process_sandbox = ProcessSandbox()
@@ -0,0 +1,49 @@
+"""工具纯度分析模块
+
+基于 AST 判断工具是否为纯函数 (相同代码/参数总是返回相同结果)，
+纯工具的执行结果可以缓存复用，无需再次进入沙箱。
+"""
+
+import ast
+from typing import List, Tuple
+
+
+class PurityAnalyzer:
+    """工具纯度分析器"""
+    
+    # 结果依赖当前时间或随机状态的模块
+    IMPURE_MODULES = {"time", "random", "secrets", "uuid"}
+    
+    # 读取当前时间的方法 (datetime.now / date.today 等)
+    IMPURE_ATTRIBUTES = {"now", "today", "utcnow"}
+    
+    def analyze(self, code: str) -> Tuple[bool, List[str]]:
+        """分析代码纯度，返回 (是否纯函数, 不纯的原因)"""
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            return False, [f"代码语法错误: {e}"]
+        
+        reasons = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.name.split('.')[0] in self.IMPURE_MODULES:
+                        reasons.append(f"导入模块: {alias.name}")
+            
+            elif isinstance(node, ast.ImportFrom):
+                if node.module and node.module.split('.')[0] in self.IMPURE_MODULES:
+                    reasons.append(f"导入模块: {node.module}")
+            
+            elif isinstance(node, ast.Attribute):
+                if node.attr in self.IMPURE_ATTRIBUTES:
+                    reasons.append(f"读取当前时间: .{node.attr}")
+            
+            elif isinstance(node, (ast.Global, ast.Nonlocal)):
+                reasons.append("修改外部状态")
+        
+        return not reasons, reasons
+    
+    def is_pure(self, code: str) -> bool:
+        """是否为纯函数"""
+        return self.analyze(code)[0]
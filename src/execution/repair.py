@@ -0,0 +1,167 @@
+"""安全问题自动修复模块
+
+部分安全检查失败可以在 AST 层面机械修复，无需再次调用 LLM 重新生成:
+- 未使用的禁止模块导入 (如多余的 import os) 直接删除
+- print 语句删除 (沙箱中 print 本就无输出)；参数中有调用等副作用时保留这些参数表达式，
+  夹带的禁止调用仍会被安全检查发现
+- 白名单模块上的 getattr(math, "sqrt") 改写为属性访问 math.sqrt
+修复后重新做安全检查，仍不通过时才交给 LLM 重新生成。
+"""
+
+import ast
+import importlib
+from collections import Counter
+from typing import List, Optional, Tuple
+from .safety import CodeSafetyChecker, safety_checker
+from .sandbox import SafeExecutor
+
+
+class _Transformer(ast.NodeTransformer):
+    """删除语句后块为空时补 pass，保持语法正确 (含 try 语句只剩 finally 的情况)"""
+    
+    def generic_visit(self, node):
+        super().generic_visit(node)
+        body = getattr(node, "body", None)
+        if isinstance(body, list) and not body:
+            body.append(ast.Pass())
+        if isinstance(node, ast.Try) and not node.handlers and not node.finalbody:
+            node.finalbody.append(ast.Pass())
+        return node
+
+
+class _StatementRepairer(_Transformer):
+    """删除 print 语句 (保留有副作用的参数表达式)，改写白名单模块上的 getattr"""
+    
+    def __init__(self, module_aliases: dict):
+        self.module_aliases = module_aliases  # 绑定名 -> 白名单模块名
+        self.fixes: List[str] = []
+    
+    # 求值时可能改变状态的表达式
+    SIDE_EFFECT_NODES = (ast.Call, ast.NamedExpr, ast.Await, ast.Yield, ast.YieldFrom)
+    
+    def visit_Expr(self, node: ast.Expr):
+        call = node.value
+        if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == "print"):
+            return self.generic_visit(node)
+        
+        arguments = [arg.value if isinstance(arg, ast.Starred) else arg for arg in call.args]
+        arguments += [keyword.value for keyword in call.keywords]
+        kept = [arg for arg in arguments if self._has_side_effects(arg)]
+        if not kept:
+            self.fixes.append("删除 print 语句")
+            return None
+        self.fixes.append("print 语句改写为其有副作用的参数表达式")
+        statements = [ast.copy_location(ast.Expr(value=arg), node) for arg in kept]
+        return [self.generic_visit(statement) for statement in statements]
+    
+    def _has_side_effects(self, node: ast.AST) -> bool:
+        return any(isinstance(child, self.SIDE_EFFECT_NODES) for child in ast.walk(node))
+    
+    def visit_Call(self, node: ast.Call):
+        self.generic_visit(node)
+        attribute = self._getattr_target(node)
+        if attribute is None:
+            return node
+        self.fixes.append(f"getattr 改写为属性访问: {node.args[0].id}.{attribute}")
+        return ast.copy_location(ast.Attribute(value=node.args[0], attr=attribute, ctx=ast.Load()), node)
+    
+    def _getattr_target(self, node: ast.Call) -> Optional[str]:
+        """getattr(白名单模块, "常量属性名"[, 默认值]) 且属性存在时返回属性名"""
+        if not (isinstance(node.func, ast.Name) and node.func.id == "getattr"):
+            return None
+        if node.keywords or len(node.args) not in (2, 3):
+            return None
+        target, name = node.args[0], node.args[1]
+        if not (isinstance(target, ast.Name) and target.id in self.module_aliases):
+            return None
+        if not (isinstance(name, ast.Constant) and isinstance(name.value, str)):
+            return None
+        attribute = name.value
+        if not attribute.isidentifier() or attribute.startswith("_"):
+            return None
+        module = importlib.import_module(self.module_aliases[target.id])
+        return attribute if hasattr(module, attribute) else None
+
+
+class _ImportPruner(_Transformer):
+    """删除未使用的禁止模块导入"""
+    
+    def __init__(self, used_names: set):
+        self.used_names = used_names
+        self.fixes: List[str] = []
+    
+    def visit_Import(self, node: ast.Import):
+        kept = []
+        for alias in node.names:
+            bound = alias.asname or alias.name.split('.')[0]
+            if alias.name.split('.')[0] in CodeSafetyChecker.FORBIDDEN_IMPORTS and bound not in self.used_names:
+                self.fixes.append(f"删除未使用的导入: {alias.name}")
+            else:
+                kept.append(alias)
+        if not kept:
+            return None
+        node.names = kept
+        return node
+    
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        if not node.module or node.module.split('.')[0] not in CodeSafetyChecker.FORBIDDEN_IMPORTS:
+            return node
+        # from 导入只要有一个名称被使用就无法删除整条语句，保留由重新生成处理
+        if any((alias.asname or alias.name) in self.used_names for alias in node.names):
+            return node
+        self.fixes.append(f"删除未使用的导入: {node.module}")
+        return None
+
+
+class SafetyRepairer:
+    """安全问题自动修复器"""
+    
+    def __init__(self):
+        self._stats = Counter()  # attempted / saved / failed
+    
+    def repair(self, code: str) -> Tuple[str, List[str]]:
+        """尝试修复代码，返回 (修复后代码, 已应用的修复)；无可修复内容时原样返回"""
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return code, []
+        
+        module_aliases = {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    if alias.name in SafeExecutor.ALLOWED_MODULE_NAMES:
+                        module_aliases[alias.asname or alias.name] = alias.name
+        statements = _StatementRepairer(module_aliases)
+        tree = statements.visit(tree)
+        
+        # 先删除 print 语句，仅被 print 引用的导入随后也可删除
+        used_names = {
+            node.id for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Store)
+        }
+        imports = _ImportPruner(used_names)
+        tree = ast.fix_missing_locations(imports.visit(tree))
+        
+        fixes = imports.fixes + statements.fixes
+        if not fixes:
+            return code, []
+        return ast.unparse(tree), fixes
+    
+    def try_fix(self, code: str) -> Optional[Tuple[str, List[str]]]:
+        """修复并重新检查: 修复后通过安全检查返回 (代码, 修复说明)，否则返回 None"""
+        self._stats["attempted"] += 1
+        repaired, fixes = self.repair(code)
+        if fixes and not safety_checker.check_all(repaired):
+            self._stats["saved"] += 1
+            return repaired, fixes
+        self._stats["failed"] += 1
+        return None
+    
+    def stats(self) -> dict:
+        """修复统计 (saved 即节省的 LLM 重新生成次数)"""
+        return dict(self._stats)
+
+
+# 全局安全修复器实例
+safety_repairer = SafetyRepairer()
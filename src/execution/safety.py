@@ -1,7 +1,46 @@
-"""代码安全检查模块"""
+"""代码安全检查模块
+
+单次 AST 遍历收集全部问题 (禁止导入、禁止调用的内置函数)，不做子串匹配，
+避免 reopen( / re.compile( 之类的误报触发不必要的重新生成。
+检查结果按 (代码哈希, 规则版本) 缓存；判定随工具注册保存在工具文档上，
+复查已注册工具时与当前规则版本一致即可直接使用。
+"""
 
 import ast
-from typing import List
+import hashlib
+import json
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Optional
+from ..infra.config import config
+
+
+class _SafetyVisitor(ast.NodeVisitor):
+    """单次遍历收集安全问题"""
+    
+    def __init__(self, forbidden_imports: set, forbidden_builtins: set):
+        self.forbidden_imports = forbidden_imports
+        self.forbidden_builtins = forbidden_builtins
+        self.issues: List[str] = []
+    
+    def _add(self, issue: str, node: ast.AST):
+        issue = f"{issue} (第 {node.lineno} 行)"
+        if issue not in self.issues:
+            self.issues.append(issue)
+    
+    def visit_Import(self, node: ast.Import):
+        for alias in node.names:
+            if alias.name.split('.')[0] in self.forbidden_imports:
+                self._add(f"禁止导入模块: {alias.name}", node)
+    
+    def visit_ImportFrom(self, node: ast.ImportFrom):
+        if node.module and node.module.split('.')[0] in self.forbidden_imports:
+            self._add(f"禁止导入模块: {node.module}", node)
+    
+    def visit_Call(self, node: ast.Call):
+        if isinstance(node.func, ast.Name) and node.func.id in self.forbidden_builtins:
+            self._add(f"禁止使用函数: {node.func.id}", node)
+        self.generic_visit(node)
 
 
 class CodeSafetyChecker:
@@ -25,54 +64,79 @@ class CodeSafetyChecker:
         "breakpoint", "exit", "quit",
     }
     
-    def check_all(self, code: str) -> List[str]:
-        """执行所有安全检查"""
-        issues = []
-        issues.extend(self._check_imports(code))
-        issues.extend(self._check_builtins(code))
-        issues.extend(self._check_ast(code))
-        return issues
+    # 检查逻辑变更时递增 (禁止列表的变更自动体现在规则版本中)
+    RULES_REVISION = 2
     
-    def _check_imports(self, code: str) -> List[str]:
-        """检查禁止的导入"""
-        issues = []
-        for mod in self.FORBIDDEN_IMPORTS:
-            if f"import {mod}" in code or f"from {mod}" in code:
-                issues.append(f"禁止导入模块: {mod}")
-        return issues
+    def __init__(self, cache_size: int = None):
+        self._cache_size = config.SAFETY_VERDICT_CACHE_SIZE if cache_size is None else cache_size
+        self._verdicts: "OrderedDict[str, tuple]" = OrderedDict()  # 代码哈希:规则版本 -> 问题列表
+        self._lock = threading.Lock()
+        self._stats = Counter()  # hit / check / stored_verdict
+        self.ruleset = self.ruleset_version()
     
-    def _check_builtins(self, code: str) -> List[str]:
-        """检查禁止的内置函数"""
-        issues = []
-        for func in self.FORBIDDEN_BUILTINS:
-            if f"{func}(" in code:
-                issues.append(f"禁止使用函数: {func}")
-        return issues
+    @classmethod
+    def ruleset_version(cls) -> str:
+        """规则版本: 检查逻辑修订号 + 禁止列表的哈希"""
+        rules = json.dumps([cls.RULES_REVISION, sorted(cls.FORBIDDEN_IMPORTS), sorted(cls.FORBIDDEN_BUILTINS)])
+        return hashlib.sha256(rules.encode("utf-8")).hexdigest()[:12]
     
-    def _check_ast(self, code: str) -> List[str]:
-        """AST 深度检查"""
-        issues = []
+    @staticmethod
+    def code_hash(code: str) -> str:
+        return hashlib.sha256(code.encode("utf-8")).hexdigest()
+    
+    def check_all(self, code: str) -> List[str]:
+        """执行所有安全检查，相同代码在同一规则版本下只分析一次"""
+        key = f"{self.code_hash(code)}:{self.ruleset}"
+        with self._lock:
+            cached = self._verdicts.get(key)
+            if cached is not None:
+                self._verdicts.move_to_end(key)
+                self._stats["hit"] += 1
+                return list(cached)
+        
+        issues = self._analyze(code)
+        self._stats["check"] += 1
+        self._remember(key, issues)
+        return list(issues)
+    
+    def _analyze(self, code: str) -> List[str]:
         try:
             tree = ast.parse(code)
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Import):
-                    for alias in node.names:
-                        mod_name = alias.name.split('.')[0]
-                        if mod_name in self.FORBIDDEN_IMPORTS:
-                            issues.append(f"AST检测到禁止导入: {alias.name}")
-                
-                elif isinstance(node, ast.ImportFrom):
-                    if node.module:
-                        mod_name = node.module.split('.')[0]
-                        if mod_name in self.FORBIDDEN_IMPORTS:
-                            issues.append(f"AST检测到禁止导入: {node.module}")
-                
-                elif isinstance(node, ast.Call):
-                    if isinstance(node.func, ast.Name):
-                        if node.func.id in self.FORBIDDEN_BUILTINS:
-                            issues.append(f"AST检测到禁止调用: {node.func.id}")
-                            
         except SyntaxError as e:
-            issues.append(f"代码语法错误: {e}")
-        
+            return [f"代码语法错误: {e}"]
+        visitor = _SafetyVisitor(self.FORBIDDEN_IMPORTS, self.FORBIDDEN_BUILTINS)
+        visitor.visit(tree)
+        return visitor.issues
+    
+    def _remember(self, key: str, issues: List[str]):
+        if self._cache_size <= 0:
+            return
+        with self._lock:
+            self._verdicts[key] = tuple(issues)
+            self._verdicts.move_to_end(key)
+            while len(self._verdicts) > self._cache_size:
+                self._verdicts.popitem(last=False)
+    
+    def verdict(self, code: str) -> dict:
+        """检查结果及其适用范围，随工具注册保存: {"code_hash", "ruleset", "issues"}"""
+        return {"code_hash": self.code_hash(code), "ruleset": self.ruleset, "issues": self.check_all(code)}
+    
+    def check_with_verdict(self, code: str, verdict: Optional[dict]) -> Optional[List[str]]:
+        """已保存的判定与当前代码和规则版本一致时直接使用，返回问题列表；不一致返回 None"""
+        if not verdict or verdict.get("ruleset") != self.ruleset:
+            return None
+        code_hash = self.code_hash(code)
+        if verdict.get("code_hash") != code_hash:
+            return None
+        issues = list(verdict.get("issues") or [])
+        self._stats["stored_verdict"] += 1
+        self._remember(f"{code_hash}:{self.ruleset}", issues)
         return issues
+    
+    def stats(self) -> dict:
+        """检查统计"""
+        return {**self._stats, "entries": len(self._verdicts)}
+
+
+# 全局安全检查器实例
+safety_checker = CodeSafetyChecker()
@@ -2,11 +2,21 @@
 
 import ast
 import builtins
-from typing import Any
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from types import CodeType
+from typing import Any, Iterable, List, Optional, Tuple
+from ..infra.config import config
 
 
 class SafeExecutor:
-    """安全沙箱执行器"""
+    """安全沙箱执行器
+    
+    编译后的代码对象按代码哈希缓存在 LRU 中，复用热门工具省去解析和编译。
+    每次调用都在新的命名空间中执行代码对象，模块级变量、可变默认参数等状态不会在调用
+    (以及会话、用户) 之间共享。
+    """
     
     # 允许的安全模块名称
     ALLOWED_MODULE_NAMES = {
@@ -14,15 +24,40 @@ class SafeExecutor:
         "json", "re", "random", "string"
     }
     
-    def _safe_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+    # 参数 schema 中允许的类型
+    PARAM_TYPES = {
+        "int": int, "integer": int,
+        "float": float, "number": float,
+        "str": str, "string": str,
+        "bool": bool, "boolean": bool,
+    }
+    
+    # 安全内置函数模板 (类级别只构建一次，每次执行持有一份副本)
+    _safe_builtins: Optional[dict] = None
+    
+    def __init__(self, cache_size: int = None):
+        self._cache_size = cache_size or config.EXECUTOR_CACHE_SIZE
+        self._compiled: "OrderedDict[str, Tuple[CodeType, Optional[str]]]" = OrderedDict()  # 代码哈希 -> (代码对象, 首个函数名)
+        self._lock = threading.Lock()  # 同步节点在线程池中执行
+        self._stats = Counter()  # hit / compile
+    
+    @classmethod
+    def _safe_import(cls, name, globals=None, locals=None, fromlist=(), level=0):
         """安全导入函数，只允许白名单模块"""
         module_name = name.split('.')[0]
-        if module_name not in self.ALLOWED_MODULE_NAMES:
+        if module_name not in cls.ALLOWED_MODULE_NAMES:
             raise ImportError(f"禁止导入模块: {name}")
         return __import__(name, globals, locals, fromlist, level)
     
     def _get_safe_builtins(self) -> dict:
-        """获取安全的内置函数"""
+        """获取安全的内置函数 (模板副本，工具代码修改内置函数不影响其他调用)"""
+        if SafeExecutor._safe_builtins is None:
+            SafeExecutor._safe_builtins = self._build_safe_builtins()
+        return dict(SafeExecutor._safe_builtins)
+    
+    @classmethod
+    def _build_safe_builtins(cls) -> dict:
+        """构建安全内置函数模板"""
         return {
             # 常量
             "True": True, 
@@ -61,26 +96,109 @@ class SafeExecutor:
             "format": format,
             "print": lambda *args, **kwargs: None,
             # 安全导入
-            "__import__": self._safe_import,
+            "__import__": cls._safe_import,
         }
     
-    def execute(self, code: str, func_name: str) -> Any:
-        """安全执行代码并返回结果"""
-        safe_globals = {
-            "__builtins__": self._get_safe_builtins(),
-        }
+    @classmethod
+    def coerce_arguments(cls, parameters: dict, arguments: Optional[dict]) -> dict:
+        """按参数 schema 校验并转换实参类型
         
-        exec(code, safe_globals)
+        parameters 形如 {"a": {"type": "int", "description": "..."}} (也接受 {"a": "int"})。
+        缺少必填参数或类型无法转换时抛出 ValueError，schema 之外的实参被忽略。
+        """
+        arguments = arguments or {}
+        coerced = {}
+        for name, schema in (parameters or {}).items():
+            if isinstance(schema, str):
+                schema = {"type": schema}
+            if name not in arguments:
+                if "default" in schema:
+                    continue
+                raise ValueError(f"缺少参数: {name}")
+            
+            value = arguments[name]
+            target = cls.PARAM_TYPES.get(str(schema.get("type", "")).lower())
+            if target is None or isinstance(value, target) and not (target is int and isinstance(value, bool)):
+                coerced[name] = value
+                continue
+            try:
+                if target is bool and isinstance(value, str):
+                    if value.strip().lower() not in ("true", "false", "1", "0"):
+                        raise ValueError(value)
+                    coerced[name] = value.strip().lower() in ("true", "1")
+                elif target is int and isinstance(value, float) and not value.is_integer():
+                    raise ValueError(value)
+                else:
+                    coerced[name] = target(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"参数 {name} 类型错误: 期望 {schema.get('type')}, 实际 {value!r}")
+        return coerced
+    
+    def execute(self, code: str, func_name: str, args: Optional[dict] = None) -> Any:
+        """安全执行代码并返回结果 (args 为关键字参数)"""
+        code_obj, first_func = self._compile(code)
+        namespace = {"__builtins__": self._get_safe_builtins()}
+        exec(code_obj, namespace)
         
-        if func_name not in safe_globals:
-            tree = ast.parse(code)
-            for node in ast.walk(tree):
-                if isinstance(node, ast.FunctionDef):
-                    func_name = node.name
-                    break
+        if func_name not in namespace:
+            func_name = first_func or func_name
         
-        func = safe_globals.get(func_name)
+        func = namespace.get(func_name)
         if not callable(func):
             raise ValueError(f"函数 {func_name} 未找到或不可调用")
         
-        return func()
+        return func(**(args or {}))
+    
+    def execute_batch(self, calls: List[Tuple[str, str, Optional[dict]]]) -> List[Tuple[Any, Optional[str]]]:
+        """依次执行多个工具 [(代码, 函数名, 参数)]，返回每项的 (结果, 错误信息)，单项失败不影响其他项"""
+        results = []
+        for code, func_name, args in calls:
+            try:
+                results.append((self.execute(code, func_name, args), None))
+            except Exception as e:
+                results.append((None, str(e) or type(e).__name__))
+        return results
+    
+    def _compile(self, code: str) -> Tuple[CodeType, Optional[str]]:
+        """获取编译后的代码对象: 命中 LRU 直接返回，否则编译并缓存 (只编译，不执行)"""
+        key = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        with self._lock:
+            entry = self._compiled.get(key)
+            if entry:
+                self._compiled.move_to_end(key)
+                self._stats["hit"] += 1
+                return entry
+        
+        tree = ast.parse(code)
+        code_obj = compile(tree, "<tool>", "exec")
+        first_func = next((node.name for node in ast.walk(tree) if isinstance(node, ast.FunctionDef)), None)
+        
+        with self._lock:
+            self._stats["compile"] += 1
+            self._compiled[key] = (code_obj, first_func)
+            self._compiled.move_to_end(key)
+            while len(self._compiled) > self._cache_size:
+                self._compiled.popitem(last=False)
+        return code_obj, first_func
+    
+    def warm_up(self, tools: Iterable[dict]) -> int:
+        """预编译工具 (启动时加载注册表中的常用工具)，返回成功编译的数量
+        
+        只编译不执行，工具的模块级代码不会在服务进程中运行。
+        """
+        count = 0
+        for tool in tools:
+            try:
+                self._compile(tool["code"])
+                count += 1
+            except Exception:
+                continue  # 无法编译的旧工具在使用时按原流程报错
+        return count
+    
+    def stats(self) -> dict:
+        """编译缓存统计"""
+        return {**self._stats, "entries": len(self._compiled)}
+
+
+# 全局共享执行器实例 (各节点复用编译缓存)
+safe_executor = SafeExecutor()
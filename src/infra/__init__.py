@@ -1,5 +1,6 @@
 """基础设施模块"""
 
 from .config import config
-from .logger import llm_logger, sandbox_logger, safety_logger, registry_logger, workflow_logger
+from .logger import llm_logger, sandbox_logger, safety_logger, registry_logger, workflow_logger, console_to
 from .connection_manager import connection_manager
+from .llm_gateway import llm_gateway
@@ -20,6 +20,19 @@ class Config:
     )
     LLM_MODEL: str = "qwen-plus"  # 通义千问模型
     
+    # LLM 网关配置 (并发、限流、重试、超时)
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    LLM_REQUESTS_PER_MINUTE: int = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+    LLM_TOKENS_PER_MINUTE: int = int(os.getenv("LLM_TOKENS_PER_MINUTE", "100000"))
+    LLM_CHARS_PER_TOKEN: int = 2  # Token 估算: 中文约 1-2 字符/Token
+    LLM_OUTPUT_TOKEN_RESERVE: int = 512  # 估算时为输出预留的 Token 数
+    LLM_MAX_RETRIES: int = 3
+    LLM_BACKOFF_BASE: float = 0.5  # 退避基数 (秒)
+    LLM_BACKOFF_MAX: float = 8.0  # 单次退避上限 (秒)
+    LLM_REQUEST_TIMEOUT: float = 30.0  # 单次 HTTP 请求超时 (秒)
+    LLM_CALL_DEADLINE: float = 60.0  # 单次调用截止时间，含排队与重试 (秒)
+    LLM_JSON_MODE: bool = os.getenv("LLM_JSON_MODE", "true").lower() == "true"  # 结构化输出节点启用 response_format=json_object
+    
     # MongoDB 配置
     MONGODB_URI: str = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
     MONGODB_DB: str = os.getenv("MONGODB_DB", "selftool")
@@ -34,6 +47,111 @@ class Config:
     # 工具生成配置
     MAX_GENERATION_ATTEMPTS: int = 3  # 最大重试次数
     EXECUTION_TIMEOUT: int = 5  # 执行超时 (秒)
+    EXECUTOR_CACHE_SIZE: int = 256  # 编译后工具的 LRU 容量
+    EXECUTOR_WARMUP_TOOLS: int = 64  # 启动时按使用次数预编译的工具数
+    
+    # 沙箱后端: process 在预启动的工作进程中执行 (超时/内存限制)，inline 在当前进程中执行，
+    # auto 按静态成本估计选择 (trivial 进程内执行，其余进程池)
+    SANDBOX_BACKEND: str = os.getenv("SANDBOX_BACKEND", "auto")
+    SANDBOX_POOL_SIZE: int = int(os.getenv("SANDBOX_POOL_SIZE", "4"))  # 工作进程数
+    SANDBOX_MEMORY_LIMIT_MB: int = 256  # 单个工作进程的内存配额 (MB)，0 表示不限制
+    SANDBOX_MAX_RUNS_PER_WORKER: int = 500  # 工作进程执行该次数后替换
+    
+    # 执行成本估计 (SANDBOX_BACKEND=auto 时 trivial 工具在进程内执行，其余交给进程池)
+    COST_TRIVIAL_ITERATIONS: int = 10_000  # 常量循环次数不超过该值视为 trivial
+    COST_HEAVY_ITERATIONS: int = 10_000_000  # 常量循环/序列重复次数达到该值视为 heavy
+    COST_MAX_CONSTANT_OPERAND: int = 10_000  # factorial 参数、幂指数超过该值视为 heavy
+    
+    # 会话记忆配置 (滚动摘要 + 短尾原文)
+    CONVERSATION_TAIL_MESSAGES: int = 4  # Prompt 中保留原文的最近消息数
+    CONVERSATION_SUMMARY_TOKENS: int = 300  # 滚动摘要的 Token 上限
+    CONVERSATION_HISTORY_TOKEN_BUDGET: int = 600  # 原文历史的 Token 上限
+    CONVERSATION_SUMMARY_WAIT: float = 2.0  # 等待上一轮后台摘要完成的最长时间 (秒)
+    CONVERSATION_PENDING_MAX: int = 1024  # 进程内最多保留的后台摘要合并数 (超出时丢弃最早的，消息之后重新合并)
+    
+    # 工具检索配置 (本地相似度索引)
+    TOOL_SEARCH_TOP_K: int = 10  # 相似度召回的候选工具数
+    TOOL_SUMMARY_TOP_K: int = 5  # 写入选择 Prompt 的最多工具数
+    TOOL_SUMMARY_TOKEN_BUDGET: int = 300  # 工具摘要的 Token 上限
+    TOOL_SUMMARY_MAX_DESC_CHARS: int = 80  # 单个工具描述的最大字符数
+    TOOL_USAGE_WEIGHT: float = 0.05  # 排序时使用次数的权重 (乘以 log(1+次数))
+    TOOL_SEARCH_MIN_SCORE: float = 0.05  # 低于该相似度的工具不作为候选
+    # 达到该相似度直接复用，跳过 LLM (相同描述为 1.0；"获取当前时间戳" 对 "获取当前时间" 约 0.86，不应直接复用)
+    TOOL_MATCH_THRESHOLD: float = float(os.getenv("TOOL_MATCH_THRESHOLD", "0.9"))
+    TOOL_INDEX_REFRESH_INTERVAL: float = 5.0  # 检查其他进程是否注册了新工具的间隔 (秒)
+    
+    # 纯工具执行结果缓存 (按代码哈希，AST 判定为纯函数的工具才缓存)
+    TOOL_RESULT_CACHE_ENABLED: bool = os.getenv("TOOL_RESULT_CACHE_ENABLED", "true").lower() == "true"
+    TOOL_RESULT_CACHE_MAX_ENTRIES: int = 1024  # 进程内 LRU 容量
+    TOOL_RESULT_CACHE_DEFAULT_TTL: int = 3600  # 未单独配置分类的默认 TTL (秒)
+    TOOL_RESULT_CACHE_TTL: dict = {
+        "math": 86400,  # 计算结果不随时间变化
+        "datetime": 0,  # 日期类工具即使判定为纯函数也不缓存，避免依赖隐含的当前日期
+    }
+    
+    # 大结果外置存储: 超过阈值的工具结果按内容哈希写入 GridFS (MongoDB 不可用时写本地文件)，
+    # 图状态和 checkpoint 中只保留引用和预览
+    RESULT_BLOB_THRESHOLD: int = int(os.getenv("RESULT_BLOB_THRESHOLD", str(64 * 1024)))  # 字节，0 表示不外置
+    RESULT_PREVIEW_CHARS: int = 500  # 状态中保留的结果预览长度
+    RESULT_BLOB_BUCKET: str = "tool_results"  # GridFS bucket 名称
+    
+    # 服务端配置 (行分隔 JSON over TCP)
+    SERVER_HOST: str = os.getenv("SERVER_HOST", "127.0.0.1")
+    SERVER_PORT: int = int(os.getenv("SERVER_PORT", "8765"))
+    SERVER_MAX_CONCURRENCY: int = int(os.getenv("SERVER_MAX_CONCURRENCY", "16"))  # 同时执行的请求数上限
+    SERVER_DRAIN_TIMEOUT: float = 30.0  # 关闭时等待在途请求完成的上限 (秒)
+    
+    # 合并模式: 一次 LLM 调用同时完成需求分析和任务规划
+    COMBINED_ANALYZE_PLAN: bool = os.getenv("COMBINED_ANALYZE_PLAN", "false").lower() == "true"
+    
+    # 推测生成: 工具选择判断期间并行生成新工具 (按分类统计命中率)
+    SPECULATIVE_GENERATION: bool = os.getenv("SPECULATIVE_GENERATION", "false").lower() == "true"
+    SPECULATIVE_CATEGORIES: set = set()  # 为空表示所有分类都可推测
+    SPECULATION_MIN_SAMPLES: int = 20  # 统计样本达到该数量后才按命中率自动关闭
+    SPECULATION_MIN_PAYOFF_RATE: float = 0.3  # 近期命中率低于该值的分类停止推测
+    SPECULATION_WINDOW: int = 50  # 命中率按最近 N 次推测计算
+    SPECULATION_EXPLORE_RATE: float = 0.05  # 已停止推测的分类仍以该概率推测，命中率回升后恢复
+    
+    # 批量生成: 同一波中多个在注册表未命中的任务，一次 LLM 调用生成全部工具规格
+    BATCH_GENERATION: bool = os.getenv("BATCH_GENERATION", "true").lower() == "true"
+    BATCH_GENERATION_MIN_TASKS: int = 2  # 未命中任务达到该数量才批量生成
+    
+    # 批量执行: 同一波中多个直接命中已注册工具的任务，一次沙箱往返执行全部工具
+    BATCH_EXECUTION: bool = os.getenv("BATCH_EXECUTION", "true").lower() == "true"
+    BATCH_EXECUTION_MIN_TASKS: int = 2  # 直接命中的任务达到该数量才批量执行
+    
+    # 生成去重 (singleflight): 相同任务描述+分类的并发首次生成只调用一次 LLM
+    GENERATION_SINGLEFLIGHT: bool = os.getenv("GENERATION_SINGLEFLIGHT", "true").lower() == "true"
+    SINGLEFLIGHT_LOCK_TTL: int = 120  # 跨进程锁过期时间 (秒)，需大于单次生成耗时
+    SINGLEFLIGHT_RESULT_TTL: int = 60  # leader 结果在 Redis 中的保留时间 (秒)
+    SINGLEFLIGHT_WAIT_TIMEOUT: float = 90.0  # follower 等待其他进程结果的上限 (秒)
+    SINGLEFLIGHT_POLL_INTERVAL: float = 0.2  # follower 轮询 Redis 的间隔 (秒)
+    
+    # 安全问题自动修复: 未使用的禁止导入、print、白名单模块 getattr 在 AST 层修复，修复后通过则不再重新生成
+    SAFETY_AUTO_REPAIR: bool = os.getenv("SAFETY_AUTO_REPAIR", "true").lower() == "true"
+    
+    # 安全检查结果缓存: 按 (代码哈希, 规则版本) 缓存，相同代码重复检查时直接返回
+    SAFETY_VERDICT_CACHE_SIZE: int = 1024
+    
+    # 生成失败负缓存: 多次重试仍失败的任务描述+分类在 TTL 内直接快速拒绝
+    NEGATIVE_CACHE_ENABLED: bool = os.getenv("NEGATIVE_CACHE_ENABLED", "true").lower() == "true"
+    NEGATIVE_CACHE_TTL: int = int(os.getenv("NEGATIVE_CACHE_TTL", "1800"))  # 失败记录保留时间 (秒)
+    NEGATIVE_CACHE_MAX_ENTRIES: int = 1024  # 进程内记录上限
+    
+    # LLM 响应缓存配置 (进程内 LRU + Redis)
+    LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    LLM_CACHE_MAX_ENTRIES: int = 512  # 进程内 LRU 容量
+    LLM_CACHE_DEFAULT_TTL: int = 600  # 未单独配置节点的默认 TTL (秒)
+    LLM_CACHE_TTL: dict = {
+        "analyze": 600,
+        "analyze_plan": 600,
+        "plan_tasks": 3600,
+        "search": 300,  # 工具列表会随注册变化，TTL 较短
+        "generate": 86400,  # 生成结果在工具未通过安全检查或执行失败时删除
+        "generate_batch": 86400,
+        "format_response": 600,
+    }
+    LLM_CACHE_BYPASS: set = {"should_continue"}  # 迭代判断需基于最新结果实时决策，不走缓存
 
 
 config = Config()
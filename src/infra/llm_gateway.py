@@ -0,0 +1,243 @@
+"""LLM 网关模块
+
+所有节点的 LLM 调用统一经过网关: 并发上限、请求数/Token 数令牌桶限流、
+可重试错误的抖动指数退避，以及单次调用的截止时间。
+"""
+
+import asyncio
+import random
+import time
+from typing import AsyncIterator, List, Optional
+import openai
+from langchain_core.messages import BaseMessage
+from langchain_openai import ChatOpenAI
+from .config import config
+from .logger import llm_logger
+
+
+# 可重试的错误: 限流、超时、连接失败、服务端错误
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    asyncio.TimeoutError,
+)
+
+
+class TokenBucket:
+    """令牌桶限流器 (按分钟配额匀速补充)"""
+    
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0  # 每秒补充量
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _refill(self):
+        """按流逝时间补充令牌"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    async def acquire(self, amount: float = 1) -> float:
+        """获取令牌，不足时等待，返回等待秒数"""
+        amount = min(amount, self.capacity)  # 单次请求超过配额时按满额处理，避免永久等待
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                delay = (amount - self.tokens) / self.rate
+                waited += delay
+                await asyncio.sleep(delay)
+
+
+class LLMGateway:
+    """LLM 调用网关"""
+    
+    TEMPERATURE = 0.2
+    
+    def __init__(self):
+        self._client: Optional[ChatOpenAI] = None
+        self._json_client = None
+        self._semaphore = asyncio.Semaphore(config.LLM_MAX_CONCURRENCY)
+        self._request_bucket = TokenBucket(config.LLM_REQUESTS_PER_MINUTE)
+        self._token_bucket = TokenBucket(config.LLM_TOKENS_PER_MINUTE)
+        self._metrics = {
+            "calls": 0,
+            "retries": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "queue_depth": 0,
+            "max_queue_depth": 0,
+            "in_flight": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "rate_limit_wait_ms": 0.0,
+        }
+    
+    @property
+    def client(self) -> ChatOpenAI:
+        """获取 LLM 客户端 (阿里云 DashScope)，首次使用时创建"""
+        if self._client is None:
+            self._client = ChatOpenAI(
+                model=config.LLM_MODEL,
+                api_key=config.DASHSCOPE_API_KEY,
+                base_url=config.DASHSCOPE_BASE_URL,
+                temperature=self.TEMPERATURE,
+                timeout=config.LLM_REQUEST_TIMEOUT,
+                max_retries=0,  # 重试由网关统一处理
+            )
+        return self._client
+    
+    def _runnable(self, json_mode: bool):
+        """选择调用对象: JSON 模式下绑定 response_format，要求服务端只输出合法 JSON 对象"""
+        if not (json_mode and config.LLM_JSON_MODE):
+            return self.client
+        if self._json_client is None:
+            self._json_client = self.client.bind(response_format={"type": "json_object"})
+        return self._json_client
+    
+    # 模型与温度不依赖客户端实例: 计算缓存键 (含缓存命中) 时无需创建客户端
+    @property
+    def model_name(self) -> str:
+        return config.LLM_MODEL
+    
+    @property
+    def temperature(self) -> float:
+        return self.TEMPERATURE
+    
+    @staticmethod
+    def _estimate_tokens(messages: List[BaseMessage]) -> int:
+        """粗略估算请求 Token 数 (Prompt + 预留输出)"""
+        chars = sum(len(str(m.content)) for m in messages)
+        return chars // config.LLM_CHARS_PER_TOKEN + config.LLM_OUTPUT_TOKEN_RESERVE
+    
+    async def _acquire_slot(self, tokens: int):
+        """排队获取并发槽位并通过限流，记录等待时间"""
+        self._metrics["queue_depth"] += 1
+        self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._metrics["queue_depth"])
+        start = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._metrics["queue_depth"] -= 1
+        
+        try:
+            limited = await self._request_bucket.acquire(1)
+            limited += await self._token_bucket.acquire(tokens)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        
+        wait_ms = (time.perf_counter() - start) * 1000
+        self._metrics["total_wait_ms"] += wait_ms
+        self._metrics["max_wait_ms"] = max(self._metrics["max_wait_ms"], wait_ms)
+        self._metrics["rate_limit_wait_ms"] += limited * 1000
+        self._metrics["in_flight"] += 1
+    
+    def _release_slot(self):
+        self._metrics["in_flight"] -= 1
+        self._semaphore.release()
+    
+    @staticmethod
+    def _backoff_delay(attempt: int) -> float:
+        """抖动指数退避 (full jitter)"""
+        ceiling = min(config.LLM_BACKOFF_MAX, config.LLM_BACKOFF_BASE * (2 ** attempt))
+        return random.uniform(0, ceiling)
+    
+    async def ainvoke(self, messages: List[BaseMessage], timeout: float = None, json_mode: bool = False):
+        """调用 LLM，超过截止时间抛出 asyncio.TimeoutError"""
+        deadline = time.monotonic() + (timeout or config.LLM_CALL_DEADLINE)
+        tokens = self._estimate_tokens(messages)
+        self._metrics["calls"] += 1
+        
+        for attempt in range(config.LLM_MAX_RETRIES + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            
+            try:
+                await asyncio.wait_for(self._acquire_slot(tokens), remaining)
+            except asyncio.TimeoutError:
+                break
+            try:
+                return await asyncio.wait_for(self._runnable(json_mode).ainvoke(messages), deadline - time.monotonic())
+            except RETRYABLE_ERRORS as e:
+                error = e
+            finally:
+                self._release_slot()
+            
+            delay = self._backoff_delay(attempt)
+            if attempt == config.LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                break
+            self._metrics["retries"] += 1
+            llm_logger.warning(f"LLM 调用失败 ({type(error).__name__})，{delay:.2f}s 后第 {attempt + 1} 次重试")
+            await asyncio.sleep(delay)
+        
+        raise self._fail(deadline)
+    
+    async def astream(self, messages: List[BaseMessage], timeout: float = None, json_mode: bool = False) -> AsyncIterator:
+        """流式调用 LLM；仅在尚未产出任何内容时重试"""
+        deadline = time.monotonic() + (timeout or config.LLM_CALL_DEADLINE)
+        tokens = self._estimate_tokens(messages)
+        self._metrics["calls"] += 1
+        
+        for attempt in range(config.LLM_MAX_RETRIES + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            
+            try:
+                await asyncio.wait_for(self._acquire_slot(tokens), remaining)
+            except asyncio.TimeoutError:
+                break
+            started = False
+            try:
+                stream = self._runnable(json_mode).astream(messages).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), deadline - time.monotonic())
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield chunk
+            except RETRYABLE_ERRORS as e:
+                if started:
+                    raise
+                error = e
+            finally:
+                self._release_slot()
+            
+            delay = self._backoff_delay(attempt)
+            if attempt == config.LLM_MAX_RETRIES or time.monotonic() + delay >= deadline:
+                break
+            self._metrics["retries"] += 1
+            llm_logger.warning(f"LLM 流式调用失败 ({type(error).__name__})，{delay:.2f}s 后第 {attempt + 1} 次重试")
+            await asyncio.sleep(delay)
+        
+        raise self._fail(deadline)
+    
+    def _fail(self, deadline: float) -> asyncio.TimeoutError:
+        """记录失败指标，返回重试耗尽或超过截止时间的异常"""
+        if time.monotonic() >= deadline:
+            self._metrics["timeouts"] += 1
+        self._metrics["failures"] += 1
+        llm_logger.error("LLM 调用失败: 重试耗尽或超过截止时间")
+        return asyncio.TimeoutError("LLM 调用失败: 重试耗尽或超过截止时间")
+    
+    def metrics(self) -> dict:
+        """获取网关指标 (队列深度、等待时间等)"""
+        acquired = self._metrics["calls"] + self._metrics["retries"]
+        return {
+            **self._metrics,
+            "avg_wait_ms": round(self._metrics["total_wait_ms"] / acquired, 3) if acquired else 0.0,
+        }
+
+
+# 全局 LLM 网关实例
+llm_gateway = LLMGateway()
@@ -1,9 +1,11 @@
 """日志模块"""
 
+import contextlib
 import logging
 import sys
 from datetime import datetime
 from pathlib import Path
+from typing import List, TextIO
 
 # 创建日志目录
 LOG_DIR = Path(__file__).parent.parent / "logs"
@@ -13,6 +15,9 @@ LOG_DIR.mkdir(exist_ok=True)
 DETAILED_FORMAT = "%(asctime)s | %(levelname)-8s | %(name)-20s | %(message)s"
 SIMPLE_FORMAT = "%(levelname)-8s | %(message)s"
 
+# 各 logger 的控制台 handler (创建时绑定了当时的 sys.stdout，redirect_stdout 无法改变其输出)
+_console_handlers: List[logging.StreamHandler] = []
+
 
 def setup_logger(name: str, level: int = logging.DEBUG) -> logging.Logger:
     """创建并配置 logger"""
@@ -28,6 +33,7 @@ def setup_logger(name: str, level: int = logging.DEBUG) -> logging.Logger:
     console_handler.setLevel(logging.DEBUG)
     console_handler.setFormatter(logging.Formatter(DETAILED_FORMAT))
     logger.addHandler(console_handler)
+    _console_handlers.append(console_handler)
     
     # 文件 handler
     log_file = LOG_DIR / f"selftool_{datetime.now().strftime('%Y%m%d')}.log"
@@ -39,6 +45,19 @@ def setup_logger(name: str, level: int = logging.DEBUG) -> logging.Logger:
     return logger
 
 
+@contextlib.contextmanager
+def console_to(stream: TextIO):
+    """临时把控制台日志输出到指定流 (批处理时 stdout 只输出结果)"""
+    previous = [handler.stream for handler in _console_handlers]
+    for handler in _console_handlers:
+        handler.setStream(stream)
+    try:
+        yield
+    finally:
+        for handler, old_stream in zip(_console_handlers, previous):
+            handler.setStream(old_stream)
+
+
 # 预定义的 loggers
 llm_logger = setup_logger("LLM")
 sandbox_logger = setup_logger("SANDBOX")
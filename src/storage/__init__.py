@@ -3,3 +3,8 @@
 from .cache import tool_cache
 from .checkpointer import checkpointer
 from .registry import tool_registry, TOOLS_DIR
+from .llm_cache import llm_cache
+from .singleflight import generation_flight
+from .result_cache import tool_result_cache
+from .negative_cache import negative_cache
+from .blob_store import blob_store
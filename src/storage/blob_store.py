@@ -0,0 +1,120 @@
+"""大结果外置存储模块 (GridFS + 本地文件)
+
+超过阈值的工具结果按内容哈希 (sha256) 只存储一次，图状态中只保留引用和预览，
+避免 checkpoint 在每个 superstep 重复序列化大字符串。
+MongoDB 可用时写入 GridFS，否则写入本地 blobs 目录；读取时依次查询两者。
+"""
+
+import hashlib
+import os
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Tuple
+import gridfs
+from ..infra.config import config
+from ..infra.connection_manager import connection_manager
+
+# 本地存储目录 (项目根目录/blobs)，首次写入时创建
+BLOBS_DIR = Path(__file__).parent.parent.parent / "blobs"
+
+
+class BlobStore:
+    """内容寻址的工具结果存储"""
+    
+    def __init__(self, local_dir: Path = None):
+        self.local_dir = Path(local_dir) if local_dir else BLOBS_DIR
+        self._stats = Counter()  # stored / dedup / fetched / missing
+    
+    def _get_bucket(self) -> Optional[gridfs.GridFSBucket]:
+        """获取 GridFS bucket（通过连接管理器）"""
+        db = connection_manager.db.get_database()
+        if db is None:
+            return None
+        return gridfs.GridFSBucket(db, bucket_name=config.RESULT_BLOB_BUCKET)
+    
+    @staticmethod
+    def make_ref(value: str) -> str:
+        """内容哈希作为引用"""
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def preview(value: str) -> str:
+        """状态中保留的结果预览"""
+        return value[:config.RESULT_PREVIEW_CHARS] + f"... (共 {len(value)} 字符，完整结果已外置存储)"
+    
+    def offload(self, value: str) -> Tuple[str, Optional[str]]:
+        """结果超过阈值时外置存储，返回 (预览, 引用)；未超过阈值或存储失败时返回 (原值, None)"""
+        if not config.RESULT_BLOB_THRESHOLD or len(value.encode("utf-8")) <= config.RESULT_BLOB_THRESHOLD:
+            return value, None
+        ref = self.put(value)
+        if ref is None:
+            return value, None
+        return self.preview(value), ref
+    
+    def put(self, value: str) -> Optional[str]:
+        """按内容哈希写入 (已存在时跳过)，返回引用；GridFS 和本地均写入失败时返回 None"""
+        ref = self.make_ref(value)
+        data = value.encode("utf-8")
+        
+        bucket = self._get_bucket()
+        if bucket is not None:
+            try:
+                if next(bucket.find({"_id": ref}).limit(1), None) is not None:
+                    self._stats["dedup"] += 1
+                else:
+                    bucket.upload_from_stream_with_id(ref, ref, data)
+                    self._stats["stored"] += 1
+                return ref
+            except Exception:
+                pass  # GridFS 写入失败时写本地文件
+        
+        path = self._local_path(ref)
+        if path.exists():
+            self._stats["dedup"] += 1
+            return ref
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)  # 原子替换，并发写入相同内容时不会读到半个文件
+            self._stats["stored"] += 1
+            return ref
+        except OSError:
+            return None
+    
+    def get(self, ref: str) -> Optional[str]:
+        """按引用读取完整结果，依次查询 GridFS 和本地文件"""
+        bucket = self._get_bucket()
+        if bucket is not None:
+            try:
+                value = bucket.open_download_stream(ref).read().decode("utf-8")
+                self._stats["fetched"] += 1
+                return value
+            except Exception:
+                pass
+        
+        try:
+            value = self._local_path(ref).read_text(encoding="utf-8")
+            self._stats["fetched"] += 1
+            return value
+        except OSError:
+            self._stats["missing"] += 1
+            return None
+    
+    def resolve(self, value: str, ref: Optional[str]) -> str:
+        """有引用时返回完整结果，读取失败时退回预览"""
+        if not ref:
+            return value
+        full = self.get(ref)
+        return value if full is None else full
+    
+    def _local_path(self, ref: str) -> Path:
+        return self.local_dir / ref[:2] / ref
+    
+    def stats(self) -> dict:
+        """存储统计"""
+        return dict(self._stats)
+
+
+# 全局结果存储实例
+blob_store = BlobStore()
@@ -10,6 +10,9 @@ from ..infra.connection_manager import connection_manager
 class ToolCache:
     """工具缓存管理器 (Redis)"""
     
+    # 不使用 tool: 前缀，避免被当作工具扫描
+    REGISTRY_VERSION_KEY = "registry:version"
+    
     def _get_client(self) -> Optional[redis.Redis]:
         """获取 Redis 客户端（通过连接管理器）"""
         return connection_manager.cache.get_client()
@@ -45,6 +48,44 @@ class ToolCache:
         except Exception:
             return False
     
+    def list_tools(self) -> list:
+        """列出全部缓存的工具 (MongoDB 不可用时构建相似度索引)"""
+        client = self._get_client()
+        if not client:
+            return []
+        
+        try:
+            tools = []
+            for key in client.keys("tool:*"):
+                data = client.get(key)
+                if data:
+                    tools.append(json.loads(data))
+            return tools
+        except Exception:
+            return []
+    
+    def get_registry_version(self) -> Optional[int]:
+        """工具注册版本号 (每次注册递增，用于各进程刷新相似度索引)；Redis 不可用时返回 None"""
+        client = self._get_client()
+        if not client:
+            return None
+        
+        try:
+            return int(client.get(self.REGISTRY_VERSION_KEY) or 0)
+        except Exception:
+            return None
+    
+    def bump_registry_version(self) -> Optional[int]:
+        """注册工具时递增版本号，返回新版本号；Redis 不可用时返回 None"""
+        client = self._get_client()
+        if not client:
+            return None
+        
+        try:
+            return int(client.incr(self.REGISTRY_VERSION_KEY))
+        except Exception:
+            return None
+    
     def search_by_category(self, category: str) -> list:
         """按分类搜索缓存的工具"""
         client = self._get_client()
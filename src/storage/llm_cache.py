@@ -0,0 +1,141 @@
+"""LLM 响应缓存模块 (进程内 LRU + Redis 两级缓存)"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict, defaultdict
+from typing import Optional
+import redis
+from ..infra.config import config
+from ..infra.connection_manager import connection_manager
+
+
+class LLMResponseCache:
+    """LLM 响应缓存管理器
+    
+    缓存键由模型、温度和 Prompt 哈希组成；先查进程内 LRU，未命中再查 Redis，
+    Redis 命中后回填 LRU。每个节点使用独立的 TTL 策略，并统计命中情况。
+    """
+    
+    KEY_PREFIX = "llm:"
+    
+    def __init__(self, max_entries: int = None):
+        self._max_entries = max_entries or config.LLM_CACHE_MAX_ENTRIES
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (过期时间戳, 响应内容)
+        self._stats = defaultdict(lambda: {"memory_hit": 0, "redis_hit": 0, "miss": 0, "bypass": 0, "evicted": 0})
+    
+    def _get_client(self) -> Optional[redis.Redis]:
+        """获取 Redis 客户端（通过连接管理器）"""
+        return connection_manager.cache.get_client()
+    
+    @staticmethod
+    def make_key(model: str, temperature: float, prompt: str) -> str:
+        """生成缓存键: 模型 + 温度 + Prompt 哈希"""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return f"{model}:{temperature}:{digest}"
+    
+    def ttl_for(self, node: str) -> int:
+        """获取节点的缓存 TTL (秒)，0 表示不缓存"""
+        if not config.LLM_CACHE_ENABLED or node in config.LLM_CACHE_BYPASS:
+            return 0
+        return config.LLM_CACHE_TTL.get(node, config.LLM_CACHE_DEFAULT_TTL)
+    
+    def get(self, node: str, key: str) -> Optional[str]:
+        """读取缓存，依次查询 LRU 和 Redis"""
+        if self.ttl_for(node) <= 0:
+            self._stats[node]["bypass"] += 1
+            return None
+        
+        entry = self._lru.get(key)
+        if entry:
+            expires_at, content = entry
+            if expires_at > time.time():
+                self._lru.move_to_end(key)
+                self._stats[node]["memory_hit"] += 1
+                return content
+            self._lru.pop(key, None)
+        
+        client = self._get_client()
+        if client:
+            try:
+                data = client.get(self.KEY_PREFIX + key)
+                if data:
+                    content = json.loads(data)["content"]
+                    remaining = client.ttl(self.KEY_PREFIX + key)
+                    self._put_memory(key, content, remaining if remaining > 0 else self.ttl_for(node))
+                    self._stats[node]["redis_hit"] += 1
+                    return content
+            except Exception:
+                pass
+        
+        self._stats[node]["miss"] += 1
+        return None
+    
+    def set(self, node: str, key: str, content: str) -> bool:
+        """写入缓存 (LRU + Redis)"""
+        ttl = self.ttl_for(node)
+        if ttl <= 0:
+            return False
+        
+        self._put_memory(key, content, ttl)
+        
+        client = self._get_client()
+        if not client:
+            return False
+        
+        try:
+            payload = json.dumps({"node": node, "content": content}, ensure_ascii=False)
+            client.setex(self.KEY_PREFIX + key, ttl, payload)
+            return True
+        except Exception:
+            return False
+    
+    def evict(self, node: str, key: str):
+        """删除缓存条目 (响应已证实不可用，如生成的工具未通过安全检查或执行失败)"""
+        if self._lru.pop(key, None) is not None:
+            self._stats[node]["evicted"] += 1
+        
+        client = self._get_client()
+        if client:
+            try:
+                client.delete(self.KEY_PREFIX + key)
+            except Exception:
+                pass
+    
+    def _put_memory(self, key: str, content: str, ttl: int):
+        """写入进程内 LRU，超出容量时淘汰最久未使用的条目"""
+        self._lru[key] = (time.time() + ttl, content)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self._max_entries:
+            self._lru.popitem(last=False)
+    
+    def stats(self) -> dict:
+        """获取各节点的命中统计"""
+        report = {}
+        for node, counters in self._stats.items():
+            lookups = counters["memory_hit"] + counters["redis_hit"] + counters["miss"]
+            hits = counters["memory_hit"] + counters["redis_hit"]
+            report[node] = {
+                **counters,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            }
+        return report
+    
+    def clear(self) -> bool:
+        """清除所有 LLM 响应缓存"""
+        self._lru.clear()
+        client = self._get_client()
+        if not client:
+            return False
+        
+        try:
+            keys = client.keys(f"{self.KEY_PREFIX}*")
+            if keys:
+                client.delete(*keys)
+            return True
+        except Exception:
+            return False
+
+
+# 全局 LLM 响应缓存实例
+llm_cache = LLMResponseCache()
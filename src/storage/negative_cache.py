@@ -0,0 +1,127 @@
+"""生成失败负缓存模块 (进程内 + Redis)
+
+任务经过最大重试次数仍被安全检查拒绝时记录拒绝原因 (只记录确定性的结果，
+超时、未生成有效规格等偶发失败不记录)，TTL 内相同任务描述+分类且检索未命中已有工具的请求
+直接快速拒绝，不再重复消耗多次 LLM 生成。
+Redis 不可用时仅在进程内生效。
+"""
+
+import hashlib
+import json
+import re
+import time
+from collections import Counter
+from typing import Dict, Optional
+import redis
+from ..infra.config import config
+from ..infra.connection_manager import connection_manager
+
+
+class NegativeCache:
+    """生成失败的任务记录"""
+    
+    KEY_PREFIX = "negative:"
+    
+    def __init__(self, max_entries: int = None):
+        self._max_entries = max_entries or config.NEGATIVE_CACHE_MAX_ENTRIES
+        self._memory: Dict[str, tuple] = {}  # key -> (过期时间戳, 失败记录)
+        self._stats = Counter()  # hit / miss / record
+    
+    def _get_client(self) -> Optional[redis.Redis]:
+        """获取 Redis 客户端（通过连接管理器）"""
+        return connection_manager.cache.get_client()
+    
+    @staticmethod
+    def make_key(description: str, category: str) -> str:
+        """失败记录键: 任务描述忽略大小写、空白和句末标点 + 分类
+        
+        运算符和句中标点保留: "计算 7+5" 的失败不能拒绝 "计算 7-5"。
+        """
+        normalized = re.sub(r"\s+", "", description.lower()).rstrip("。．.！!？?；;")
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+        return f"{category}:{digest}"
+    
+    def get(self, description: str, category: str) -> Optional[dict]:
+        """查询失败记录 {"reason", "stage", "failed_at"}，无记录或已过期返回 None"""
+        record = self.peek(description, category)
+        if config.NEGATIVE_CACHE_ENABLED:
+            self._stats["hit" if record else "miss"] += 1
+        return record
+    
+    def peek(self, description: str, category: str) -> Optional[dict]:
+        """查询失败记录但不计入命中统计 (用于分发、推测等预判)"""
+        if not config.NEGATIVE_CACHE_ENABLED:
+            return None
+        key = self.make_key(description, category)
+        
+        entry = self._memory.get(key)
+        if entry:
+            expires_at, record = entry
+            if expires_at > time.time():
+                return record
+            self._memory.pop(key, None)
+        
+        client = self._get_client()
+        if client:
+            try:
+                data = client.get(self.KEY_PREFIX + key)
+                if data:
+                    record = json.loads(data)
+                    remaining = client.ttl(self.KEY_PREFIX + key)
+                    self._put_memory(key, record, remaining if remaining > 0 else config.NEGATIVE_CACHE_TTL)
+                    return record
+            except Exception:
+                pass
+        return None
+    
+    def record(self, description: str, category: str, reason: str, stage: str) -> bool:
+        """记录失败 (stage: reject 安全检查拒绝 / fail 执行失败)"""
+        if not config.NEGATIVE_CACHE_ENABLED:
+            return False
+        key = self.make_key(description, category)
+        record = {"reason": reason, "stage": stage, "failed_at": time.time()}
+        
+        self._put_memory(key, record, config.NEGATIVE_CACHE_TTL)
+        self._stats["record"] += 1
+        
+        client = self._get_client()
+        if not client:
+            return False
+        
+        try:
+            client.setex(self.KEY_PREFIX + key, config.NEGATIVE_CACHE_TTL, json.dumps(record, ensure_ascii=False))
+            return True
+        except Exception:
+            return False
+    
+    def clear(self, description: str, category: str):
+        """清除失败记录 (相同任务已成功生成工具)"""
+        key = self.make_key(description, category)
+        if self._memory.pop(key, None):
+            self._stats["clear"] += 1
+        
+        client = self._get_client()
+        if client:
+            try:
+                client.delete(self.KEY_PREFIX + key)
+            except Exception:
+                pass
+    
+    def _put_memory(self, key: str, record: dict, ttl: int):
+        """写入进程内记录，超出容量时先清理过期条目，仍超出则淘汰最早写入的条目"""
+        self._memory.pop(key, None)
+        self._memory[key] = (time.time() + ttl, record)
+        if len(self._memory) > self._max_entries:
+            now = time.time()
+            for k in [k for k, (expires_at, _) in self._memory.items() if expires_at <= now]:
+                del self._memory[k]
+            while len(self._memory) > self._max_entries:
+                del self._memory[next(iter(self._memory))]
+    
+    def stats(self) -> dict:
+        """获取命中统计"""
+        return {**self._stats, "entries": len(self._memory)}
+
+
+# 全局生成失败负缓存实例
+negative_cache = NegativeCache()
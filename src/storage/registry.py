@@ -1,9 +1,12 @@
 """MongoDB 工具注册模块"""
 
-from typing import Optional, List
+import math
+import time
+from typing import Dict, Optional, List, Tuple
 from pathlib import Path
 from ..infra.config import config
 from .cache import tool_cache
+from .tool_index import ToolIndex
 from ..infra.connection_manager import connection_manager
 
 # 工具文件存储目录 (项目根目录/tools)
@@ -11,9 +14,29 @@ TOOLS_DIR = Path(__file__).parent.parent.parent / "tools"
 TOOLS_DIR.mkdir(exist_ok=True)
 
 
+def format_signature(tool: dict) -> str:
+    """工具签名文本，如 multiply(a: int, b: int)；无参数工具只返回名称"""
+    parameters = tool.get("parameters") or {}
+    if not parameters:
+        return tool["name"]
+    params = ", ".join(
+        f"{name}: {schema.get('type', 'str') if isinstance(schema, dict) else schema}"
+        for name, schema in parameters.items()
+    )
+    return f"{tool['name']}({params})"
+
+
 class ToolRegistry:
     """工具注册管理器 (MongoDB)"""
     
+    def __init__(self):
+        self._index = ToolIndex()
+        self._index_loaded = False  # 已从 MongoDB 加载全部工具
+        self._index_version = 0  # 索引已包含的注册版本号
+        self._index_checked_at: Optional[float] = None  # 上次检查注册版本号的时间
+        self._usage: Dict[str, int] = {}  # 工具名 -> 复用次数
+        self._summary_fragments: Dict[str, str] = {}  # 工具名 -> 预渲染摘要片段
+    
     def _get_collection(self):
         """获取集合（通过连接管理器）"""
         return connection_manager.db.get_collection()
@@ -23,13 +46,19 @@ class ToolRegistry:
         return connection_manager.db.is_connected()
     
     def list_tools(self) -> List[str]:
-        """列出所有工具名称"""
+        """列出所有工具名称 (取自进程内相似度索引，不扫描集合)"""
+        self._ensure_index()
+        return [tool["name"] for tool in self._index.tools()]
+    
+    def list_hot_tools(self, limit: int) -> List[dict]:
+        """按使用次数降序列出工具 (用于启动预热)"""
         collection = self._get_collection()
         if collection is None:
             return []
         
         try:
-            return [doc["name"] for doc in collection.find({}, {"name": 1})]
+            docs = list(collection.find({}, {"_id": 0}).sort("usage_count", -1).limit(limit))
+            return [doc for doc in docs if doc.get("code")]
         except Exception:
             return []
     
@@ -54,15 +83,19 @@ class ToolRegistry:
         return None
     
     def register(self, spec: dict) -> bool:
-        """注册工具到数据库"""
+        """注册工具到数据库 (递增注册版本号，其他进程据此增量刷新相似度索引)"""
+        self._ensure_index()
+        self._add_to_index(spec)
+        
         collection = self._get_collection()
         if collection is None:
             return False
         
+        version = tool_cache.bump_registry_version()
         try:
             collection.update_one(
                 {"name": spec["name"]},
-                {"$set": spec},
+                {"$set": spec if version is None else {**spec, "registry_version": version}},
                 upsert=True
             )
             tool_cache.set_tool(spec)
@@ -70,6 +103,20 @@ class ToolRegistry:
         except Exception:
             return False
     
+    def update_safety_verdict(self, tool: dict, verdict: dict):
+        """更新工具文档上的安全检查判定 (安全规则变更后重新检查的结果)"""
+        tool["safety_verdict"] = verdict  # 相似度索引中的工具规格同步更新
+        
+        collection = self._get_collection()
+        if collection is None:
+            return
+        
+        try:
+            collection.update_one({"name": tool["name"]}, {"$set": {"safety_verdict": verdict}})
+            tool_cache.set_tool(tool)
+        except Exception:
+            pass
+    
     def save_as_file(self, spec: dict) -> str:
         """保存工具为 Python 文件"""
         name = spec["name"]
@@ -77,6 +124,12 @@ class ToolRegistry:
         description = spec.get("description", "")
         parameters = spec.get("parameters", {})
         
+        # 带参数的工具需要调用方传参，文件中只给出调用示例
+        if parameters:
+            test_call = f'print("调用示例: {name}({", ".join(f"{p}=..." for p in parameters)})")'
+        else:
+            test_call = f'result = {name}()\n    print(f"执行结果: {{result}}")'
+        
         # 生成文件内容
         file_content = f'''"""
 工具名称: {name}
@@ -99,10 +152,9 @@ __tool_meta__ = {{
 
 if __name__ == "__main__":
     # 测试执行
-    result = {name}()
-    print(f"执行结果: {{result}}")
+    {test_call}
 '''
-        
+
         # 写入文件
         file_path = TOOLS_DIR / f"{name}.py"
         with open(file_path, 'w', encoding='utf-8') as f:
@@ -148,29 +200,147 @@ if __name__ == "__main__":
         except Exception:
             return []
     
-    def get_tools_summary(self, category: str = None) -> str:
-        """获取工具摘要文本（供 LLM 判断）"""
-        if category:
-            tools = self.search_by_category(category)
+    def _ensure_index(self):
+        """加载并定期刷新相似度索引
+        
+        首次使用时从 MongoDB 加载全部工具，MongoDB 不可用时使用 Redis 缓存的工具 (之后定期重试 MongoDB)；
+        每隔 TOOL_INDEX_REFRESH_INTERVAL 秒比较 Redis 中的注册版本号，其他进程注册了工具时
+        只从 MongoDB 增量加载版本号更新的工具。
+        """
+        now = time.monotonic()
+        if self._index_checked_at is not None and now - self._index_checked_at < config.TOOL_INDEX_REFRESH_INTERVAL:
+            return
+        self._index_checked_at = now
+        
+        version = tool_cache.get_registry_version()
+        if not self._index_loaded:
+            self._load_index(version)
+        elif version is not None and version > self._index_version:
+            self._refresh_index()
+    
+    def _load_index(self, version: Optional[int]):
+        """从 MongoDB 加载全部工具，不可用时从 Redis 缓存加载"""
+        collection = self._get_collection()
+        docs = None
+        if collection is not None:
+            try:
+                docs = list(collection.find({}, {"_id": 0}))
+            except Exception:
+                pass
+        
+        if docs is None:
+            for doc in tool_cache.list_tools():
+                self._add_to_index(doc)
+            return
+        
+        for doc in docs:
+            self._add_to_index(doc)
+        self._index_loaded = True
+        self._index_version = version or 0
+    
+    def _refresh_index(self):
+        """增量加载注册版本号大于索引版本的工具"""
+        collection = self._get_collection()
+        if collection is None:
+            return
+        
+        try:
+            docs = list(collection.find({"registry_version": {"$gt": self._index_version}}, {"_id": 0}))
+        except Exception:
+            return
+        
+        for doc in docs:
+            self._add_to_index(doc)
+        # 按已读到的文档推进版本号: 版本号已递增但尚未写入的工具下次刷新时仍会读到
+        self._index_version = max([self._index_version] + [doc["registry_version"] for doc in docs])
+    
+    def _add_to_index(self, doc: dict):
+        self._index.add(doc)
+        self._usage.setdefault(doc["name"], doc.get("usage_count", 0))
+        self._summary_fragments.pop(doc["name"], None)
+    
+    def search_similar(self, query: str, top_k: int = None) -> List[Tuple[dict, float]]:
+        """跨分类检索与查询最相似的工具，返回 (工具规格, 相似度) 列表"""
+        self._ensure_index()
+        return self._index.search(
+            query,
+            top_k=top_k or config.TOOL_SEARCH_TOP_K,
+            min_score=config.TOOL_SEARCH_MIN_SCORE,
+        )
+    
+    def find_candidates(self, query: str, category: str) -> List[Tuple[dict, float]]:
+        """检索候选工具；没有相似工具时退回同分类的工具 (相似度记为 0，交给 LLM 判断)
+        
+        字符 n-gram 无法识别同义改写，如 "现在几点了" 与 "获取当前时间" 没有共同的字。
+        """
+        candidates = self.search_similar(query)
+        if candidates:
+            return candidates
+        return [(tool, 0.0) for tool in self._index.tools() if tool.get("category") == category]
+    
+    def record_usage(self, name: str):
+        """记录工具被复用一次 (用于摘要排序)"""
+        self._usage[name] = self._usage.get(name, 0) + 1
+        
+        collection = self._get_collection()
+        if collection is None:
+            return
+        
+        try:
+            collection.update_one({"name": name}, {"$inc": {"usage_count": 1}})
+        except Exception:
+            pass
+    
+    def _summary_fragment(self, tool: dict) -> str:
+        """获取单个工具的摘要片段 (预渲染缓存，注册时失效)"""
+        name = tool["name"]
+        fragment = self._summary_fragments.get(name)
+        if fragment is None:
+            description = tool.get("description") or "无描述"
+            if len(description) > config.TOOL_SUMMARY_MAX_DESC_CHARS:
+                description = description[:config.TOOL_SUMMARY_MAX_DESC_CHARS] + "..."
+            fragment = f"- {format_signature(tool)}: {description}"
+            self._summary_fragments[name] = fragment
+        return fragment
+    
+    def build_summary(self, candidates: List[Tuple[dict, float]]) -> Tuple[List[dict], str]:
+        """按相关度和使用次数排序，在 top-k 和 Token 预算内构建工具摘要
+        
+        返回 (纳入摘要的工具列表, 摘要文本)。
+        """
+        ranked = sorted(
+            candidates,
+            key=lambda item: item[1] + config.TOOL_USAGE_WEIGHT * math.log1p(self._usage.get(item[0]["name"], 0)),
+            reverse=True,
+        )
+        
+        budget = config.TOOL_SUMMARY_TOKEN_BUDGET * config.LLM_CHARS_PER_TOKEN  # 按字符数估算
+        tools, lines, used = [], [], 0
+        for tool, _ in ranked[:config.TOOL_SUMMARY_TOP_K]:
+            fragment = self._summary_fragment(tool)
+            if lines and used + len(fragment) > budget:
+                break
+            tools.append(tool)
+            lines.append(fragment)
+            used += len(fragment) + 1
+        
+        return tools, "\n".join(lines)
+    
+    def get_tools_summary(self, category: str = None, query: str = None) -> str:
+        """获取工具摘要文本（供 LLM 判断），有查询时按相关度排序"""
+        if query:
+            candidates = self.search_similar(query)
         else:
-            collection = self._get_collection()
-            tools = []
-            if collection:
-                try:
-                    docs = list(collection.find({}, {"name": 1, "description": 1, "category": 1}))
-                    for doc in docs:
-                        doc.pop("_id", None)
-                    tools = docs
-                except Exception:
-                    pass
-        
-        if not tools:
+            self._ensure_index()
+            candidates = [
+                (t, 0.0) for t in self._index.tools()
+                if not category or t.get("category") == category
+            ]
+        
+        if not candidates:
             return ""
         
-        return "\n".join([
-            f"- {t['name']}: {t.get('description', '无描述')}"
-            for t in tools
-        ])
+        return self.build_summary(candidates)[1]
 
 
 # 全局注册实例
@@ -0,0 +1,109 @@
+"""纯工具执行结果缓存模块 (进程内 LRU + Redis 两级缓存)"""
+
+import hashlib
+import json
+import time
+from collections import Counter, OrderedDict
+from typing import Optional
+import redis
+from ..infra.config import config
+from ..infra.connection_manager import connection_manager
+
+
+class ToolResultCache:
+    """纯工具执行结果缓存
+    
+    缓存键为工具代码 + 实参的哈希 (相同代码和参数的纯函数结果相同，与工具名无关)，
+    TTL 按工具分类配置，0 表示该分类不缓存。
+    """
+    
+    KEY_PREFIX = "result:"
+    
+    def __init__(self, max_entries: int = None):
+        self._max_entries = max_entries or config.TOOL_RESULT_CACHE_MAX_ENTRIES
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (过期时间戳, 结果)
+        self._stats = Counter()  # hit / miss / store
+    
+    def _get_client(self) -> Optional[redis.Redis]:
+        """获取 Redis 客户端（通过连接管理器）"""
+        return connection_manager.cache.get_client()
+    
+    @staticmethod
+    def make_key(code: str, args: Optional[dict] = None) -> str:
+        """生成缓存键: 代码 + 实参哈希"""
+        payload = code + "\n" + json.dumps(args or {}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def ttl_for(self, category: str) -> int:
+        """获取分类的缓存 TTL (秒)，0 表示不缓存"""
+        if not config.TOOL_RESULT_CACHE_ENABLED:
+            return 0
+        return config.TOOL_RESULT_CACHE_TTL.get(category, config.TOOL_RESULT_CACHE_DEFAULT_TTL)
+    
+    def get(self, key: str, category: str = "other") -> Optional[str]:
+        """读取缓存结果，依次查询 LRU 和 Redis"""
+        if self.ttl_for(category) <= 0:
+            return None
+        
+        entry = self._lru.get(key)
+        if entry:
+            expires_at, result = entry
+            if expires_at > time.time():
+                self._lru.move_to_end(key)
+                self._stats["hit"] += 1
+                return result
+            self._lru.pop(key, None)
+        
+        client = self._get_client()
+        if client:
+            try:
+                data = client.get(self.KEY_PREFIX + key)
+                if data:
+                    result = json.loads(data)["result"]
+                    remaining = client.ttl(self.KEY_PREFIX + key)
+                    self._put_memory(key, result, remaining if remaining > 0 else self.ttl_for(category))
+                    self._stats["hit"] += 1
+                    return result
+            except Exception:
+                pass
+        
+        self._stats["miss"] += 1
+        return None
+    
+    def set(self, key: str, result: str, category: str = "other") -> bool:
+        """写入缓存结果 (LRU + Redis)"""
+        ttl = self.ttl_for(category)
+        if ttl <= 0:
+            return False
+        
+        self._put_memory(key, result, ttl)
+        self._stats["store"] += 1
+        
+        client = self._get_client()
+        if not client:
+            return False
+        
+        try:
+            client.setex(self.KEY_PREFIX + key, ttl, json.dumps({"result": result}, ensure_ascii=False))
+            return True
+        except Exception:
+            return False
+    
+    def _put_memory(self, key: str, result: str, ttl: int):
+        """写入进程内 LRU，超出容量时淘汰最久未使用的条目"""
+        self._lru[key] = (time.time() + ttl, result)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self._max_entries:
+            self._lru.popitem(last=False)
+    
+    def stats(self) -> dict:
+        """获取命中统计"""
+        lookups = self._stats["hit"] + self._stats["miss"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hit"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+# 全局纯工具结果缓存实例
+tool_result_cache = ToolResultCache()
@@ -0,0 +1,153 @@
+"""生成去重模块 (singleflight)
+
+相同能力的并发生成请求只由一个 "leader" 调用 LLM，其余请求等待并复用其结果:
+- 进程内: 以 asyncio.Future 合并同一键的并发调用
+- 跨进程: Redis SET NX 锁选出 leader，结果写入 Redis 供其他进程的 follower 读取
+Redis 不可用时退化为仅进程内去重。
+"""
+
+import asyncio
+import copy
+import hashlib
+import json
+import uuid
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Optional
+import redis
+from ..infra.config import config
+from ..infra.connection_manager import connection_manager
+from ..infra.logger import workflow_logger
+
+
+class GenerationSingleflight:
+    """工具生成的在途请求去重"""
+    
+    LOCK_PREFIX = "flight:lock:"
+    RESULT_PREFIX = "flight:result:"
+    
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = Counter()  # leader / local_follower / remote_follower / fallback
+    
+    def _get_client(self) -> Optional[redis.Redis]:
+        """获取 Redis 客户端（通过连接管理器）"""
+        return connection_manager.cache.get_client()
+    
+    @staticmethod
+    def make_key(description: str, category: str) -> str:
+        """生成去重键: 任务描述原文 (仅去除首尾空白) + 分类
+        
+        follower 直接复用 leader 的工具规格和实参 (tool_arguments)，描述不完全相同时不能合并:
+        "计算 7+5" 与 "计算 7-5" 只差运算符，"计算 abc 的大写" 与 "计算 ABC 的大写" 实参不同。
+        """
+        digest = hashlib.sha256(description.strip().encode("utf-8")).hexdigest()[:32]
+        return f"{category}:{digest}"
+    
+    async def run(self, key: str, factory: Callable[[], Awaitable[dict]]) -> dict:
+        """执行生成: 同一键只有一个 leader 调用 factory，其余调用等待其结果"""
+        while key in self._inflight:
+            future = self._inflight[key]
+            self._stats["local_follower"] += 1
+            workflow_logger.info(f"生成去重: 等待进程内相同请求的结果 ({key})")
+            try:
+                # 副本: 各任务分支后续可能修改规格
+                return copy.deepcopy(await asyncio.shield(future))
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # 自身被取消
+                # leader 被取消 (如推测生成被放弃)，由当前请求接手
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run_leader(key, factory)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 标记已取回，无 follower 时不产生警告
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+    
+    async def _run_leader(self, key: str, factory: Callable[[], Awaitable[dict]]) -> dict:
+        """进程内 leader: 尝试获取 Redis 锁，其他进程已在生成时等待其结果"""
+        client = self._get_client()
+        token = uuid.uuid4().hex
+        
+        if client and not self._acquire(client, key, token):
+            result = await self._wait_remote(client, key)
+            if result is not None:
+                self._stats["remote_follower"] += 1
+                workflow_logger.info(f"生成去重: 复用其他进程的生成结果 ({key})")
+                return result
+            # 对方超时或失败未写入结果，自行生成
+            self._stats["fallback"] += 1
+            workflow_logger.warning(f"生成去重: 等待其他进程超时，自行生成 ({key})")
+        else:
+            self._stats["leader"] += 1
+        
+        try:
+            result = await factory()
+            if client and result.get("generated_spec"):
+                self._publish(client, key, result)
+            return result
+        finally:
+            if client:
+                self._release(client, key, token)
+    
+    def _acquire(self, client: redis.Redis, key: str, token: str) -> bool:
+        """获取跨进程锁，Redis 出错时视为获取成功 (退化为进程内去重)"""
+        try:
+            return bool(client.set(self.LOCK_PREFIX + key, token, nx=True, ex=config.SINGLEFLIGHT_LOCK_TTL))
+        except Exception:
+            return True
+    
+    def _release(self, client: redis.Redis, key: str, token: str):
+        """释放锁 (仅当锁仍属于自己)"""
+        try:
+            if client.get(self.LOCK_PREFIX + key) in (token, token.encode()):
+                client.delete(self.LOCK_PREFIX + key)
+        except Exception:
+            pass
+    
+    def _publish(self, client: redis.Redis, key: str, result: dict):
+        """写入生成结果供其他进程的 follower 读取"""
+        try:
+            client.setex(
+                self.RESULT_PREFIX + key,
+                config.SINGLEFLIGHT_RESULT_TTL,
+                json.dumps(result, ensure_ascii=False),
+            )
+        except Exception:
+            pass
+    
+    async def _wait_remote(self, client: redis.Redis, key: str) -> Optional[dict]:
+        """轮询其他进程 leader 的结果，锁释放或超时后返回 (无结果返回 None)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config.SINGLEFLIGHT_WAIT_TIMEOUT
+        while loop.time() < deadline:
+            try:
+                data = client.get(self.RESULT_PREFIX + key)
+                if data:
+                    return json.loads(data)
+                if not client.exists(self.LOCK_PREFIX + key):
+                    # 锁已释放: 再读一次结果，避免与 leader 写入结果之间的竞争
+                    data = client.get(self.RESULT_PREFIX + key)
+                    return json.loads(data) if data else None
+            except Exception:
+                return None
+            await asyncio.sleep(config.SINGLEFLIGHT_POLL_INTERVAL)
+        return None
+    
+    def stats(self) -> dict:
+        """获取去重统计"""
+        return dict(self._stats)
+
+
+# 全局生成去重实例
+generation_flight = GenerationSingleflight()
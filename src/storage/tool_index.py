@@ -0,0 +1,136 @@
+"""工具相似度索引模块 (进程内，无网络依赖)
+
+基于字符 n-gram 的 TF-IDF 向量，对工具描述做余弦相似度检索
+(查询是中文任务描述，英文工具名只会拉低相似度，仅在没有描述时使用)。
+向量以稀疏的 (行号, 列号, 权重) 三元组保存，注册工具时增量追加，
+查询时按需重算权重 (IDF 随文档频率变化)，开销与非零项数成正比，不随词表大小增长。
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+
+class ToolIndex:
+    """工具相似度索引"""
+    
+    NGRAM_SIZES = (1, 2, 3)
+    
+    def __init__(self):
+        self._names: List[str] = []             # 行号 -> 工具名
+        self._rows: Dict[str, int] = {}         # 工具名 -> 行号
+        self._tools: Dict[str, dict] = {}       # 工具名 -> 工具规格
+        self._term_counts: List[Counter] = []   # 每行的 n-gram 词频 (按列号)
+        self._vocab: Dict[str, int] = {}        # n-gram -> 列号
+        self._doc_freq: List[int] = []          # 列号 -> 文档频率
+        self._entries = ([], [], [])            # 全部非零项的 (行号, 列号, 词频)，新增工具时追加
+        self._weights: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None  # 归一化的 TF-IDF 三元组 (脏标记: None)
+    
+    @classmethod
+    def _ngrams(cls, text: str) -> Counter:
+        """提取字符 n-gram (英文按单词边界切分，下划线视为空格)"""
+        text = re.sub(r"[_\W]+", " ", text.lower()).strip()
+        grams = Counter()
+        for segment in text.split():
+            for n in cls.NGRAM_SIZES:
+                for i in range(len(segment) - n + 1):
+                    grams[segment[i:i + n]] += 1
+        return grams
+    
+    @staticmethod
+    def _document_text(spec: dict) -> str:
+        return spec.get("description") or spec.get("name", "")
+    
+    def __len__(self) -> int:
+        return len(self._names)
+    
+    def tools(self) -> List[dict]:
+        """获取索引中的全部工具"""
+        return [self._tools[name] for name in self._names]
+    
+    def add(self, spec: dict):
+        """增量添加或更新工具"""
+        name = spec["name"]
+        grams = self._ngrams(self._document_text(spec))
+        
+        counts = Counter()
+        for gram, tf in grams.items():
+            if gram not in self._vocab:
+                self._vocab[gram] = len(self._doc_freq)
+                self._doc_freq.append(0)
+            counts[self._vocab[gram]] = tf
+        
+        if name in self._rows:
+            row = self._rows[name]
+            for col in self._term_counts[row]:
+                self._doc_freq[col] -= 1
+            self._term_counts[row] = counts
+            self._entries = None  # 更新已有工具 (少见) 时重新收集非零项
+        else:
+            row = self._rows[name] = len(self._names)
+            self._names.append(name)
+            self._term_counts.append(counts)
+            if self._entries is not None:
+                rows, cols, tfs = self._entries
+                rows.extend([row] * len(counts))
+                cols.extend(counts.keys())
+                tfs.extend(counts.values())
+        
+        for col in counts:
+            self._doc_freq[col] += 1
+        self._tools[name] = spec
+        self._weights = None
+    
+    def _idf(self) -> np.ndarray:
+        df = np.asarray(self._doc_freq, dtype=np.float32)
+        return np.log((1 + len(self._names)) / (1 + df)) + 1
+    
+    def _build_weights(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """计算归一化的 TF-IDF 三元组 (行号, 列号, 权重)"""
+        if self._entries is None:
+            self._entries = ([], [], [])
+            for row, counts in enumerate(self._term_counts):
+                self._entries[0].extend([row] * len(counts))
+                self._entries[1].extend(counts.keys())
+                self._entries[2].extend(counts.values())
+        rows = np.asarray(self._entries[0], dtype=np.int64)
+        cols = np.asarray(self._entries[1], dtype=np.int64)
+        weights = np.asarray(self._entries[2], dtype=np.float32) * self._idf()[cols]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(self._names)))
+        norms[norms == 0] = 1
+        return rows, cols, (weights / norms[rows]).astype(np.float32)
+    
+    def search(self, query: str, top_k: int = 5, min_score: float = 0.0) -> List[Tuple[dict, float]]:
+        """检索最相似的工具，返回 (工具规格, 相似度) 列表，按相似度降序"""
+        if not self._names:
+            return []
+        if self._weights is None:
+            self._weights = self._build_weights()
+        
+        # 词表外的 n-gram 不参与点积，但计入查询向量的模长 (按 df=0 的 IDF)，避免相似度虚高
+        query_vec = np.zeros(len(self._vocab), dtype=np.float32)
+        oov_idf = math.log(1 + len(self._names)) + 1
+        oov_norm_sq = 0.0
+        for gram, tf in self._ngrams(query).items():
+            col = self._vocab.get(gram)
+            if col is not None:
+                query_vec[col] = tf
+            else:
+                oov_norm_sq += (tf * oov_idf) ** 2
+        query_vec *= self._idf()
+        norm = math.sqrt(float(query_vec @ query_vec) + oov_norm_sq)
+        if not query_vec.any():
+            return []
+        
+        rows, cols, weights = self._weights
+        scores = np.bincount(rows, weights=weights * (query_vec / norm)[cols], minlength=len(self._names))
+        top_k = min(top_k, len(scores))
+        top_rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        top_rows = top_rows[np.argsort(-scores[top_rows])]
+        return [
+            (self._tools[self._names[row]], round(float(scores[row]), 4))
+            for row in top_rows
+            if scores[row] > min_score
+        ]
@@ -1,4 +1,4 @@
 """工作流模块"""
 
 from .state import SelfToolState, create_initial_state
-from .graph import self_tool_graph
+from .graph import self_tool_graph, oneshot_graph
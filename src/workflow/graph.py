@@ -1,11 +1,13 @@
-"""子图组装模块 - 支持多任务和会话持久化"""
+"""子图组装模块 - 支持多任务并行和会话持久化"""
 
 from langgraph.graph import StateGraph, START, END
-from .state import SelfToolState
+from .state import SelfToolState, TaskState
 from ..storage.checkpointer import checkpointer
 from .nodes import (
     analyze_requirement_node,
     plan_tasks_node,
+    dispatch_tasks_node,
+    enqueue_next_task_node,
     prepare_current_task_node,
     search_tool_node,
     generate_code_node,
@@ -19,25 +21,25 @@ from .nodes import (
     should_continue_node,
     reject_node,
     fail_node,
+    known_failure_node,
 )
 from .routing import (
     route_after_analyze,
+    route_after_prepare,
     route_after_search,
     route_after_safety,
     route_after_execute,
-    route_after_save_result,
+    route_after_dispatch,
+    route_after_aggregate,
     route_after_should_continue,
 )
 
 
-def create_self_tool_graph():
-    """创建 Self-Tool 动态工具生成子图 (支持多任务)"""
+def create_task_graph():
+    """创建单任务执行子图: 检索 -> 生成/复用 (或使用批量生成的规格) -> 安全检查 -> 执行 -> 注册"""
     
-    builder = StateGraph(SelfToolState)
+    builder = StateGraph(TaskState)
     
-    # 添加节点
-    builder.add_node("analyze", analyze_requirement_node)
-    builder.add_node("plan_tasks", plan_tasks_node)
     builder.add_node("prepare_task", prepare_current_task_node)
     builder.add_node("search", search_tool_node)
     builder.add_node("generate", generate_code_node)
@@ -46,38 +48,30 @@ def create_self_tool_graph():
     builder.add_node("register", register_tool_node)
     builder.add_node("use_existing", use_existing_tool_node)
     builder.add_node("save_result", save_task_result_node)
-    builder.add_node("aggregate", aggregate_results_node)
-    builder.add_node("format_response", format_response_node)
-    builder.add_node("should_continue", should_continue_node)
     builder.add_node("reject", reject_node)
     builder.add_node("fail", fail_node)
+    builder.add_node("fast_reject", known_failure_node)
     
-    # ===== 入口 =====
-    builder.add_edge(START, "analyze")
+    builder.add_edge(START, "prepare_task")
     
-    # 分析后分支: 需要工具 -> 任务规划, 不需要 -> 直接结束
+    # 分发阶段已批量生成规格 -> 直接安全检查, 否则 -> 检索
     builder.add_conditional_edges(
-        "analyze",
-        route_after_analyze,
+        "prepare_task",
+        route_after_prepare,
         {
-            "need_tool": "plan_tasks",
-            "direct_answer": END
+            "batched": "safety_check",
+            "search": "search"
         }
     )
     
-    # ===== 多任务循环 =====
-    # 任务规划 -> 准备任务
-    builder.add_edge("plan_tasks", "prepare_task")
-    
-    # 准备任务 -> 检索
-    builder.add_edge("prepare_task", "search")
-    
-    # 检索后分支
+    # 检索后分支 (未命中已有工具且近期生成失败 -> 快速拒绝)
     builder.add_conditional_edges(
         "search",
         route_after_search,
         {
             "use_existing": "use_existing",
+            "known_failure": "fast_reject",
+            "speculated": "safety_check",
             "generate": "generate"
         }
     )
@@ -107,22 +101,82 @@ def create_self_tool_graph():
         }
     )
     
-    # 注册/使用已有 -> 保存结果
+    # 成功或失败都记录任务结果，由主图汇总
     builder.add_edge("register", "save_result")
     builder.add_edge("use_existing", "save_result")
+    builder.add_edge("reject", "save_result")
+    builder.add_edge("fail", "save_result")
+    builder.add_edge("fast_reject", "save_result")
+    builder.add_edge("save_result", END)
+    
+    # 子任务状态只在分支内部使用，不写入会话 checkpoint
+    return builder.compile(checkpointer=False)
+
+
+task_graph = create_task_graph()
+
+
+async def run_task_node(task: dict) -> dict:
+    """并行分支节点: 在独立状态中执行单个子任务，结果合并回 task_results"""
+    final = await task_graph.ainvoke(task)
+    return {"task_results": [final["task_result"]]}
+
+
+def create_self_tool_graph(persistent: bool = True):
+    """创建 Self-Tool 动态工具生成子图 (支持多任务)
+    
+    persistent=False 时不使用 checkpointer，用于未指定会话的一次性请求，不写入会话存储。
+    """
+    
+    builder = StateGraph(SelfToolState)
     
-    # 保存结果后分支: 还有任务 -> 准备下一个, 否则 -> 汇总
+    # 添加节点
+    builder.add_node("analyze", analyze_requirement_node)
+    builder.add_node("plan_tasks", plan_tasks_node)
+    builder.add_node("dispatch", dispatch_tasks_node)
+    builder.add_node("run_task", run_task_node)
+    builder.add_node("aggregate", aggregate_results_node)
+    builder.add_node("format_response", format_response_node)
+    builder.add_node("should_continue", should_continue_node)
+    builder.add_node("enqueue_task", enqueue_next_task_node)
+    
+    # ===== 入口 =====
+    builder.add_edge(START, "analyze")
+    
+    # 分析后分支: 需要工具 -> 任务规划, 合并模式已规划 -> 直接分发, 不需要 -> 直接结束
     builder.add_conditional_edges(
-        "save_result",
-        route_after_save_result,
+        "analyze",
+        route_after_analyze,
         {
-            "next_task": "prepare_task",
-            "aggregate": "aggregate"
+            "need_tool": "plan_tasks",
+            "planned": "dispatch",
+            "direct_answer": END
         }
     )
     
-    # 汇总 -> 润色
-    builder.add_edge("aggregate", "format_response")
+    # ===== 多任务并行 =====
+    # 任务规划 -> 分发
+    builder.add_edge("plan_tasks", "dispatch")
+    
+    # 分发: 依赖已满足的任务通过 Send 并行执行，全部完成后汇总
+    builder.add_conditional_edges(
+        "dispatch",
+        route_after_dispatch,
+        ["run_task", "aggregate"]
+    )
+    
+    # 每一波并行任务完成后回到分发，调度依赖它们的任务
+    builder.add_edge("run_task", "dispatch")
+    
+    # 汇总后分支: 全部失败 -> 结束, 否则 -> 润色
+    builder.add_conditional_edges(
+        "aggregate",
+        route_after_aggregate,
+        {
+            "format": "format_response",
+            "fail": END
+        }
+    )
     
     # 润色 -> 迭代判断
     builder.add_edge("format_response", "should_continue")
@@ -132,17 +186,15 @@ def create_self_tool_graph():
         "should_continue",
         route_after_should_continue,
         {
-            "continue": "search",  # 继续执行 -> 直接检索工具
+            "continue": "enqueue_task",  # 继续执行 -> 追加任务后分发
             "end": END
         }
     )
+    builder.add_edge("enqueue_task", "dispatch")
     
-    # ===== 终点 =====
-    builder.add_edge("reject", END)
-    builder.add_edge("fail", END)
-    
-    return builder.compile(checkpointer=checkpointer)
+    return builder.compile(checkpointer=checkpointer if persistent else None)
 
 
 # 导出图实例
 self_tool_graph = create_self_tool_graph()
+oneshot_graph = create_self_tool_graph(persistent=False)
@@ -0,0 +1,122 @@
+"""流式 JSON 解析模块
+
+逐块消费 LLM 输出，顶层对象的字段一旦完整即可取用 (如 need_tool、code)，
+无需等待整个响应结束。跳过 JSON 前后的说明文字和代码块标记；
+遇到无法解析的花括号片段时重新同步到下一个对象；
+响应被截断时保留已完整的字段。
+"""
+
+import json
+from typing import Any, List, Optional, Tuple
+
+_decoder = json.JSONDecoder()
+
+
+class StreamingJSONParser:
+    """增量 JSON 对象解析器"""
+    
+    def __init__(self):
+        self._buf = ""                 # 当前对象从 '{' 开始的文本
+        self._pos = 0                  # 扫描位置
+        self._depth = 0                # 括号嵌套深度 (0 表示尚未进入对象)
+        self._in_string = False
+        self._escape = False
+        self._member_start = 0         # 当前顶层成员的起始位置
+        self._result: Optional[dict] = None  # 完整解析出的对象
+        self.fields: dict = {}         # 已完整的顶层字段
+        self.text = ""                 # 收到的原始文本 (用于日志)
+    
+    @property
+    def done(self) -> bool:
+        """是否已解析出完整对象"""
+        return self._result is not None
+    
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """输入一块文本，返回本次新完成的顶层字段 [(key, value)]"""
+        self.text += chunk
+        if self._result is not None:
+            return []
+        
+        self._buf += chunk
+        completed = []
+        while self._pos < len(self._buf):
+            i = self._pos
+            ch = self._buf[i]
+            self._pos += 1
+            
+            if self._depth == 0:
+                if ch == "{":
+                    # 进入新对象，丢弃之前的说明文字
+                    self._buf = self._buf[i:]
+                    self._pos = 1
+                    self._depth = 1
+                    self._member_start = 1
+                continue
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch == "," and self._depth == 1:
+                completed += self._close_member(i)
+                self._member_start = i + 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth > 0:
+                    continue
+                completed += self._close_member(i)
+                try:
+                    obj = json.loads(self._buf[:i + 1])
+                except json.JSONDecodeError:
+                    obj = None
+                if isinstance(obj, dict):
+                    self._result = obj
+                    return completed
+                # 不是合法对象 (如说明文字中的花括号)，从下一个 '{' 重新开始
+                self._buf = self._buf[i + 1:]
+                self._pos = 0
+                self.fields = {}
+                completed = []
+        
+        if self._depth == 0:
+            self._buf = ""
+            self._pos = 0
+        return completed
+    
+    def _close_member(self, end: int) -> List[Tuple[str, Any]]:
+        """解析一个完整的顶层成员 "key": value"""
+        text = self._buf[self._member_start:end].strip()
+        if not text:
+            return []
+        try:
+            key, index = _decoder.raw_decode(text)
+            rest = text[index:].lstrip()
+            if not isinstance(key, str) or not rest.startswith(":"):
+                return []
+            value = json.loads(rest[1:])
+        except json.JSONDecodeError:
+            return []
+        self.fields[key] = value
+        return [(key, value)]
+    
+    def result(self) -> dict:
+        """获取解析结果: 完整对象优先，否则返回已完整的字段 (响应被截断时)"""
+        if self._result is not None:
+            return self._result
+        return dict(self.fields)
+
+
+def parse_json(text: str) -> dict:
+    """一次性解析完整文本"""
+    parser = StreamingJSONParser()
+    parser.feed(text)
+    return parser.result()
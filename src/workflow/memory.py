@@ -0,0 +1,162 @@
+"""会话记忆模块 - 滚动摘要 + 短尾原文
+
+每轮对话后在后台把超出尾部窗口的历史消息合并进摘要 (受 Token 预算约束)，
+下一轮需求分析时取回合并结果，写入图状态的 conversation_summary 并随 checkpoint 持久化；
+只有被状态中的摘要覆盖的消息才从 messages 通道中移除，两者在同一次状态更新中写入，
+进程重启或后台摘要丢失时不会丢失对话内容，保证长会话的 Prompt 大小基本不变。
+"""
+
+import asyncio
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage
+from ..infra.config import config
+from ..infra.llm_gateway import llm_gateway
+from ..infra.logger import llm_logger, workflow_logger
+
+
+def _format_messages(messages: List[BaseMessage]) -> List[str]:
+    """消息转为 "角色: 内容" 文本行"""
+    return [
+        f"{'用户' if isinstance(m, HumanMessage) else '助手'}: {m.content}"
+        for m in messages
+    ]
+
+
+def empty_summary() -> dict:
+    """空的会话摘要记录"""
+    return {"summary": "", "covered_ids": []}
+
+
+class ConversationMemory:
+    """会话滚动摘要管理器
+    
+    摘要记录 {"summary": str, "covered_ids": list} 保存在图状态中，这里只持有进行中的后台合并任务
+    (按 thread_id，数量有上限，超出时丢弃最早的任务，其消息留待之后重新合并)。
+    """
+    
+    def __init__(self, max_pending: int = None):
+        self._max_pending = max_pending or config.CONVERSATION_PENDING_MAX
+        self._pending: "OrderedDict[str, asyncio.Task]" = OrderedDict()  # thread_id -> 后台摘要合并
+    
+    async def _collect(self, thread_id: str, record: dict) -> dict:
+        """取回上一轮的后台合并结果 (未完成时短暂等待，超时则沿用旧摘要，下一轮再取)"""
+        pending = self._pending.get(thread_id)
+        if pending is None:
+            return record
+        if not pending.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(pending), config.CONVERSATION_SUMMARY_WAIT)
+            except Exception:
+                pass
+            if not pending.done():
+                return record
+        
+        self._pending.pop(thread_id, None)
+        result = None if pending.cancelled() or pending.exception() else pending.result()
+        if not result:
+            return record
+        return {
+            "summary": result["summary"],
+            "covered_ids": record["covered_ids"] + [i for i in result["folded_ids"] if i not in record["covered_ids"]],
+        }
+    
+    async def build_context(
+        self, thread_id: Optional[str], messages: List[BaseMessage], record: Optional[dict]
+    ) -> Tuple[str, List[str], dict]:
+        """构建 Prompt 用的历史上下文
+        
+        record 为图状态中的摘要记录。返回 (历史上下文文本, 可从 messages 通道移除的消息 id,
+        新的摘要记录)，新记录须与移除消息写入同一次状态更新。
+        """
+        record = dict(record or empty_summary())
+        if not messages:
+            return "", [], record
+        
+        tail_size = config.CONVERSATION_TAIL_MESSAGES
+        if not thread_id:
+            # 无会话 ID 时没有 checkpoint，不做摘要，只保留尾部原文
+            lines = _format_messages(messages[-tail_size:])
+            return "历史对话:\n" + "\n".join(lines) + "\n\n", [], record
+        
+        record = await self._collect(thread_id, record)
+        covered = set(record["covered_ids"])
+        older, tail = messages[:-tail_size], messages[-tail_size:]
+        
+        removable = [m.id for m in older if m.id in covered]
+        uncovered = [m for m in older if m.id not in covered]
+        if removable:
+            # 这些消息本轮会从 messages 通道移除，不再需要记录
+            record["covered_ids"] = [i for i in record["covered_ids"] if i not in set(removable)]
+        
+        # 未被摘要覆盖的旧消息保留原文，按预算从最近往前截取
+        budget = config.CONVERSATION_HISTORY_TOKEN_BUDGET * config.LLM_CHARS_PER_TOKEN
+        lines = _format_messages(uncovered + tail)
+        kept, used = [], 0
+        for line in reversed(lines):
+            if kept and used + len(line) > budget:
+                break
+            kept.insert(0, line)
+            used += len(line)
+        
+        context = ""
+        if record["summary"]:
+            context += f"对话摘要:\n{record['summary']}\n\n"
+        if kept:
+            context += "历史对话:\n" + "\n".join(kept) + "\n\n"
+        
+        return context, removable, record
+    
+    def schedule_update(self, thread_id: Optional[str], messages: List[BaseMessage], record: dict):
+        """在后台把超出尾部窗口且未被覆盖的消息合并进摘要，结果在下一轮 build_context 时取回"""
+        if not thread_id:
+            return
+        
+        older = messages[:-config.CONVERSATION_TAIL_MESSAGES]
+        covered = set(record["covered_ids"])
+        to_fold = [m for m in older if m.id and m.id not in covered]
+        if not to_fold:
+            return
+        
+        pending = self._pending.get(thread_id)
+        if pending and not pending.done():
+            return  # 同一会话串行更新，剩余消息下一轮再合并
+        
+        self._pending[thread_id] = asyncio.create_task(self._update(thread_id, record["summary"], to_fold))
+        self._pending.move_to_end(thread_id)
+        while len(self._pending) > self._max_pending:
+            _, dropped = self._pending.popitem(last=False)
+            dropped.cancel()
+    
+    async def _update(self, thread_id: str, summary: str, to_fold: List[BaseMessage]) -> Optional[dict]:
+        """调用 LLM 合并摘要，返回 {"summary", "folded_ids"}，失败时返回 None"""
+        max_chars = config.CONVERSATION_SUMMARY_TOKENS * config.LLM_CHARS_PER_TOKEN
+        new_lines = "\n".join(_format_messages(to_fold))
+        
+        prompt = f"""将已有的对话摘要与新增的对话合并为一份新的摘要。
+
+已有摘要:
+{summary or '无'}
+
+新增对话:
+{new_lines}
+
+要求:
+1. 保留用户身份、偏好、已确认的事实和未完成的事项
+2. 删除寒暄和重复内容
+3. 不超过 {max_chars} 个字
+
+直接返回摘要内容，不要加任何前缀。"""
+
+        try:
+            response = await llm_gateway.ainvoke([HumanMessage(content=prompt)])
+        except Exception as e:
+            llm_logger.warning(f"会话摘要更新失败: {e}")
+            return None
+        
+        workflow_logger.info(f"会话 {thread_id} 摘要已更新，合并 {len(to_fold)} 条消息")
+        return {"summary": response.content.strip()[:max_chars], "folded_ids": [m.id for m in to_fold]}
+
+
+# 全局会话记忆实例
+conversation_memory = ConversationMemory()
@@ -1,37 +1,90 @@
 """节点实现模块"""
 
+import asyncio
 import json
 import time
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_openai import ChatOpenAI
+import uuid
+from typing import List, Optional
+from langchain_core.messages import HumanMessage, AIMessage, RemoveMessage
+from langchain_core.runnables import ensure_config
+from langgraph.types import StreamWriter
 from ..infra.config import config
-from .state import SelfToolState, ToolSpec
-from ..execution.safety import CodeSafetyChecker
-from ..execution.sandbox import SafeExecutor
+from .state import SelfToolState, TaskState, ToolSpec
+from .speculation import speculation_stats
+from .memory import conversation_memory
+from .routing import select_ready_tasks
+from .json_stream import StreamingJSONParser
+from ..execution.safety import safety_checker
+from ..execution.sandbox import SafeExecutor, safe_executor
+from ..execution.process_pool import process_sandbox
+from ..execution.purity import PurityAnalyzer
+from ..execution.cost import CostAnalyzer
+from ..execution.repair import safety_repairer
 from ..storage.registry import tool_registry
 from ..storage.cache import tool_cache
+from ..storage.llm_cache import llm_cache
+from ..storage.singleflight import generation_flight
+from ..storage.result_cache import tool_result_cache
+from ..storage.negative_cache import negative_cache
+from ..storage.blob_store import blob_store
+from ..infra.llm_gateway import llm_gateway
 from ..infra.logger import llm_logger, sandbox_logger, safety_logger, registry_logger, workflow_logger
 
 
-# 初始化 LLM 客户端 (阿里云 DashScope)
-llm = ChatOpenAI(
-    model=config.LLM_MODEL,
-    api_key=config.DASHSCOPE_API_KEY,
-    base_url=config.DASHSCOPE_BASE_URL,
-    temperature=0.2,
-)
+def _llm_cache_key(prompt: str) -> str:
+    return llm_cache.make_key(llm_gateway.model_name, llm_gateway.temperature, prompt)
 
 
-def _extract_json(text: str) -> dict:
-    """从文本中提取 JSON"""
+async def _astream_llm(node: str, prompt: str, bypass_cache: bool = False, json_mode: bool = False):
+    """流式调用 LLM，逐块产出文本；缓存命中时一次性产出完整内容"""
+    key = _llm_cache_key(prompt)
+    
+    if not bypass_cache:
+        cached = llm_cache.get(node, key)
+        if cached is not None:
+            llm_logger.info(f"LLM 缓存命中: {node}")
+            yield cached
+            return
+    
+    chunks = []
+    async for chunk in llm_gateway.astream([HumanMessage(content=prompt)], json_mode=json_mode):
+        if chunk.content:
+            chunks.append(chunk.content)
+            yield chunk.content
+    
+    if not bypass_cache:
+        llm_cache.set(node, key, "".join(chunks))
+
+
+async def _ainvoke_json(node: str, prompt: str, on_field=None, bypass_cache: bool = False) -> dict:
+    """以 JSON 模式流式调用 LLM，边接收边解析
+    
+    on_field(key, value) 在每个顶层字段完整时回调，返回 False 时立即停止接收
+    (提前结束的响应不写入缓存)。响应被截断时返回已完整的字段。
+    """
+    parser = StreamingJSONParser()
+    stream = _astream_llm(node, prompt, bypass_cache=bypass_cache, json_mode=True)
     try:
-        start = text.find('{')
-        end = text.rfind('}') + 1
-        if start >= 0 and end > start:
-            return json.loads(text[start:end])
-    except json.JSONDecodeError:
-        pass
-    return {}
+        async for chunk in stream:
+            for key, value in parser.feed(chunk):
+                if on_field and on_field(key, value) is False:
+                    llm_logger.info(f"{node}: 字段 {key} 已完整，提前结束接收")
+                    return parser.result()
+    finally:
+        await stream.aclose()
+    
+    llm_logger.debug(f"原始响应:\n{parser.text}")
+    if not parser.done:
+        llm_logger.warning(f"{node}: 响应不是完整的 JSON 对象，使用已解析的 {len(parser.fields)} 个字段")
+    return parser.result()
+
+
+# 代码生成的安全规则 (单任务和批量生成共用)
+_GENERATION_RULES = """1. 只能使用: datetime, time, calendar, math, json, re, random, string
+2. 禁止: os, subprocess, sys, open, eval, exec
+3. 任务中的具体数值/文本作为函数参数 (类型限 int/float/str/bool，在 parameters 中声明)，
+   本任务的参数值放在 arguments 中，使工具可被同类请求复用；函数返回字符串
+4. 工具名称应该反映实际功能"""
 
 
 async def plan_tasks_node(state: SelfToolState) -> dict:
@@ -49,11 +102,12 @@ async def plan_tasks_node(state: SelfToolState) -> dict:
 2. 保持任务的执行顺序
 3. 如果只有一个任务，也返回包含一个元素的列表
 4. 每个任务需要明确的描述和分类
+5. depends_on 列出必须先完成的任务 id，互不依赖的任务留空列表，它们会被并行执行
 
 返回 JSON:
 {{
     "tasks": [
-        {{"id": 1, "description": "任务描述", "category": "datetime|calendar|math|text|other"}}
+        {{"id": 1, "description": "任务描述", "category": "datetime|calendar|math|text|other", "depends_on": []}}
     ]
 }}
 
@@ -62,12 +116,9 @@ async def plan_tasks_node(state: SelfToolState) -> dict:
     llm_logger.info("发送任务规划 Prompt 到 LLM")
     llm_logger.debug(f"Prompt 内容:\n{prompt}")
     
-    response = await llm.ainvoke([HumanMessage(content=prompt)])
-    
-    llm_logger.info("LLM 任务规划响应:")
-    llm_logger.debug(f"原始响应:\n{response.content}")
+    result = await _ainvoke_json("plan_tasks", prompt)
+    llm_logger.info("LLM 任务规划响应已解析")
     
-    result = _extract_json(response.content)
     tasks = result.get("tasks", [])
     
     if not tasks:
@@ -78,67 +129,309 @@ async def plan_tasks_node(state: SelfToolState) -> dict:
             "category": state["task_category"]
         }]
     
+    tasks = _normalize_tasks(tasks)
+    
     workflow_logger.info(f"拆分为 {len(tasks)} 个子任务:")
     for t in tasks:
-        workflow_logger.info(f"  [{t['id']}] {t['description']} ({t['category']})")
-        print(f"  任务{t['id']}: {t['description']}")
+        deps = f" <- {t['depends_on']}" if t["depends_on"] else ""
+        workflow_logger.info(f"  [{t['id']}] {t['description']} ({t['category']}){deps}")
+        print(f"  任务{t['id']}: {t['description']}{deps}")
     
     return {
         "task_list": tasks,
-        "current_task_index": 0,
         "task_results": [],
         "current_node": "plan_tasks",
     }
 
 
-def prepare_current_task_node(state: SelfToolState) -> dict:
-    """准备当前任务: 设置 task_description 和 task_category"""
-    idx = state["current_task_index"]
-    tasks = state["task_list"]
+def _normalize_tasks(tasks: list) -> list:
+    """规范化任务列表: 补全 id/category，依赖只保留指向更早任务的 id (避免环)"""
+    normalized = []
+    seen_ids = set()
+    for t in tasks:
+        task_id = t.get("id")
+        if not isinstance(task_id, int) or task_id in seen_ids:
+            task_id = max(seen_ids, default=0) + 1
+        deps = t.get("depends_on") or []
+        if not isinstance(deps, list):
+            deps = [deps]
+        normalized.append({
+            "id": task_id,
+            "description": t.get("description", ""),
+            "category": t.get("category", "other"),
+            "depends_on": [d for d in deps if d in seen_ids],
+        })
+        seen_ids.add(task_id)
+    return normalized
+
+
+async def dispatch_tasks_node(state: SelfToolState, writer: StreamWriter) -> dict:
+    """任务分发节点: 记录本轮可并行执行的任务，直接命中已有工具的任务批量执行，
+    注册表未命中的任务批量生成工具
+    
+    实际分发由 route_after_dispatch 完成，批量生成的规格随 Send 传给各任务分支；
+    批量执行的任务直接写入 task_results，不再进入任务分支。
+    """
+    done = {r["task_id"] for r in state.get("task_results", [])}
+    ready = select_ready_tasks(state)
+    
+    if not ready:
+        return {"batch_specs": [], "current_node": "dispatch"}
+    
+    workflow_logger.info("=" * 60)
+    workflow_logger.info(f"任务分发: 已完成 {len(done)} 个, 本轮执行 {len(ready)} 个")
+    
+    update = {"current_node": "dispatch"}
+    if config.BATCH_EXECUTION:
+        matches = []
+        for t in ready:
+            tool = _direct_match(tool_registry.search_similar(t["description"]))
+            if tool:
+                matches.append((t, tool))
+        if len(matches) >= config.BATCH_EXECUTION_MIN_TASKS:
+            # task_results 为空列表表示重置，只在有结果时写入
+            update["task_results"] = await _execute_batch(matches, len(state.get("task_list", [])), writer)
+            executed = {r["task_id"] for r in update["task_results"]}
+            ready = [t for t in ready if t["id"] not in executed]
+    
+    batch_specs = []
+    if config.BATCH_GENERATION:
+        misses = [
+            t for t in ready
+            if not negative_cache.peek(t["description"], t.get("category", "other"))
+            and _is_registry_miss(t["description"], t.get("category", "other"))
+        ]
+        if len(misses) >= config.BATCH_GENERATION_MIN_TASKS:
+            batch_specs = await _generate_batch(state, misses)
+    
+    update["batch_specs"] = batch_specs
+    return update
+
+
+def _direct_match(candidates: list) -> Optional[dict]:
+    """相似度足够高的无参数工具可直接复用，无需 LLM 选择 (带参数的工具需要 LLM 提取实参)"""
+    if not candidates:
+        return None
+    top_tool, top_score = candidates[0]
+    if top_score >= config.TOOL_MATCH_THRESHOLD and not top_tool.get("parameters"):
+        return top_tool
+    return None
+
+
+async def _execute_batch(matches: list, task_total: int, writer: StreamWriter) -> list:
+    """一次沙箱往返执行多个直接命中已有工具的任务 [(任务, 工具)]，返回任务结果
+    
+    纯工具优先读取结果缓存，单个工具执行失败只影响对应任务。
+    """
+    print(f"\n[批量执行] {len(matches)} 个任务直接复用已有工具...")
+    outcomes = {}  # task_id -> (结果, 错误信息, 耗时)
+    pending = []
+    for task, tool in matches:
+        issues = _registered_tool_issues(tool)
+        if issues:
+            outcomes[task["id"]] = (None, "已注册工具未通过当前安全规则: " + "; ".join(issues), 0)
+            continue
+        if _is_pure_tool(tool):
+            cached = tool_result_cache.get(tool_result_cache.make_key(tool["code"]), tool.get("category", "other"))
+            if cached is not None:
+                sandbox_logger.info(f"纯工具结果缓存命中: {tool['name']}")
+                outcomes[task["id"]] = (cached, None, 0)
+                continue
+        pending.append((task, tool))
+    
+    if pending:
+        start_time = time.time()
+        replies = await _run_tool_batch(
+            [(tool["code"], tool["name"], {}) for _, tool in pending],
+            [_tool_cost_class(tool) for _, tool in pending],
+        )
+        elapsed_ms = int((time.time() - start_time) * 1000)  # 整批耗时，批内各任务共享
+        for (task, tool), (result, error) in zip(pending, replies):
+            if error is None:
+                result = str(result)
+                if _is_pure_tool(tool):
+                    tool_result_cache.set(tool_result_cache.make_key(tool["code"]), result, tool.get("category", "other"))
+            outcomes[task["id"]] = (result, error, elapsed_ms)
+    
+    task_results = []
+    for task, tool in matches:
+        result, error, elapsed_ms = outcomes[task["id"]]
+        result_ref = None
+        if error is None:
+            result, result_ref = blob_store.offload(result)
+            tool_registry.record_usage(tool["name"])
+            writer({"type": "tool_result", "task_id": task["id"], "tool": tool["name"], "result": result})
+            print(f"  任务{task['id']}/{task_total}: {tool['name']} -> {result}")
+        else:
+            print(f"  任务{task['id']}/{task_total}: {tool['name']} 执行失败: {error}")
+        workflow_logger.info(f"任务 {task['id']} 批量执行工具 {tool['name']}: {error or result}")
+        task_results.append({
+            "task_id": task["id"],
+            "description": task["description"],
+            "result": result or "",
+            "result_ref": result_ref,
+            "error": error,
+            "tool_file": None,
+            "tool_registered": False,
+            "tool_cached": False,
+            "execution_time_ms": elapsed_ms,
+        })
+    return task_results
+
+
+def _is_registry_miss(description: str, category: str) -> bool:
+    """本地索引中没有任何候选工具 (无相似工具，同分类也没有工具)，无需 LLM 判断即可确定要生成新工具
+    
+    有候选时即使相似度较低也交给任务分支的 LLM 选择: 带参数的任务 (如 "计算 789*12")
+    与已注册的通用工具 ("计算两个整数的乘积") 字面相似度往往很低，但可以复用。
+    """
+    return not tool_registry.find_candidates(description, category)
+
+
+async def _generate_batch(state: SelfToolState, tasks: list) -> list:
+    """一次 LLM 调用为多个任务生成工具规格，返回 [{"task_id", "spec", "arguments"}]
+    
+    响应缺失或格式错误的任务不返回规格，由任务分支走正常的检索/生成流程。
+    """
+    print(f"\n[批量生成] {len(tasks)} 个任务共用一次代码生成...")
+    results = {r["task_id"]: r for r in state.get("task_results", [])}
+    
+    task_lines = []
+    for t in tasks:
+        line = f"- task_id={t['id']} ({t.get('category', 'other')}): {t['description']}"
+        deps = [results[d] for d in t.get("depends_on", []) if d in results]
+        if deps:
+            line += "\n  前置任务结果: " + "; ".join(
+                f"{r['description']}: {r.get('result') or r.get('error')}" for r in deps
+            )
+        task_lines.append(line)
+    task_block = "\n".join(task_lines)
+    
+    prompt = f"""为以下每个任务分别生成一个 Python 工具函数。
+
+任务列表:
+{task_block}
+
+安全规则:
+{_GENERATION_RULES}
+
+返回 JSON 格式:
+{{
+    "tools": [
+        {{
+            "task_id": 1,
+            "name": "tool_function",
+            "description": "工具描述",
+            "parameters": {{"text": {{"type": "str", "description": "参数说明"}}}},
+            "arguments": {{"text": "本任务的参数值"}},
+            "return_type": "str",
+            "category": "other",
+            "code": "def tool_function(text: str) -> str:\\n    return text"
+        }}
+    ]
+}}
+
+每个任务对应一个工具，task_id 与任务列表一致，只返回 JSON。"""
+
+    llm_logger.info(f"发送批量代码生成 Prompt 到 LLM ({len(tasks)} 个任务)")
+    llm_logger.debug(f"Prompt 内容:\n{prompt}")
     
-    if idx >= len(tasks):
-        return {"current_node": "prepare_task"}
+    result = await _ainvoke_json("generate_batch", prompt)
+    llm_logger.info("LLM 批量代码生成响应已解析")
+    cache_entry = {"node": "generate_batch", "key": _llm_cache_key(prompt)}
+    
+    task_ids = {t["id"] for t in tasks}
+    batch_specs = []
+    for spec in result.get("tools", []):
+        if not isinstance(spec, dict) or not spec.get("name") or not spec.get("code"):
+            continue
+        task_id = spec.pop("task_id", None)
+        if task_id not in task_ids:
+            continue
+        task_ids.discard(task_id)
+        spec["version"] = 1
+        batch_specs.append({
+            "task_id": task_id, "spec": spec, "arguments": _pop_arguments(spec), "cache_entry": cache_entry,
+        })
+        llm_logger.info(f"批量生成工具: 任务 {task_id} -> {spec['name']}")
+        print(f"  任务{task_id}: 生成工具 {spec['name']}")
+    
+    if task_ids:
+        llm_logger.warning(f"批量生成未返回任务 {sorted(task_ids)} 的有效规格，交由任务分支单独生成")
+    return batch_specs
+
+
+def enqueue_next_task_node(state: SelfToolState) -> dict:
+    """迭代继续时追加新任务 (依赖此前所有任务)"""
+    tasks = list(state.get("task_list", []))
+    task_id = max((t["id"] for t in tasks), default=0) + 1
+    task = {
+        "id": task_id,
+        "description": state.get("task_description", ""),
+        "category": state.get("task_category", "other"),
+        "depends_on": [t["id"] for t in tasks],
+    }
+    tasks.append(task)
+    workflow_logger.info(f"追加迭代任务 [{task_id}]: {task['description']}")
+    
+    return {
+        "task_list": tasks,
+        "current_node": "enqueue_task",
+    }
+
+
+def prepare_current_task_node(state: TaskState) -> dict:
+    """准备当前任务: 初始化单个任务分支的执行状态"""
+    task_id = state["task_id"]
+    print(f"\n[执行任务 {task_id}/{state.get('task_total', task_id)}] {state['task_description']}")
+    workflow_logger.info(f"准备执行任务 {task_id}: {state['task_description']}")
     
-    task = tasks[idx]
-    print(f"\n[执行任务 {idx + 1}/{len(tasks)}] {task['description']}")
-    workflow_logger.info(f"准备执行任务 {idx + 1}: {task['description']}")
+    # 分发阶段批量生成的规格视为第一次生成，失败后按单任务重新生成
+    spec = state.get("generated_spec")
+    if spec:
+        workflow_logger.info(f"任务 {task_id} 使用批量生成的工具: {spec['name']}")
     
     return {
-        "task_description": task["description"],
-        "task_category": task.get("category", "other"),
+        "known_failure": None,
         "matched_tool": None,
-        "generated_spec": None,
-        "generation_attempt": 0,
+        "tool_arguments": state.get("tool_arguments") or {},
+        "generated_spec": spec,
+        "generation_attempt": 1 if spec else 0,
         "generation_feedback": "",
+        "generation_cache_entry": state.get("generation_cache_entry") if spec else None,
         "safety_status": "pending",
         "execution_result": None,
         "execution_error": None,
+        "execution_time_ms": 0,
+        "result_ref": None,
+        "tool_registered": False,
+        "tool_cached": False,
+        "tool_file": None,
+        "error": None,
         "current_node": "prepare_task",
     }
 
 
-def save_task_result_node(state: SelfToolState) -> dict:
-    """保存当前任务结果并移动到下一个任务"""
-    idx = state["current_task_index"]
-    tasks = state["task_list"]
-    results = list(state.get("task_results", []))
-    
-    task = tasks[idx] if idx < len(tasks) else {"id": idx + 1, "description": "unknown"}
+def save_task_result_node(state: TaskState) -> dict:
+    """保存当前任务结果 (由并行分支合并回主图的 task_results)"""
+    task_id = state["task_id"]
     
     result_entry = {
-        "task_id": task.get("id", idx + 1),
-        "description": task.get("description", ""),
-        "result": state.get("execution_result", ""),
-        "error": state.get("execution_error"),
+        "task_id": task_id,
+        "description": state.get("task_description", ""),
+        "result": state.get("execution_result") or "",
+        "result_ref": state.get("result_ref"),
+        "error": state.get("error") or state.get("execution_error"),
         "tool_file": state.get("tool_file"),
+        "tool_registered": state.get("tool_registered", False),
+        "tool_cached": state.get("tool_cached", False),
+        "execution_time_ms": state.get("execution_time_ms", 0),
     }
-    results.append(result_entry)
     
-    workflow_logger.info(f"任务 {idx + 1} 结果已保存: {result_entry['result'][:50]}...")
+    workflow_logger.info(f"任务 {task_id} 结果已保存: {result_entry['result'][:50]}...")
     
     return {
-        "task_results": results,
-        "current_task_index": idx + 1,
+        "task_result": result_entry,
         "current_node": "save_result",
     }
 
@@ -157,20 +450,36 @@ def aggregate_results_node(state: SelfToolState) -> dict:
             "current_node": "aggregate",
         }
     
-    combined_parts = []
-    for r in results:
-        if r.get("error"):
-            combined_parts.append(f"任务{r['task_id']}: 执行失败 - {r['error']}")
-        else:
-            combined_parts.append(f"任务{r['task_id']}({r['description']}): {r['result']}")
-    
-    combined = "\n".join(combined_parts)
+    combined = _combine_results(results)
     workflow_logger.info(f"汇总结果:\n{combined}")
     
-    return {
+    tool_files = [r["tool_file"] for r in results if r.get("tool_file")]
+    update = {
         "execution_result": combined,
+        "execution_time_ms": round(sum(r.get("execution_time_ms", 0) for r in results), 3),
+        "tool_file": tool_files[-1] if tool_files else None,
+        "tool_registered": any(r.get("tool_registered") for r in results),
+        "tool_cached": any(r.get("tool_cached") for r in results),
         "current_node": "aggregate",
     }
+    
+    # 所有任务均失败时整体报错，与单任务失败时的行为保持一致；
+    # 否则清除错误 (会话 checkpoint 会保留上一轮的 error)
+    update["error"] = results[0]["error"] if all(r.get("error") for r in results) else None
+    
+    return update
+
+
+def _combine_results(results: list, resolve: bool = False) -> str:
+    """拼接各任务结果，resolve 时读取外置存储的完整结果 (否则使用预览)"""
+    parts = []
+    for r in results:
+        if r.get("error"):
+            parts.append(f"任务{r['task_id']}: 执行失败 - {r['error']}")
+        else:
+            result = blob_store.resolve(r["result"], r.get("result_ref")) if resolve else r["result"]
+            parts.append(f"任务{r['task_id']}({r['description']}): {result}")
+    return "\n".join(parts)
 
 
 async def analyze_requirement_node(state: SelfToolState) -> dict:
@@ -180,18 +489,20 @@ async def analyze_requirement_node(state: SelfToolState) -> dict:
     workflow_logger.info("节点1: 需求分析开始")
     workflow_logger.info(f"用户请求: {state['user_request']}")
     
-    # 构建历史对话上下文
-    history_context = ""
+    # 构建历史对话上下文: 滚动摘要 + 最近几条原文
+    thread_id = ensure_config().get("configurable", {}).get("thread_id")
     messages = state.get("messages", [])
-    if messages:
-        history_lines = []
-        for msg in messages[-10:]:  # 最近10条消息
-            role = "用户" if isinstance(msg, HumanMessage) else "助手"
-            history_lines.append(f"{role}: {msg.content}")
-        if history_lines:
-            history_context = "历史对话:\n" + "\n".join(history_lines) + "\n\n"
+    history_context, removable_ids, summary = await conversation_memory.build_context(
+        thread_id, messages, state.get("conversation_summary")
+    )
     
-    prompt = f"""分析以下用户请求，判断是否需要执行工具/代码来完成。
+    analysis, tasks = {}, []
+    if config.COMBINED_ANALYZE_PLAN:
+        analysis, tasks = await _analyze_and_plan(state, history_context)
+    
+    if not analysis:
+        # 两步模式 (或合并模式 JSON 解析失败时的回退): 仅做需求分析，任务规划交给 plan_tasks
+        prompt = f"""分析以下用户请求，判断是否需要执行工具/代码来完成。
 
 {history_context}当前请求: {state['user_request']}
 
@@ -211,16 +522,11 @@ async def analyze_requirement_node(state: SelfToolState) -> dict:
 
 只返回 JSON。"""
 
-    llm_logger.info("发送 Prompt 到 LLM:")
-    llm_logger.debug(f"Prompt 内容:\n{prompt}")
-    
-    response = await llm.ainvoke([HumanMessage(content=prompt)])
-    
-    llm_logger.info("LLM 响应:")
-    llm_logger.debug(f"原始响应:\n{response.content}")
-    
-    analysis = _extract_json(response.content)
-    llm_logger.info(f"解析后 JSON: {json.dumps(analysis, ensure_ascii=False)}")
+        llm_logger.info("发送 Prompt 到 LLM:")
+        llm_logger.debug(f"Prompt 内容:\n{prompt}")
+        
+        analysis = await _ainvoke_json("analyze", prompt)
+        llm_logger.info(f"解析后 JSON: {json.dumps(analysis, ensure_ascii=False)}")
     
     need_tool = analysis.get("need_tool", True)
     task_desc = analysis.get("task_description", state['user_request'])
@@ -237,24 +543,89 @@ async def analyze_requirement_node(state: SelfToolState) -> dict:
     else:
         print(f"  需要工具: 否 (直接回复)")
     
-    # 构建消息历史：用户请求 + 助手回复
+    # 构建消息历史：用户请求 + 助手回复，移除已被摘要覆盖的旧消息
     new_messages = [
-        HumanMessage(content=state['user_request']),
-        AIMessage(content=direct_answer if direct_answer else f"任务: {task_desc}")
+        HumanMessage(content=state['user_request'], id=str(uuid.uuid4())),
+        AIMessage(content=direct_answer if direct_answer else f"任务: {task_desc}", id=str(uuid.uuid4()))
     ]
+    # 本轮移除的消息已在摘要中 (且已从 covered_ids 中去掉)，不再参与合并
+    kept = [m for m in messages if m.id not in set(removable_ids)]
+    conversation_memory.schedule_update(thread_id, kept + new_messages, summary)
+    new_messages = [RemoveMessage(id=i) for i in removable_ids] + new_messages
+    
+    if need_tool and tasks:
+        workflow_logger.info(f"合并模式已规划 {len(tasks)} 个子任务，跳过 plan_tasks")
+        for t in tasks:
+            print(f"  任务{t['id']}: {t['description']}")
     
     return {
         "need_tool": need_tool,
         "task_description": task_desc,
         "task_category": task_cat,
         "execution_result": direct_answer if not need_tool else None,
+        "task_list": tasks if need_tool else [],
+        "task_results": [],
         "current_node": "analyze",
-        "messages": new_messages
+        "messages": new_messages,
+        "conversation_summary": summary,
     }
 
 
-async def search_tool_node(state: SelfToolState) -> dict:
-    """节点2: 工具检索 - LLM 智能判断可用工具"""
+async def _analyze_and_plan(state: SelfToolState, history_context: str) -> tuple:
+    """合并模式: 一次 LLM 调用同时完成需求分析和任务规划
+    
+    返回 (analysis, tasks)。JSON 无法解析时返回空 analysis，由调用方回退到两步模式；
+    仅任务列表缺失或格式错误时返回空 tasks，由 plan_tasks 节点补做规划。
+    """
+    prompt = f"""分析以下用户请求，判断是否需要执行工具/代码来完成；如果需要，同时拆分为可执行的子任务。
+
+{history_context}当前请求: {state['user_request']}
+
+判断标准:
+- 需要工具: 获取时间、计算数学、生成随机数、处理数据等需要执行代码的任务
+- 不需要工具: 聊天问候、问答解释、意见咨询等可以直接回复的问题
+
+注意: 如果历史对话中有相关信息，请结合历史回答当前问题。
+
+子任务规则 (仅在需要工具时填写 tasks，否则返回空列表):
+1. 每个子任务应该是独立的、可单独执行的
+2. 保持任务的执行顺序
+3. 如果只有一个任务，也返回包含一个元素的列表
+4. depends_on 列出必须先完成的任务 id，互不依赖的任务留空列表，它们会被并行执行
+
+返回 JSON 格式:
+{{
+    "need_tool": true或false,
+    "task_description": "简洁的任务描述",
+    "task_category": "datetime|calendar|math|text|chat|other",
+    "direct_answer": "如果不需要工具，这里填写直接回复内容；否则留空",
+    "tasks": [
+        {{"id": 1, "description": "任务描述", "category": "datetime|calendar|math|text|other", "depends_on": []}}
+    ]
+}}
+
+只返回 JSON。"""
+
+    llm_logger.info("发送需求分析+任务规划合并 Prompt 到 LLM")
+    llm_logger.debug(f"Prompt 内容:\n{prompt}")
+    
+    analysis = await _ainvoke_json("analyze_plan", prompt)
+    llm_logger.info(f"合并模式解析后 JSON: {json.dumps(analysis, ensure_ascii=False)}")
+    
+    if "need_tool" not in analysis:
+        llm_logger.warning("合并模式 JSON 解析失败，回退到两步模式")
+        return {}, []
+    
+    tasks = analysis.get("tasks")
+    if not isinstance(tasks, list) or not all(isinstance(t, dict) and t.get("description") for t in tasks):
+        llm_logger.warning("合并模式任务列表格式错误，交由 plan_tasks 重新规划")
+        return analysis, []
+    
+    return analysis, _normalize_tasks(tasks)
+
+
+async def search_tool_node(state: TaskState) -> dict:
+    """节点2: 工具检索 - 相似度索引召回候选，高置信度直接复用，否则由 LLM 判断"""
     print("\n[2/6] 工具检索...")
     workflow_logger.info("=" * 60)
     workflow_logger.info("节点2: 工具检索开始")
@@ -264,21 +635,37 @@ async def search_tool_node(state: SelfToolState) -> dict:
     registry_logger.info(f"搜索查询: {state['task_description']}")
     registry_logger.info(f"搜索分类: {state['task_category']}")
     
-    # 获取同类别工具列表
-    category_tools = tool_registry.search_by_category(state['task_category'])
+    # 本地相似度索引跨分类检索候选工具，没有相似工具时退回同分类的工具
+    candidates = tool_registry.find_candidates(state['task_description'], state.get('task_category', 'other'))
     
-    if not category_tools:
-        registry_logger.info("无同类别工具，需要生成新工具")
+    if not candidates:
+        registry_logger.info("无相似工具且同分类没有工具，需要生成新工具")
         print("  无可用工具，准备生成")
         return {
             "existing_tools": existing,
             "matched_tool": None,
             "need_generate": True,
+            "known_failure": _known_failure(state),
+            "current_node": "search",
+        }
+    
+    registry_logger.info(f"候选工具: {[(t['name'], score) for t, score in candidates]}")
+    
+    # 相似度足够高的无参数工具直接复用，跳过 LLM 选择
+    top_tool, top_score = candidates[0]
+    if _direct_match(candidates):
+        registry_logger.info(f"高置信度匹配: {top_tool['name']} (相似度 {top_score})")
+        print(f"  直接匹配工具: {top_tool['name']} (相似度 {top_score})")
+        return {
+            "existing_tools": existing,
+            "matched_tool": top_tool,
+            "tool_arguments": {},
+            "need_generate": False,
             "current_node": "search",
         }
     
-    # 构建工具列表描述
-    tools_summary = tool_registry.get_tools_summary(state['task_category'])
+    # 构建工具列表描述 (按相关度和使用次数取 top-k，受 Token 预算约束)
+    candidate_tools, tools_summary = tool_registry.build_summary(candidates)
     
     # LLM 判断是否有可复用的工具
     prompt = f"""判断已有工具是否可以完成当前任务。
@@ -292,11 +679,13 @@ async def search_tool_node(state: SelfToolState) -> dict:
 1. 上述工具中是否有可以完成当前任务的？
 2. 如果有，选择最合适的工具
 3. 如果没有合适的工具，需要生成新工具
+4. 选中带参数的工具时，按其签名从任务描述中提取参数值
 
 返回 JSON:
 {{
     "use_existing": true或false,
     "tool_name": "选中的工具名，无则留空",
+    "arguments": {{"参数名": "参数值，无参数工具留空对象"}},
     "reason": "选择理由"
 }}
 
@@ -305,8 +694,19 @@ async def search_tool_node(state: SelfToolState) -> dict:
     llm_logger.info("发送工具选择 Prompt 到 LLM")
     llm_logger.debug(f"Prompt 内容:\n{prompt}")
     
-    response = await llm.ainvoke([HumanMessage(content=prompt)])
-    result = _extract_json(response.content)
+    # 推测执行: 选择判断期间并行生成新工具，未命中时省去一次串行 LLM 往返
+    speculative = None
+    if speculation_stats.should_speculate(state['task_category']) and not _known_failure(state, count=False):
+        registry_logger.info("推测执行: 工具选择期间并行生成新工具")
+        speculative = asyncio.create_task(generate_code_node(state))
+        speculative.add_done_callback(_retrieve_exception)  # 取消或未采用的推测失败时不留下未读取的异常
+    
+    try:
+        result = await _ainvoke_json("search", prompt)
+    except BaseException:
+        if speculative:
+            speculative.cancel()
+        raise
     
     use_existing = result.get("use_existing", False)
     tool_name = result.get("tool_name", "")
@@ -316,55 +716,114 @@ async def search_tool_node(state: SelfToolState) -> dict:
     
     if use_existing and tool_name:
         # 查找匹配的工具
-        matched = next((t for t in category_tools if t['name'] == tool_name), None)
+        matched = next((t for t in candidate_tools if t['name'] == tool_name), None)
+        arguments = None
         if matched:
+            try:
+                arguments = SafeExecutor.coerce_arguments(matched.get("parameters"), _pop_arguments(result))
+            except ValueError as e:
+                registry_logger.warning(f"工具 {matched['name']} 参数无效，改为生成新工具: {e}")
+                reason = f"参数无效: {e}"
+        if arguments is not None:
             registry_logger.info(f"匹配成功! 工具: {matched['name']}")
             print(f"  LLM 选择工具: {matched['name']} ({reason})")
+            if speculative:
+                speculative.cancel()
+                speculation_stats.record(state['task_category'], paid_off=False)
+                registry_logger.info("推测生成已取消 (复用已有工具)")
             return {
                 "existing_tools": existing,
                 "matched_tool": matched,
+                "tool_arguments": arguments,
                 "need_generate": False,
                 "current_node": "search",
             }
     
     registry_logger.info(f"LLM 判断需要生成新工具: {reason}")
     print(f"  LLM 判断需要新工具 ({reason})")
-    return {
+    update = {
         "existing_tools": existing,
         "matched_tool": None,
         "need_generate": True,
+        "known_failure": _known_failure(state),
         "current_node": "search",
     }
+    
+    if speculative and update["known_failure"]:
+        speculative.cancel()  # 推测开始后才写入的失败记录，按快速拒绝处理
+    elif speculative:
+        # 采用推测生成的结果，路由直接进入安全检查；推测失败时按正常流程生成
+        try:
+            generated = await speculative
+        except Exception as e:
+            speculation_stats.record(state['task_category'], paid_off=False)
+            registry_logger.warning(f"推测生成失败，改为正常生成: {e}")
+            return update
+        speculation_stats.record(state['task_category'], paid_off=True)
+        registry_logger.info("推测生成已采用")
+        update.update(generated)
+        update["current_node"] = "search"
+    
+    return update
+
 
+def _retrieve_exception(task: asyncio.Task):
+    if not task.cancelled():
+        task.exception()
 
-async def generate_code_node(state: SelfToolState) -> dict:
+
+async def generate_code_node(state: TaskState) -> dict:
     """节点3: 代码生成"""
     print("\n[3/6] 代码生成...")
     workflow_logger.info("=" * 60)
     workflow_logger.info("节点3: 代码生成开始")
     workflow_logger.info(f"当前尝试次数: {state['generation_attempt'] + 1}")
     
+    # 首次生成按任务描述+分类去重: 并发的相同请求等待同一次 LLM 生成的结果
+    # (重新生成带有各自的失败反馈，依赖前置结果的任务上下文不同，均不去重)
+    if (
+        config.GENERATION_SINGLEFLIGHT
+        and state["generation_attempt"] == 0
+        and not state.get("dependency_results")
+    ):
+        key = generation_flight.make_key(state["task_description"], state.get("task_category", "other"))
+        return await generation_flight.run(key, lambda: _generate_spec(state))
+    return await _generate_spec(state)
+
+
+async def _generate_spec(state: TaskState) -> dict:
+    """调用 LLM 生成工具规格"""
     feedback = ""
     if state["generation_feedback"]:
         feedback = f"\n上次失败原因:\n{state['generation_feedback']}\n请修正。"
         llm_logger.warning(f"重试原因: {state['generation_feedback']}")
-
+    
+    # 前置任务结果作为上下文 (依赖的数值通过 arguments 传入)
+    dependency_context = ""
+    if state.get("dependency_results"):
+        dependency_context = "\n前置任务结果:\n" + "\n".join(
+            f"- {r['description']}: {r.get('result') or r.get('error')}"
+            for r in state["dependency_results"]
+        ) + "\n"
+    
     # 根据任务类别选择示例
     category = state.get("task_category", "other")
     if category == "math" or "计算" in state["task_description"] or "乘" in state["task_description"]:
         example = '''{
-    "name": "calculate_result",
-    "description": "计算数学表达式",
-    "parameters": {},
+    "name": "multiply_numbers",
+    "description": "计算两个整数的乘积",
+    "parameters": {"a": {"type": "int", "description": "被乘数"}, "b": {"type": "int", "description": "乘数"}},
+    "arguments": {"a": 123, "b": 456},
     "return_type": "str",
     "category": "math",
-    "code": "def calculate_result() -> str:\\n    result = 123 * 456\\n    return str(result)"
+    "code": "def multiply_numbers(a: int, b: int) -> str:\\n    return str(a * b)"
 }'''
     elif category == "datetime" or "时间" in state["task_description"]:
         example = '''{
     "name": "get_current_time",
     "description": "获取当前时间",
     "parameters": {},
+    "arguments": {},
     "return_type": "str",
     "category": "datetime",
     "code": "def get_current_time() -> str:\\n    from datetime import datetime\\n    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')"
@@ -373,10 +832,11 @@ async def generate_code_node(state: SelfToolState) -> dict:
         example = '''{
     "name": "tool_function",
     "description": "工具描述",
-    "parameters": {},
+    "parameters": {"text": {"type": "str", "description": "参数说明"}},
+    "arguments": {"text": "本任务的参数值"},
     "return_type": "str",
     "category": "other",
-    "code": "def tool_function() -> str:\\n    return 'result'"
+    "code": "def tool_function(text: str) -> str:\\n    return text"
 }'''
 
     prompt = f"""为以下任务生成 Python 工具函数。
@@ -384,13 +844,10 @@ async def generate_code_node(state: SelfToolState) -> dict:
 **重要: 请根据任务描述生成对应的工具，不要照抄示例！**
 
 任务描述: {state["task_description"]}
-{feedback}
+{dependency_context}{feedback}
 
 安全规则:
-1. 只能使用: datetime, time, calendar, math, json, re, random, string
-2. 禁止: os, subprocess, sys, open, eval, exec
-3. 函数无参数，返回字符串
-4. 工具名称应该反映实际功能
+{_GENERATION_RULES}
 
 返回 JSON 格式示例:
 {example}
@@ -400,14 +857,30 @@ async def generate_code_node(state: SelfToolState) -> dict:
     llm_logger.info("发送代码生成 Prompt 到 LLM")
     llm_logger.debug(f"Prompt 内容:\n{prompt}")
     
-    response = await llm.ainvoke([HumanMessage(content=prompt)])
-    
-    llm_logger.info("LLM 代码生成响应:")
-    llm_logger.debug(f"原始响应:\n{response.content}")
-    
-    spec = _extract_json(response.content)
-    
-    if spec:
+    # code 字段一完整就做安全预检，不通过时停止接收剩余内容，尽早进入重新生成
+    precheck_issues = []
+    
+    def precheck(key, value):
+        if key == "code" and isinstance(value, str):
+            issues = safety_checker.check_all(value)
+            # 可以自动修复的问题交给安全检查节点处理，不中断接收
+            if issues and config.SAFETY_AUTO_REPAIR:
+                repaired, fixes = safety_repairer.repair(value)
+                if fixes and not safety_checker.check_all(repaired):
+                    return True
+            precheck_issues.extend(issues)
+            return not precheck_issues
+    
+    # 重试时 Prompt 可能与上次相同，绕过缓存避免重放失败的生成结果
+    bypass_cache = state["generation_attempt"] > 0
+    spec = await _ainvoke_json("generate", prompt, on_field=precheck, bypass_cache=bypass_cache)
+    # 响应在工具通过安全检查和执行之前已写入缓存，工具不可用时据此删除
+    cache_entry = None if bypass_cache else {"node": "generate", "key": _llm_cache_key(prompt)}
+    if precheck_issues:
+        llm_logger.warning(f"安全预检未通过，已提前结束生成: {precheck_issues}")
+    
+    if spec.get("code"):
+        arguments = _pop_arguments(spec)
         spec["version"] = state.get("generation_attempt", 0) + 1
         llm_logger.info(f"生成工具: {spec.get('name', 'unknown')}")
         llm_logger.info(f"工具描述: {spec.get('description', '')}")
@@ -418,8 +891,11 @@ async def generate_code_node(state: SelfToolState) -> dict:
         print(f"  生成工具: {spec.get('name', 'unknown')} (v{spec['version']})")
         return {
             "generated_spec": spec,
+            "tool_arguments": arguments,
             "generation_attempt": state["generation_attempt"] + 1,
+            "generation_cache_entry": cache_entry,
             "current_node": "generate",
+            "error": None,  # 清除上一次生成失败留下的错误
         }
     else:
         llm_logger.error("代码生成失败: JSON 解析错误")
@@ -427,12 +903,17 @@ async def generate_code_node(state: SelfToolState) -> dict:
             "generated_spec": None,
             "generation_attempt": state["generation_attempt"] + 1,
             "generation_feedback": "JSON解析失败",
+            "generation_cache_entry": cache_entry,
             "current_node": "generate",
             "error": "代码生成格式错误"
         }
 
 
-def safety_check_node(state: SelfToolState) -> dict:
+# 未生成有效规格 (LLM 输出格式错误等偶发情况) 时的安全检查问题，不写入负缓存
+_NO_SPEC_ISSUE = "未生成有效的工具规格"
+
+
+def safety_check_node(state: TaskState) -> dict:
     """节点4: 安全检查"""
     print("\n[4/6] 安全检查...")
     workflow_logger.info("=" * 60)
@@ -440,13 +921,13 @@ def safety_check_node(state: SelfToolState) -> dict:
     
     if not state["generated_spec"]:
         safety_logger.error("无有效工具规格")
+        _forget_generation(state)
         return {
             "safety_status": "failed",
-            "safety_issues": ["未生成有效的工具规格"],
+            "safety_issues": [_NO_SPEC_ISSUE],
             "current_node": "safety_check"
         }
     
-    checker = CodeSafetyChecker()
     code = state["generated_spec"]["code"]
     
     safety_logger.info("开始检查代码安全性...")
@@ -454,17 +935,33 @@ def safety_check_node(state: SelfToolState) -> dict:
     safety_logger.info(f"\n{code}\n")
     safety_logger.info("-" * 90)
     
-    safety_logger.info("检查禁止导入...")
-    safety_logger.info("检查禁止函数...")
-    safety_logger.info("检查 AST 结构...")
+    safety_logger.info("检查禁止导入与禁止函数 (AST)...")
     
-    issues = checker.check_all(code)
+    issues = safety_checker.check_all(code)
+    
+    if issues and config.SAFETY_AUTO_REPAIR:
+        fixed = safety_repairer.try_fix(code)
+        if fixed:
+            code, fixes = fixed
+            safety_logger.info(f"安全问题已自动修复 (节省一次重新生成): {fixes}")
+            safety_logger.info(f"\n{code}\n")
+            print(f"  检查通过 (自动修复: {'; '.join(fixes)})")
+            return {
+                "generated_spec": _with_cost_class(
+                    {**state["generated_spec"], "code": code, "safety_verdict": safety_checker.verdict(code)}
+                ),
+                "safety_status": "passed",
+                "safety_issues": [],
+                "current_node": "safety_check",
+            }
+        safety_logger.info("自动修复未能解决全部问题，需要重新生成")
     
     if issues:
         safety_logger.warning(f"安全检查未通过! 发现 {len(issues)} 个问题:")
         for i, issue in enumerate(issues, 1):
             safety_logger.warning(f"  [{i}] {issue}")
         print(f"  检查未通过: {issues}")
+        _forget_generation(state)
         return {
             "safety_status": "failed",
             "safety_issues": issues,
@@ -475,20 +972,36 @@ def safety_check_node(state: SelfToolState) -> dict:
         safety_logger.info("安全检查通过!")
         print("  检查通过")
         return {
+            # 检查结果随工具注册保存，复用时与当前规则版本一致则无需重新检查
+            "generated_spec": _with_cost_class({**state["generated_spec"], "safety_verdict": safety_checker.verdict(code)}),
             "safety_status": "passed",
             "safety_issues": [],
             "current_node": "safety_check",
         }
 
 
-def execute_node(state: SelfToolState) -> dict:
+def _forget_generation(state: TaskState):
+    """生成的工具未通过安全检查或执行失败时删除该次生成的 LLM 缓存，相同请求不再重放不可用的结果"""
+    entry = state.get("generation_cache_entry")
+    if entry:
+        llm_cache.evict(entry["node"], entry["key"])
+        llm_logger.info(f"已删除不可用的生成结果缓存: {entry['node']}")
+
+
+def _with_cost_class(spec: dict) -> dict:
+    """安全检查通过后估计执行成本，记录在规格上 (随工具注册保存，复用时决定执行方式)"""
+    cost_class, reasons = CostAnalyzer().analyze(spec["code"])
+    safety_logger.info(f"执行成本: {cost_class}" + (f" ({'; '.join(reasons)})" if reasons else ""))
+    return {**spec, "cost_class": cost_class}
+
+
+async def execute_node(state: TaskState, writer: StreamWriter) -> dict:
     """节点5: 沙箱执行"""
     print("\n[5/6] 沙箱执行...")
     workflow_logger.info("=" * 60)
     workflow_logger.info("节点5: 沙箱执行开始")
     
     spec = state["generated_spec"]
-    executor = SafeExecutor()
     
     sandbox_logger.info(f"准备执行工具: {spec['name']}")
     sandbox_logger.info("\n" + "-" * 40 + " 执行代码 " + "-" * 40)
@@ -496,13 +1009,16 @@ def execute_node(state: SelfToolState) -> dict:
     sandbox_logger.info("-" * 90)
     
     sandbox_logger.info("构建安全执行环境...")
-    sandbox_logger.info(f"允许的模块: {executor.ALLOWED_MODULE_NAMES}")
+    sandbox_logger.info(f"允许的模块: {safe_executor.ALLOWED_MODULE_NAMES}")
+    sandbox_logger.info(f"沙箱后端: {config.SANDBOX_BACKEND}")
     
     start_time = time.perf_counter()
     sandbox_logger.info("开始执行...")
     
     try:
-        result = executor.execute(spec["code"], spec["name"])
+        args = SafeExecutor.coerce_arguments(spec.get("parameters"), state.get("tool_arguments"))
+        sandbox_logger.info(f"调用参数: {args}")
+        result = await _run_tool(spec["code"], spec["name"], args, _tool_cost_class(spec))
         elapsed_ms = (time.perf_counter() - start_time) * 1000
         
         sandbox_logger.info(f"执行成功!")
@@ -511,13 +1027,20 @@ def execute_node(state: SelfToolState) -> dict:
         sandbox_logger.info(f"结果类型: {type(result).__name__}")
         
         print(f"  执行成功 ({elapsed_ms:.3f}ms)")
+        result = str(result)
+        if _is_pure_tool(spec):
+            tool_result_cache.set(tool_result_cache.make_key(spec["code"], args), result, spec.get("category", "other"))
+        result, result_ref = blob_store.offload(result)
+        # 原始结果先行推送，客户端无需等待润色完成
+        writer({"type": "tool_result", "task_id": state["task_id"], "tool": spec["name"], "result": result})
         return {
-            "execution_result": str(result),
+            "execution_result": result,
+            "result_ref": result_ref,
             "execution_error": None,
             "execution_time_ms": round(elapsed_ms, 3),
             "current_node": "execute",
         }
-        
+    
     except Exception as e:
         elapsed_ms = (time.perf_counter() - start_time) * 1000
         sandbox_logger.error(f"执行失败!")
@@ -525,6 +1048,7 @@ def execute_node(state: SelfToolState) -> dict:
         sandbox_logger.error(f"错误信息: {e}")
         sandbox_logger.error(f"执行耗时: {elapsed_ms:.3f}ms")
         print(f"  执行失败: {e}")
+        _forget_generation(state)
         return {
             "execution_result": None,
             "execution_error": str(e),
@@ -534,7 +1058,7 @@ def execute_node(state: SelfToolState) -> dict:
         }
 
 
-def register_tool_node(state: SelfToolState) -> dict:
+def register_tool_node(state: TaskState) -> dict:
     """节点6: 工具注册"""
     print("\n[6/6] 工具注册...")
     workflow_logger.info("=" * 60)
@@ -549,9 +1073,11 @@ def register_tool_node(state: SelfToolState) -> dict:
             "current_node": "register"
         }
     
-    spec = state["generated_spec"]
+    # 记录纯度分析结果，复用时据此决定是否读取结果缓存
+    pure, impure_reasons = PurityAnalyzer().analyze(state["generated_spec"]["code"])
+    spec = {**state["generated_spec"], "pure": pure}
     
-    registry_logger.info(f"注册工具: {spec['name']}")
+    registry_logger.info(f"注册工具: {spec['name']} ({'纯函数' if pure else '非纯函数: ' + '; '.join(impure_reasons)})")
     registry_logger.info(f"工具规格: {json.dumps(spec, ensure_ascii=False, indent=2)}")
     
     # 1. 保存为 Python 文件
@@ -570,6 +1096,9 @@ def register_tool_node(state: SelfToolState) -> dict:
     cached = tool_cache.set_tool(spec)
     registry_logger.info(f"Redis 缓存: {'成功' if cached else '失败'}")
     
+    # 任务已能成功生成工具，清除此前的失败记录
+    negative_cache.clear(state["task_description"], state.get("task_category", "other"))
+    
     status = []
     if file_path:
         status.append("已保存文件")
@@ -588,22 +1117,57 @@ def register_tool_node(state: SelfToolState) -> dict:
     }
 
 
-def use_existing_tool_node(state: SelfToolState) -> dict:
-    """使用已有工具"""
+async def use_existing_tool_node(state: TaskState, writer: StreamWriter) -> dict:
+    """使用已有工具 (纯工具优先读取结果缓存，命中时不进入沙箱)"""
     print("\n[使用已有工具]")
     
     tool = state["matched_tool"]
-    executor = SafeExecutor()
+    issues = _registered_tool_issues(tool)
+    if issues:
+        print(f"  工具 {tool['name']} 未通过当前安全规则: {issues}")
+        return {
+            "execution_result": None,
+            "execution_error": "已注册工具未通过当前安全规则: " + "; ".join(issues),
+            "current_node": "use_existing",
+        }
+    
+    category = tool.get("category", "other")
+    args = state.get("tool_arguments") or {}
+    pure = _is_pure_tool(tool)
+    result_key = tool_result_cache.make_key(tool["code"], args)
+    
+    if pure:
+        cached = tool_result_cache.get(result_key, category)
+        if cached is not None:
+            cached, result_ref = blob_store.offload(cached)
+            print(f"  工具 {tool['name']} 结果缓存命中: {cached}")
+            sandbox_logger.info(f"纯工具结果缓存命中: {tool['name']}")
+            tool_registry.record_usage(tool["name"])
+            writer({"type": "tool_result", "task_id": state["task_id"], "tool": tool["name"], "result": cached})
+            return {
+                "execution_result": cached,
+                "result_ref": result_ref,
+                "execution_error": None,
+                "execution_time_ms": 0,
+                "current_node": "use_existing",
+            }
     
     start_time = time.time()
     
     try:
-        result = executor.execute(tool["code"], tool["name"])
+        result = await _run_tool(tool["code"], tool["name"], args, _tool_cost_class(tool))
         elapsed_ms = int((time.time() - start_time) * 1000)
         
+        result = str(result)
+        tool_registry.record_usage(tool["name"])
+        if pure:
+            tool_result_cache.set(result_key, result, category)
+        result, result_ref = blob_store.offload(result)
         print(f"  执行工具 {tool['name']}: {result} ({elapsed_ms}ms)")
+        writer({"type": "tool_result", "task_id": state["task_id"], "tool": tool["name"], "result": result})
         return {
-            "execution_result": str(result),
+            "execution_result": result,
+            "result_ref": result_ref,
             "execution_error": None,
             "execution_time_ms": elapsed_ms,
             "current_node": "use_existing",
@@ -616,8 +1180,63 @@ def use_existing_tool_node(state: SelfToolState) -> dict:
         }
 
 
-async def format_response_node(state: SelfToolState) -> dict:
-    """润色节点: 将工具执行结果格式化为自然语言"""
+async def _run_tool(code: str, func_name: str, args: dict, cost_class: str):
+    """按沙箱后端执行工具: process 在工作进程中执行 (不阻塞事件循环)，inline 在当前进程中执行，
+    auto 时只有成本为 trivial 的工具在当前进程中执行"""
+    backend = config.SANDBOX_BACKEND
+    if backend == "process" or (backend == "auto" and cost_class != "trivial"):
+        sandbox_logger.info(f"隔离执行 (成本: {cost_class})")
+        return await process_sandbox.execute(code, func_name, args)
+    sandbox_logger.info(f"进程内执行 (成本: {cost_class})")
+    return safe_executor.execute(code, func_name, args)
+
+
+async def _run_tool_batch(calls: list, cost_classes: list) -> list:
+    """批量执行工具 [(代码, 函数名, 参数)]，返回每项的 (结果, 错误信息)；
+    隔离规则与 _run_tool 相同，任一工具需要隔离时整批在一个工作进程中执行"""
+    backend = config.SANDBOX_BACKEND
+    if backend == "process" or (backend == "auto" and any(c != "trivial" for c in cost_classes)):
+        sandbox_logger.info(f"批量隔离执行 {len(calls)} 个工具 (成本: {cost_classes})")
+        return await process_sandbox.execute_batch(calls)
+    sandbox_logger.info(f"批量进程内执行 {len(calls)} 个工具")
+    return safe_executor.execute_batch(calls)
+
+
+def _tool_cost_class(spec: dict) -> str:
+    """工具执行成本: 优先使用安全检查时记录的结果，旧工具按代码现场分析"""
+    if "cost_class" in spec:
+        return spec["cost_class"]
+    return CostAnalyzer().cost_class(spec["code"])
+
+
+def _pop_arguments(spec: dict) -> dict:
+    """从 LLM 返回的规格中取出本次调用的实参 (实参不属于工具定义，不随工具注册)"""
+    arguments = spec.pop("arguments", None)
+    return arguments if isinstance(arguments, dict) else {}
+
+
+def _registered_tool_issues(tool: dict) -> list:
+    """已注册工具按当前安全规则复查: 工具文档上的判定与代码和规则版本一致时直接使用，
+    否则重新检查并更新文档 (规则变更后每个工具只需重新检查一次)"""
+    issues = safety_checker.check_with_verdict(tool["code"], tool.get("safety_verdict"))
+    if issues is None:
+        verdict = safety_checker.verdict(tool["code"])
+        tool_registry.update_safety_verdict(tool, verdict)
+        issues = verdict["issues"]
+        if issues:
+            safety_logger.warning(f"已注册工具 {tool['name']} 未通过当前安全规则: {issues}")
+    return issues
+
+
+def _is_pure_tool(spec: dict) -> bool:
+    """工具是否为纯函数: 优先使用注册时记录的结果，旧工具按代码现场分析"""
+    if "pure" in spec:
+        return bool(spec["pure"])
+    return PurityAnalyzer().is_pure(spec.get("code", ""))
+
+
+async def format_response_node(state: SelfToolState, writer: StreamWriter) -> dict:
+    """润色节点: 将工具执行结果格式化为自然语言，生成过程中逐块推送"""
     print("\n[润色] 格式化回复...")
     workflow_logger.info("=" * 60)
     workflow_logger.info("润色节点: 格式化回复")
@@ -626,6 +1245,11 @@ async def format_response_node(state: SelfToolState) -> dict:
     user_request = state.get("user_request", "")
     task_desc = state.get("task_description", "")
     
+    # 状态中只有大结果的预览，润色时才读取完整内容
+    results = state.get("task_results", [])
+    if any(r.get("result_ref") for r in results):
+        tool_result = _combine_results(results, resolve=True)
+    
     prompt = f"""将以下工具执行结果转化为自然、友好的回复给用户。
 
 用户原始请求: {user_request}
@@ -642,9 +1266,12 @@ async def format_response_node(state: SelfToolState) -> dict:
     llm_logger.info("发送润色 Prompt 到 LLM")
     llm_logger.debug(f"Prompt 内容:\n{prompt}")
     
-    response = await llm.ainvoke([HumanMessage(content=prompt)])
+    parts = []
+    async for chunk in _astream_llm("format_response", prompt):
+        parts.append(chunk)
+        writer({"type": "token", "node": "format_response", "content": chunk})
     
-    formatted = response.content.strip()
+    formatted = "".join(parts).strip()
     llm_logger.info(f"润色后回复: {formatted}")
     
     print(f"  润色完成")
@@ -706,8 +1333,7 @@ async def should_continue_node(state: SelfToolState) -> dict:
     llm_logger.info("发送迭代判断 Prompt 到 LLM")
     llm_logger.debug(f"Prompt 内容:\n{prompt}")
     
-    response = await llm.ainvoke([HumanMessage(content=prompt)])
-    result = _extract_json(response.content)
+    result = await _ainvoke_json("should_continue", prompt)
     
     is_complete = result.get("is_complete", True)
     reasoning = result.get("reasoning", "")
@@ -731,13 +1357,46 @@ async def should_continue_node(state: SelfToolState) -> dict:
     }
 
 
-def reject_node(state: SelfToolState) -> dict:
+def reject_node(state: TaskState) -> dict:
     """拒绝节点"""
     print("\n[拒绝] 工具生成失败，已达到最大重试次数")
+    _record_failure(state, state.get("safety_issues") or [])
     return {"error": "工具生成失败，已达到最大重试次数"}
 
 
-def fail_node(state: SelfToolState) -> dict:
+def fail_node(state: TaskState) -> dict:
     """失败节点"""
     print(f"\n[失败] 执行错误: {state['execution_error']}")
     return {"error": f"执行失败: {state['execution_error']}"}
+
+
+def known_failure_node(state: TaskState) -> dict:
+    """快速拒绝节点: 相同任务近期已多次生成失败，不再重复生成"""
+    failure = state["known_failure"]
+    print(f"\n[拒绝] 相同任务近期生成失败，已跳过: {failure['reason']}")
+    return {"error": f"相同任务近期生成失败，已跳过 (原因: {failure['reason']})"}
+
+
+def _known_failure(state: TaskState, count: bool = True) -> Optional[dict]:
+    """检索未命中已有工具后查询负缓存 (依赖前置结果的任务上下文不同，不查负缓存)"""
+    if state.get("dependency_results"):
+        return None
+    lookup = negative_cache.get if count else negative_cache.peek
+    failure = lookup(state["task_description"], state.get("task_category", "other"))
+    if failure and count:
+        workflow_logger.info(f"任务 {state['task_id']} 命中生成失败负缓存: {failure['reason']}")
+    return failure
+
+
+def _record_failure(state: TaskState, issues: List[str]):
+    """重试耗尽仍被安全检查拒绝时写入负缓存
+    
+    只记录确定性的拒绝 (代码违反安全规则)；执行失败、超时、未生成有效规格可能是偶发的，
+    依赖前置结果的任务失败可能与上下文有关，均不记录。
+    """
+    issues = [i for i in issues if i != _NO_SPEC_ISSUE]
+    if not issues or state.get("dependency_results"):
+        return
+    reason = "; ".join(issues)
+    negative_cache.record(state["task_description"], state.get("task_category", "other"), reason, "reject")
+    workflow_logger.info(f"任务已写入生成失败负缓存: {reason}")
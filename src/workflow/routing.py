@@ -1,25 +1,39 @@
 """路由逻辑模块"""
 
-from typing import Literal
-from .state import SelfToolState
+from typing import Literal, List, Union
+from langgraph.types import Send
+from .state import SelfToolState, TaskState
 from ..infra.config import config
 
 
-def route_after_analyze(state: SelfToolState) -> Literal["need_tool", "direct_answer"]:
-    """分析后路由: 判断是否需要工具"""
+def route_after_analyze(state: SelfToolState) -> Literal["need_tool", "planned", "direct_answer"]:
+    """分析后路由: 判断是否需要工具，合并模式已规划任务时跳过 plan_tasks"""
     if state.get("need_tool", True):
+        if state.get("task_list"):
+            return "planned"
         return "need_tool"
     return "direct_answer"
 
 
-def route_after_search(state: SelfToolState) -> Literal["use_existing", "generate"]:
-    """检索后路由"""
+def route_after_search(state: TaskState) -> Literal["use_existing", "known_failure", "speculated", "generate"]:
+    """检索后路由: 未命中已有工具且近期生成失败的任务快速拒绝，推测生成已产出工具规格时直接进入安全检查"""
     if state.get("matched_tool"):
         return "use_existing"
+    if state.get("known_failure"):
+        return "known_failure"
+    if state.get("generated_spec"):
+        return "speculated"
     return "generate"
 
 
-def route_after_safety(state: SelfToolState) -> Literal["execute", "regenerate", "reject"]:
+def route_after_prepare(state: TaskState) -> Literal["batched", "search"]:
+    """准备后路由: 分发阶段已批量生成工具规格时跳过检索和生成"""
+    if state.get("generated_spec"):
+        return "batched"
+    return "search"
+
+
+def route_after_safety(state: TaskState) -> Literal["execute", "regenerate", "reject"]:
     """安全检查后路由"""
     if state.get("safety_status") == "passed":
         return "execute"
@@ -28,7 +42,7 @@ def route_after_safety(state: SelfToolState) -> Literal["execute", "regenerate",
     return "reject"
 
 
-def route_after_execute(state: SelfToolState) -> Literal["register", "regenerate", "fail"]:
+def route_after_execute(state: TaskState) -> Literal["register", "regenerate", "fail"]:
     """执行后路由"""
     if state.get("execution_error") is None:
         return "register"
@@ -37,14 +51,51 @@ def route_after_execute(state: SelfToolState) -> Literal["register", "regenerate
     return "fail"
 
 
-def route_after_save_result(state: SelfToolState) -> Literal["next_task", "aggregate"]:
-    """保存结果后路由: 判断是否还有下一个任务"""
-    current = state.get("current_task_index", 0)
-    total = len(state.get("task_list", []))
+def select_ready_tasks(state: SelfToolState) -> List[dict]:
+    """选出本轮可执行的任务: 未完成且依赖均已完成"""
+    results = {r["task_id"] for r in state.get("task_results", [])}
+    pending = [t for t in state.get("task_list", []) if t["id"] not in results]
+    
+    ready = [t for t in pending if all(d in results for d in t.get("depends_on", []))]
+    if not ready:
+        # 依赖无法满足 (如引用了不存在的任务)，忽略依赖直接执行，避免死锁
+        ready = pending
+    return ready
+
+
+def route_after_dispatch(state: SelfToolState) -> Union[List[Send], Literal["aggregate"]]:
+    """分发后路由: 依赖已满足的任务并行扇出，全部完成后汇总"""
+    tasks = state.get("task_list", [])
+    results = {r["task_id"]: r for r in state.get("task_results", [])}
+    ready = select_ready_tasks(state)
     
-    if current < total:
-        return "next_task"
-    return "aggregate"
+    if not ready:
+        return "aggregate"
+    
+    batch_specs = {b["task_id"]: b for b in state.get("batch_specs") or []}
+    
+    sends = []
+    for t in ready:
+        payload = {
+            "task_id": t["id"],
+            "task_description": t["description"],
+            "task_category": t.get("category", "other"),
+            "task_total": len(tasks),
+            "dependency_results": [results[d] for d in t.get("depends_on", []) if d in results],
+        }
+        if t["id"] in batch_specs:
+            payload["generated_spec"] = batch_specs[t["id"]]["spec"]
+            payload["tool_arguments"] = batch_specs[t["id"]].get("arguments") or {}
+            payload["generation_cache_entry"] = batch_specs[t["id"]].get("cache_entry")
+        sends.append(Send("run_task", payload))
+    return sends
+
+
+def route_after_aggregate(state: SelfToolState) -> Literal["format", "fail"]:
+    """汇总后路由: 全部任务失败时直接结束"""
+    if state.get("error"):
+        return "fail"
+    return "format"
 
 
 def route_after_should_continue(state: SelfToolState) -> Literal["continue", "end"]:
@@ -0,0 +1,117 @@
+"""请求执行模块 - 交互模式、服务端和批处理共用的图调用入口"""
+
+import asyncio
+import contextlib
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Optional
+from .graph import self_tool_graph, oneshot_graph
+from ..execution.sandbox import safe_executor
+from ..infra.config import config
+from ..infra.logger import workflow_logger
+from ..storage.registry import tool_registry
+
+
+def warm_up_executor() -> int:
+    """启动预热: 预编译注册表中最常用的工具，首次复用时无需编译"""
+    count = safe_executor.warm_up(tool_registry.list_hot_tools(config.EXECUTOR_WARMUP_TOOLS))
+    if count:
+        workflow_logger.info(f"已预编译 {count} 个常用工具")
+    return count
+
+
+def build_input_state(user_request: str) -> dict:
+    """构建单次请求的输入状态
+    
+    只传入当前请求，checkpoint 会自动恢复历史状态；
+    重置迭代计数、任务列表以及上一轮的结果和错误（每个新请求都是新的执行）。
+    """
+    return {
+        "user_request": user_request,
+        "iteration_count": 0,
+        "task_list": [],
+        "task_results": [],
+        "execution_result": None,
+        "error": None,
+    }
+
+
+def build_run_config(thread_id: Optional[str] = None) -> dict:
+    """构建图运行配置（带会话配置）
+    
+    指定会话时使用带 checkpointer 的图，按 thread_id 恢复和保存状态；
+    未指定会话时使用不带 checkpointer 的 oneshot_graph，不生成会话 ID，也不写入 checkpoint。
+    """
+    return {
+        "configurable": {"thread_id": thread_id} if thread_id else {},
+        "recursion_limit": 100,  # 增加递归限制，支持多任务多迭代
+    }
+
+
+async def run_request(
+    user_request: str,
+    thread_id: Optional[str] = None,
+    on_event: Optional[Callable[[dict], Awaitable[None]]] = None,
+) -> dict:
+    """流式运行图并返回最终状态
+    
+    on_event 接收 custom 事件 (工具原始结果、润色 token)，用于实时推送。
+    """
+    result = {}
+    graph = self_tool_graph if thread_id else oneshot_graph
+    async for mode, chunk in graph.astream(
+        build_input_state(user_request),
+        config=build_run_config(thread_id),
+        stream_mode=["custom", "values"],
+    ):
+        if mode == "values":
+            result = chunk
+        elif on_event:
+            await on_event(chunk)
+    return result
+
+
+def summarize_result(result: dict) -> dict:
+    """提取对外输出的结果字段"""
+    return {
+        "need_tool": result.get("need_tool", True),
+        "execution_result": result.get("execution_result"),
+        "error": result.get("error"),
+        "tool_file": result.get("tool_file"),
+        "tool_registered": result.get("tool_registered", False),
+        "tool_cached": result.get("tool_cached", False),
+        "execution_time_ms": result.get("execution_time_ms", 0),
+        "task_results": result.get("task_results", []),
+    }
+
+
+class SessionScheduler:
+    """请求调度: 全局并发上限 + 同一会话按到达顺序串行 (asyncio.Lock 按等待顺序唤醒)"""
+    
+    def __init__(self, max_concurrency: int):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users = Counter()  # thread_id -> 持有或等待锁的请求数
+    
+    @property
+    def active_sessions(self) -> int:
+        return len(self._locks)
+    
+    @contextlib.asynccontextmanager
+    async def slot(self, thread_id: Optional[str]):
+        """获取执行槽位: 先按会话排队，再占用并发额度"""
+        if not thread_id:
+            async with self._semaphore:
+                yield
+            return
+        
+        lock = self._locks.setdefault(thread_id, asyncio.Lock())
+        self._users[thread_id] += 1
+        try:
+            async with lock:
+                async with self._semaphore:
+                    yield
+        finally:
+            self._users[thread_id] -= 1
+            if self._users[thread_id] <= 0:
+                del self._users[thread_id]
+                del self._locks[thread_id]
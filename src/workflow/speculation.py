@@ -0,0 +1,59 @@
+"""推测执行统计模块
+
+工具检索阶段可在 LLM 判断是否复用的同时并行生成新工具。
+按分类记录推测是否有效，以便调整哪些分类值得推测。
+命中率按最近若干次推测的滑动窗口计算；命中率过低而停止推测的分类仍按探索概率偶尔推测，
+新的结果进入窗口，命中率回升后自动恢复。
+"""
+
+import random
+from collections import defaultdict, deque
+from ..infra.config import config
+
+
+class SpeculationStats:
+    """推测生成的分类统计"""
+    
+    def __init__(self):
+        self._stats = defaultdict(lambda: {"launched": 0, "paid_off": 0, "wasted": 0})
+        self._recent = defaultdict(lambda: deque(maxlen=config.SPECULATION_WINDOW))  # 最近的推测结果 (是否采用)
+    
+    def should_speculate(self, category: str) -> bool:
+        """判断该分类是否启用推测生成"""
+        if not config.SPECULATIVE_GENERATION:
+            return False
+        if config.SPECULATIVE_CATEGORIES and category not in config.SPECULATIVE_CATEGORIES:
+            return False
+        
+        # 样本足够且近期命中率过低时关闭该分类的推测，避免浪费 LLM 调用；仅按探索概率偶尔推测
+        recent = self._recent[category]
+        enough = len(recent) >= min(config.SPECULATION_MIN_SAMPLES, recent.maxlen)
+        if enough and self._payoff_rate(recent) < config.SPECULATION_MIN_PAYOFF_RATE:
+            return random.random() < config.SPECULATION_EXPLORE_RATE
+        return True
+    
+    @staticmethod
+    def _payoff_rate(outcomes) -> float:
+        return round(sum(outcomes) / len(outcomes), 3) if outcomes else 0.0
+    
+    def record(self, category: str, paid_off: bool):
+        """记录一次推测结果: paid_off 表示最终需要生成新工具，推测结果被采用"""
+        counters = self._stats[category]
+        counters["launched"] += 1
+        counters["paid_off" if paid_off else "wasted"] += 1
+        self._recent[category].append(paid_off)
+    
+    def stats(self) -> dict:
+        """获取各分类的推测统计"""
+        return {
+            category: {
+                **counters,
+                "payoff_rate": round(counters["paid_off"] / counters["launched"], 3) if counters["launched"] else 0.0,
+                "recent_payoff_rate": self._payoff_rate(self._recent[category]),
+            }
+            for category, counters in self._stats.items()
+        }
+
+
+# 全局推测统计实例
+speculation_stats = SpeculationStats()
@@ -4,6 +4,16 @@ from typing import TypedDict, Annotated, Optional, Literal, List
 from langgraph.graph.message import add_messages
 
 
+def merge_task_results(left: List[dict], right: List[dict]) -> List[dict]:
+    """任务结果合并: 并行分支的结果按 task_id 合并并排序，空列表表示重置"""
+    if not right:
+        return []
+    merged = {r["task_id"]: r for r in (left or [])}
+    for r in right:
+        merged[r["task_id"]] = r
+    return sorted(merged.values(), key=lambda r: r["task_id"])
+
+
 class ToolSpec(TypedDict):
     """生成的工具规格"""
     name: str
@@ -25,9 +35,9 @@ class SelfToolState(TypedDict):
     need_tool: bool  # 是否需要工具
     
     # 多任务规划
-    task_list: List[dict]           # 子任务列表
-    current_task_index: int          # 当前任务索引
-    task_results: List[dict]         # 各任务执行结果
+    task_list: List[dict]           # 子任务列表 (含 depends_on 依赖)
+    task_results: Annotated[List[dict], merge_task_results]  # 各任务执行结果 (按 task_id 排序)
+    batch_specs: List[dict]         # 本轮批量生成的工具规格 [{"task_id", "spec", "arguments"}]
     
     # 工具检索
     existing_tools: List[str]
@@ -55,6 +65,7 @@ class SelfToolState(TypedDict):
     
     # 消息
     messages: Annotated[list, add_messages]
+    conversation_summary: dict  # 滚动摘要 {"summary", "covered_ids"}，与移除的消息一起写入 checkpoint
     
     # 流程控制
     current_node: str
@@ -66,6 +77,50 @@ class SelfToolState(TypedDict):
     continue_reasoning: Optional[str] # LLM判断是否继续的理由
 
 
+class TaskState(TypedDict):
+    """单个子任务的执行状态 (并行分支独立持有)"""
+    
+    # 任务输入
+    task_id: int
+    task_description: str
+    task_category: str
+    task_total: int                  # 本次请求的任务总数 (仅用于展示)
+    dependency_results: List[dict]   # 前置任务的执行结果
+    
+    # 工具检索
+    existing_tools: List[str]
+    matched_tool: Optional[ToolSpec]
+    need_generate: bool
+    tool_arguments: Optional[dict]   # 本任务调用工具的实参
+    known_failure: Optional[dict]    # 负缓存中的近期失败记录 (命中时快速拒绝)
+    
+    # 代码生成
+    generated_spec: Optional[ToolSpec]
+    generation_attempt: int
+    generation_feedback: str
+    generation_cache_entry: Optional[dict]  # 本次生成响应的 LLM 缓存条目 {"node", "key"}，工具不可用时删除
+    
+    # 安全检查
+    safety_status: Literal["pending", "passed", "failed"]
+    safety_issues: List[str]
+    
+    # 执行
+    execution_result: Optional[str]
+    execution_error: Optional[str]
+    execution_time_ms: int
+    result_ref: Optional[str]       # 大结果外置存储的引用 (此时 execution_result 为预览)
+    
+    # 注册
+    tool_registered: bool
+    tool_cached: bool
+    tool_file: Optional[str]
+    
+    # 输出
+    task_result: Optional[dict]
+    current_node: str
+    error: Optional[str]
+
+
 def create_initial_state(user_request: str) -> SelfToolState:
     """创建初始状态"""
     return {
@@ -74,8 +129,8 @@ def create_initial_state(user_request: str) -> SelfToolState:
         "task_category": "other",
         "need_tool": True,
         "task_list": [],
-        "current_task_index": 0,
         "task_results": [],
+        "batch_specs": [],
         "existing_tools": [],
         "matched_tool": None,
         "need_generate": False,
@@ -91,6 +146,7 @@ def create_initial_state(user_request: str) -> SelfToolState:
         "tool_cached": False,
         "tool_file": None,
         "messages": [],
+        "conversation_summary": {"summary": "", "covered_ids": []},
         "current_node": "start",
         "error": None,
         "iteration_count": 0,
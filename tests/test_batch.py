@@ -0,0 +1,70 @@
+"""批处理测试用例"""
+
+import asyncio
+import io
+import json
+import batch
+from batch import BatchRunner, load_finished_ids, open_output, read_requests
+
+
+class TestBatchRunner:
+    """JSONL 批处理测试"""
+    
+    def _patch_run(self, monkeypatch, events):
+        async def fake_run_request(user_request, thread_id=None, on_event=None):
+            events.append(("start", user_request))
+            await asyncio.sleep(0.01)
+            events.append(("end", user_request))
+            if user_request == "boom":
+                raise RuntimeError("失败")
+            return {"need_tool": True, "execution_result": user_request.upper()}
+        
+        monkeypatch.setattr(batch, "run_request", fake_run_request)
+    
+    async def test_results_streamed_with_session_order(self, monkeypatch):
+        """测试逐行输出结果，同一会话按输入顺序执行"""
+        events = []
+        self._patch_run(monkeypatch, events)
+        source = io.StringIO("\n".join([
+            json.dumps({"id": "a1", "thread_id": "a", "request": "a1"}),
+            json.dumps({"id": "a2", "thread_id": "a", "request": "a2"}),
+            json.dumps("b1"),
+            "not json",
+            json.dumps({"id": "x", "request": "boom"}),
+        ]))
+        output = io.StringIO()
+        runner = BatchRunner(output, concurrency=4)
+        await runner.run(read_requests(source), finished=set())
+        
+        records = {r["id"]: r for r in map(json.loads, output.getvalue().splitlines())}
+        assert records["a1"]["result"]["execution_result"] == "A1"
+        assert records["line-3"]["ok"] is True
+        assert records["line-4"]["ok"] is False
+        assert "RuntimeError" in records["x"]["error"]
+        assert events.index(("end", "a1")) < events.index(("start", "a2"))
+        assert runner.counts == {"ok": 3, "failed": 2, "skipped": 0}
+    
+    async def test_resume_skips_finished_ids(self, monkeypatch, tmp_path):
+        """测试断点续跑跳过已完成的请求，可选重跑失败的请求"""
+        events = []
+        self._patch_run(monkeypatch, events)
+        path = tmp_path / "results.jsonl"
+        path.write_text(
+            json.dumps({"id": "r1", "ok": True}) + "\n"
+            + json.dumps({"id": "r2", "ok": False}) + "\n"
+            + '{"id": "r3", "ok"',  # 中断时写了一半的行
+            encoding="utf-8",
+        )
+        assert load_finished_ids(str(path)) == {"r1", "r2"}
+        finished = load_finished_ids(str(path), retry_failed=True)
+        assert finished == {"r1"}
+        
+        source = io.StringIO("\n".join(json.dumps({"id": i, "request": i}) for i in ["r1", "r2", "r3"]))
+        with open_output(str(path)) as output:
+            runner = BatchRunner(output, concurrency=2)
+            await runner.run(read_requests(source), finished)
+        
+        assert [e[1] for e in events if e[0] == "start"] == ["r2", "r3"]
+        lines = path.read_text(encoding="utf-8").splitlines()
+        assert json.loads(lines[-1])["ok"] is True
+        assert runner.counts["skipped"] == 1
@@ -2,9 +2,9 @@
 
 import pytest
 import asyncio
-from src.state import create_initial_state
-from src.safety import CodeSafetyChecker
-from src.sandbox import SafeExecutor
+from src.workflow.state import create_initial_state
+from src.execution.safety import CodeSafetyChecker
+from src.execution.sandbox import SafeExecutor
 
 
 class TestSafety:
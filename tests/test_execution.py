@@ -0,0 +1,298 @@
+"""执行层测试用例"""
+
+import asyncio
+import os
+import pytest
+from src.execution.cost import CostAnalyzer
+from src.execution.process_pool import ProcessSandbox, SandboxTimeoutError
+from src.execution.purity import PurityAnalyzer
+from src.execution.repair import SafetyRepairer
+from src.execution.safety import CodeSafetyChecker
+from src.execution.sandbox import SafeExecutor
+from src.storage.result_cache import ToolResultCache
+
+
+class TestPurityAnalyzer:
+    """工具纯度分析测试"""
+    
+    def test_arithmetic_is_pure(self):
+        """测试纯计算工具"""
+        code = "def calculate_result() -> str:\n    import math\n    return str(123 * 456 + math.sqrt(4))"
+        assert PurityAnalyzer().analyze(code) == (True, [])
+    
+    def test_time_and_random_are_impure(self):
+        """测试依赖当前时间或随机数的工具"""
+        analyzer = PurityAnalyzer()
+        assert not analyzer.is_pure(
+            "def f() -> str:\n    from datetime import datetime\n    return datetime.now().isoformat()"
+        )
+        assert not analyzer.is_pure("def f() -> str:\n    import time\n    return str(time.time())")
+        assert not analyzer.is_pure("def f() -> str:\n    import random\n    return str(random.randint(1, 6))")
+        assert not analyzer.is_pure("def f() -> str:\n    import datetime\n    return str(datetime.date.today())")
+
+
+class TestToolArguments:
+    """参数化工具测试"""
+    
+    CODE = "def multiply_numbers(a: int, b: int) -> str:\n    return str(a * b)"
+    PARAMETERS = {"a": {"type": "int"}, "b": "int"}
+    
+    def test_execute_with_arguments(self):
+        """测试同一工具用不同实参执行"""
+        executor = SafeExecutor()
+        assert executor.execute(self.CODE, "multiply_numbers", {"a": 123, "b": 456}) == "56088"
+        assert executor.execute(self.CODE, "multiply_numbers", {"a": 7, "b": 8}) == "56"
+    
+    def test_coerce_arguments(self):
+        """测试实参类型转换和校验"""
+        assert SafeExecutor.coerce_arguments(self.PARAMETERS, {"a": "12", "b": 3.0, "c": 1}) == {"a": 12, "b": 3}
+        assert SafeExecutor.coerce_arguments({"flag": "bool"}, {"flag": "false"}) == {"flag": False}
+        assert SafeExecutor.coerce_arguments({"x": {"type": "float", "default": 1.0}}, {}) == {}
+        assert SafeExecutor.coerce_arguments({}, None) == {}
+        
+        with pytest.raises(ValueError, match="缺少参数"):
+            SafeExecutor.coerce_arguments(self.PARAMETERS, {"a": 1})
+        with pytest.raises(ValueError, match="类型错误"):
+            SafeExecutor.coerce_arguments(self.PARAMETERS, {"a": "abc", "b": 1})
+        with pytest.raises(ValueError, match="类型错误"):
+            SafeExecutor.coerce_arguments(self.PARAMETERS, {"a": 1.5, "b": 1})
+    
+    def test_result_cache_key_includes_arguments(self):
+        """测试结果缓存键区分实参"""
+        assert ToolResultCache.make_key(self.CODE, {"a": 1, "b": 2}) == ToolResultCache.make_key(self.CODE, {"b": 2, "a": 1})
+        assert ToolResultCache.make_key(self.CODE, {"a": 1, "b": 2}) != ToolResultCache.make_key(self.CODE, {"a": 2, "b": 1})
+
+
+class TestCodeSafetyChecker:
+    """单次遍历安全检查与判定缓存测试"""
+    
+    @pytest.mark.parametrize("code", [
+        "def f(path: str) -> str:\n    return reopen(path)",
+        "import re\ndef f(text: str) -> str:\n    return str(re.compile(r'\\d+').findall(text))",
+        "def f(input: str) -> str:\n    return input.upper()",
+        "def f() -> str:\n    return 'import os; eval(1)'",
+    ])
+    def test_no_substring_false_positives(self, code):
+        """测试名称包含禁止函数、字符串中出现禁止内容不再误报"""
+        assert CodeSafetyChecker().check_all(code) == []
+    
+    def test_issues_collected_in_one_pass(self):
+        """测试每个问题只报告一次并附带行号"""
+        code = "import os\nfrom subprocess import run\ndef f() -> str:\n    return str(eval('1'))"
+        assert CodeSafetyChecker().check_all(code) == [
+            "禁止导入模块: os (第 1 行)",
+            "禁止导入模块: subprocess (第 2 行)",
+            "禁止使用函数: eval (第 4 行)",
+        ]
+    
+    def test_verdict_cached_per_ruleset(self, monkeypatch):
+        """测试相同代码只分析一次，规则版本变化后重新分析"""
+        checker = CodeSafetyChecker()
+        code = "def f() -> str:\n    return open('x').read()"
+        assert checker.check_all(code) == checker.check_all(code)
+        assert checker.stats()["check"] == 1 and checker.stats()["hit"] == 1
+        
+        verdict = checker.verdict(code)
+        assert CodeSafetyChecker().check_with_verdict(code, verdict) == verdict["issues"]
+        assert CodeSafetyChecker().check_with_verdict(code + "\n", verdict) is None
+        monkeypatch.setattr(CodeSafetyChecker, "RULES_REVISION", CodeSafetyChecker.RULES_REVISION + 1)
+        assert CodeSafetyChecker().check_with_verdict(code, verdict) is None
+
+
+class TestSafetyRepairer:
+    """安全问题自动修复测试"""
+    
+    def test_repairs_mechanical_violations(self):
+        """测试删除未使用的禁止导入和 print、改写白名单模块 getattr"""
+        code = (
+            "import os\nimport math\n"
+            "def f() -> str:\n"
+            "    print(os.sep)\n"
+            "    return str(getattr(math, 'sqrt')(16))"
+        )
+        assert CodeSafetyChecker().check_all(code)
+        
+        repairer = SafetyRepairer()
+        repaired, fixes = repairer.try_fix(code)
+        assert CodeSafetyChecker().check_all(repaired) == []
+        assert SafeExecutor().execute(repaired, "f") == "4.0"
+        assert len(fixes) == 3
+        assert repairer.stats() == {"attempted": 1, "saved": 1}
+    
+    def test_print_side_effects_kept(self):
+        """测试 print 参数中的调用保留为语句，只剩 finally 的 try 语句补 pass"""
+        code = (
+            "import os\n"
+            "def f(s: str) -> str:\n"
+            "    lst = list(s)\n"
+            "    try:\n"
+            "        print(lst.pop(), os.sep)\n"
+            "    finally:\n"
+            "        print(os.sep)\n"
+            "    return ''.join(lst)"
+        )
+        repaired, fixes = SafetyRepairer().try_fix(code)
+        assert SafeExecutor().execute(repaired, "f", {"s": "abc"}) == "ab"
+        assert "print 语句改写为其有副作用的参数表达式" in fixes
+    
+    def test_unrepairable_code_needs_regeneration(self):
+        """测试实际使用禁止模块 (含 print 参数中的调用) 或访问私有属性的代码不修复"""
+        repairer = SafetyRepairer()
+        assert repairer.try_fix("import os\ndef f() -> str:\n    return os.getcwd()") is None
+        assert repairer.try_fix("import os\ndef f() -> str:\n    print(os.getcwd())\n    return ''") is None
+        assert repairer.try_fix("import math\ndef f() -> str:\n    return str(getattr(math, '__loader__'))") is None
+        assert repairer.stats() == {"attempted": 3, "failed": 3}
+
+
+class TestCompiledToolCache:
+    """编译缓存测试"""
+    
+    def test_repeated_execution_compiles_once(self):
+        """测试相同代码只编译一次"""
+        executor = SafeExecutor()
+        for a in range(3):
+            assert executor.execute(TestToolArguments.CODE, "multiply_numbers", {"a": a, "b": 2}) == str(a * 2)
+        assert executor.stats() == {"compile": 1, "hit": 2, "entries": 1}
+    
+    def test_lru_eviction(self):
+        """测试超出容量时淘汰最久未使用的工具"""
+        executor = SafeExecutor(cache_size=2)
+        codes = [f"def f() -> str:\n    return '{i}'" for i in range(3)]
+        for code in codes:
+            executor.execute(code, "f")
+        executor.execute(codes[0], "f")
+        assert executor.stats()["compile"] == 4
+        assert executor.stats()["entries"] == 2
+    
+    def test_builtins_not_shared_between_tools(self):
+        """测试工具修改内置函数不影响其他工具"""
+        executor = SafeExecutor()
+        executor.execute("def f() -> str:\n    __builtins__['len'] = lambda x: 0\n    return ''", "f")
+        assert executor.execute("def g() -> str:\n    return str(len('abc'))", "g") == "3"
+    
+    def test_state_not_shared_between_calls(self):
+        """测试同一工具的多次调用不共享模块级变量和可变默认参数"""
+        executor = SafeExecutor()
+        code = "seen = []\ndef remember(name: str, acc=[]) -> str:\n    seen.append(name)\n    acc.append(name)\n    return ','.join(seen + acc)"
+        assert executor.execute(code, "remember", {"name": "alice-secret"}) == "alice-secret,alice-secret"
+        assert executor.execute(code, "remember", {"name": "bob"}) == "bob,bob"
+        assert executor.stats()["compile"] == 1
+    
+    def test_warm_up(self):
+        """测试预热只编译不执行工具代码，无法编译的工具被跳过"""
+        executor = SafeExecutor()
+        tools = [{"code": TestToolArguments.CODE}, {"code": "def broken(:"}, {"code": "x = 1 / 0\ndef f() -> str:\n    return ''"}]
+        assert executor.warm_up(tools) == 2
+        executor.execute(TestToolArguments.CODE, "multiply_numbers", {"a": 1, "b": 1})
+        assert executor.stats()["hit"] == 1
+
+
+class TestProcessSandbox:
+    """进程池沙箱测试"""
+    
+    LOOP_CODE = "def spin() -> str:\n    while True:\n        pass"
+    
+    @pytest.fixture
+    def sandbox(self):
+        sandbox = ProcessSandbox(pool_size=1, timeout=0.5, max_runs=3)
+        yield sandbox
+        sandbox.close()
+    
+    async def test_execute_in_worker(self, sandbox):
+        """测试在工作进程中执行工具，工具自身异常不替换进程"""
+        assert await sandbox.execute(TestToolArguments.CODE, "multiply_numbers", {"a": 6, "b": 7}) == "42"
+        with pytest.raises(RuntimeError, match="division by zero"):
+            await sandbox.execute("def f() -> str:\n    return str(1 / 0)", "f")
+        assert sandbox.stats() == {"runs": 2}
+    
+    async def test_timeout_does_not_block_loop(self, sandbox):
+        """测试死循环超时后替换进程，期间事件循环不被阻塞"""
+        ticks = 0
+        
+        async def ticker():
+            nonlocal ticks
+            for _ in range(3):
+                await asyncio.sleep(0.05)
+                ticks += 1
+        
+        results = await asyncio.gather(sandbox.execute(self.LOOP_CODE, "spin"), ticker(), return_exceptions=True)
+        assert isinstance(results[0], SandboxTimeoutError)
+        assert ticks == 3
+        assert await sandbox.execute("def f() -> str:\n    return 'ok'", "f") == "ok"
+        assert sandbox.stats()["timeouts"] == 1 and sandbox.stats()["recycled"] == 1
+    
+    async def test_batch_single_round_trip(self, sandbox):
+        """测试批量执行一次往返返回每项结果，单项异常不影响其他项"""
+        calls = [
+            (TestToolArguments.CODE, "multiply_numbers", {"a": 6, "b": 7}),
+            ("def f() -> str:\n    return str(1 / 0)", "f", None),
+            ("def g() -> str:\n    return 'ok'", "g", {}),
+        ]
+        assert await sandbox.execute_batch(calls) == [("42", None), (None, "division by zero"), ("ok", None)]
+        assert sandbox.stats()["runs"] == 3 and sandbox.stats()["batches"] == 1
+    
+    async def test_batch_timeout_falls_back_per_item(self, sandbox):
+        """测试整批超时后逐项重新执行，只有死循环的工具失败"""
+        calls = [("def f() -> str:\n    return 'ok'", "f", None), (self.LOOP_CODE, "spin", None)]
+        results = await sandbox.execute_batch(calls)
+        assert results[0] == ("ok", None)
+        assert results[1][0] is None and "超时" in results[1][1]
+        assert sandbox.stats()["batch_fallbacks"] == 1
+    
+    async def test_worker_recycled_after_max_runs(self, sandbox):
+        """测试执行次数达到上限后替换工作进程"""
+        for _ in range(4):
+            await sandbox.execute("def f() -> str:\n    return 'ok'", "f")
+        assert sandbox.stats()["recycled"] == 1
+    
+    async def test_workers_not_forked_from_main_process(self, sandbox):
+        """测试工作进程 (含替换进程) 由 forkserver 派生，而不是直接从多线程的主进程 fork"""
+        if sandbox._context.get_start_method() != "forkserver":
+            pytest.skip("平台不支持 forkserver")
+        
+        def parent_pid(pid: int) -> int:
+            with open(f"/proc/{pid}/stat") as f:
+                return int(f.read().rsplit(")", 1)[1].split()[1])
+        
+        for _ in range(4):
+            await sandbox.execute("def f() -> str:\n    return 'ok'", "f")
+        worker = sandbox._idle.queue[0]
+        assert sandbox.stats()["recycled"] == 1
+        assert parent_pid(worker.process.pid) != os.getpid()
+
+
+class TestCostAnalyzer:
+    """执行成本估计测试"""
+    
+    @pytest.mark.parametrize("code, expected", [
+        ("def f(a: int, b: int) -> str:\n    return str(a * b)", "trivial"),
+        ("def f(x: float) -> str:\n    return str(x ** 0.5)", "trivial"),
+        ("def f() -> str:\n    return str([i * i for i in range(100)])", "trivial"),
+        ("def f(s: str) -> str:\n    return ''.join(c.upper() for c in s)", "moderate"),
+        ("def f() -> str:\n    t = 0\n    for i in range(1000):\n        for j in range(1000):\n            t += j\n    return str(t)", "moderate"),
+        ("def f() -> str:\n    return str(sum(range(10 ** 9)))", "heavy"),
+        ("def f() -> str:\n    return 'a' * 10 ** 9", "heavy"),
+        ("def f() -> str:\n    while True:\n        pass", "unknown"),
+        ("def f(n: int) -> str:\n    return '1' if n < 2 else str(n * int(f(n - 1)))", "unknown"),
+        ("def f(n: int) -> str:\n    return str(2 ** n)", "unknown"),
+        ("def f(n: int) -> str:\n    x = [0]\n    return str(len(x * n))", "unknown"),
+        ("def f(s: str, n: int) -> str:\n    return s * n", "unknown"),
+        ("def f() -> str:\n    return '{:>900000000}'.format(1)", "heavy"),
+        ("def f(n: int) -> str:\n    return f'{1:>{n}}' + '%*d' % (n, 1)", "unknown"),
+        ("def f() -> str:\n    return '-' * 20 + f'{3.14159:.2f}'", "trivial"),
+        ("import re\ndef f(s: str) -> str:\n    return str(bool(re.match(r'(a+)+$', s)))", "unknown"),
+        ("import re\nP = re.compile(r'(a+)+$')\ndef f(s: str) -> str:\n    return str(bool(P.match(s)))", "unknown"),
+        ("import re\ndef f(s: str) -> str:\n    return ','.join(re.findall(r'\\d+', s))", "moderate"),
+        ("def f() -> str:\n    x = 'a'\n    for _ in range(60):\n        x = x + x\n    return str(len(x))", "unknown"),
+        ("def f() -> str:\n    x = 2\n    for _ in range(40):\n        x = x * x\n    return str(x)", "unknown"),
+        ("def f() -> str:\n    x = [0]\n    for _ in range(60):\n        x *= 2\n    return str(len(x))", "unknown"),
+        ("def f() -> str:\n    x = 'a'\n    for _ in range(60):\n        x += x\n    return x", "unknown"),
+        ("def f() -> str:\n    t = 0\n    for i in range(10):\n        t += i\n    return str(t)", "trivial"),
+        ("def f() -> str:\n    x = 1\n    x = x * x\n    return str(x)", "trivial"),
+        ("def f() -> str:\n    from time import sleep as nap\n    nap(100)\n    return ''", "unknown"),
+        ("import time\ndef f() -> str:\n    nap = time.sleep\n    nap(100)\n    return ''", "unknown"),
+        ("def f() -> str:\n    from math import factorial as fact\n    return str(fact(10 ** 9))", "heavy"),
+    ])
+    def test_cost_class(self, code, expected):
+        """测试循环规模、递归、序列重复、格式宽度、正则、幂运算、循环中的倍增和别名阻塞调用的成本分类"""
+        assert CostAnalyzer().cost_class(code) == expected
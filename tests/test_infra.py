@@ -0,0 +1,75 @@
+"""基础设施测试用例"""
+
+import asyncio
+import io
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from src.infra.config import config
+from src.infra.llm_gateway import LLMGateway, TokenBucket
+from src.infra.logger import console_to, workflow_logger
+
+
+class FlakyClient:
+    """前 N 次调用超时的模拟 LLM 客户端"""
+    
+    model_name = "fake"
+    temperature = 0.2
+    
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+    
+    async def ainvoke(self, messages):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise asyncio.TimeoutError()
+        return AIMessage(content="ok")
+
+
+class TestLLMGateway:
+    """LLM 网关测试"""
+    
+    @pytest.fixture(autouse=True)
+    def fast_backoff(self, monkeypatch):
+        monkeypatch.setattr(config, "LLM_BACKOFF_BASE", 0.001)
+        monkeypatch.setattr(config, "LLM_BACKOFF_MAX", 0.01)
+    
+    async def test_retry_then_succeed(self):
+        """测试可重试错误后重试成功"""
+        gateway = LLMGateway()
+        gateway._client = FlakyClient(failures=2)
+        response = await gateway.ainvoke([HumanMessage(content="hi")])
+        assert response.content == "ok"
+        metrics = gateway.metrics()
+        assert metrics["retries"] == 2
+        assert metrics["in_flight"] == 0
+    
+    async def test_retries_exhausted(self):
+        """测试重试耗尽后抛出超时"""
+        gateway = LLMGateway()
+        gateway._client = FlakyClient(failures=100)
+        with pytest.raises(asyncio.TimeoutError):
+            await gateway.ainvoke([HumanMessage(content="hi")])
+        assert gateway._client.calls == config.LLM_MAX_RETRIES + 1
+        assert gateway.metrics()["failures"] == 1
+    
+    async def test_token_bucket_waits_when_empty(self):
+        """测试令牌不足时等待补充"""
+        bucket = TokenBucket(per_minute=600)  # 每秒补充 10 个
+        bucket.tokens = 0
+        waited = await bucket.acquire(1)
+        assert 0.05 < waited <= 0.2
+
+
+class TestConsoleRedirect:
+    """控制台日志重定向测试"""
+    
+    def test_console_handlers_follow_stream(self):
+        """测试控制台日志临时写入指定流，退出后恢复"""
+        handler = next(h for h in workflow_logger.handlers if type(h).__name__ == "StreamHandler")
+        original = handler.stream
+        stream = io.StringIO()
+        with console_to(stream):
+            workflow_logger.info("批处理日志")
+        assert "批处理日志" in stream.getvalue()
+        assert handler.stream is original
@@ -0,0 +1,76 @@
+"""服务端测试用例"""
+
+import asyncio
+import json
+import server
+from server import SelfToolServer
+
+
+class TestSelfToolServer:
+    """多会话并发服务测试"""
+    
+    async def _start(self, monkeypatch, delay=0.05):
+        events = []
+        
+        async def fake_run_request(user_request, thread_id=None, on_event=None):
+            events.append(("start", user_request))
+            await asyncio.sleep(delay)
+            events.append(("end", user_request))
+            return {"need_tool": True, "execution_result": user_request.upper()}
+        
+        monkeypatch.setattr(server, "run_request", fake_run_request)
+        monkeypatch.setattr(server.connection_manager, "close_all", lambda: None)
+        srv = SelfToolServer("127.0.0.1", 0, max_concurrency=4)
+        await srv.start()
+        return srv, events
+    
+    async def _call(self, port, messages):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for m in messages:
+            writer.write(json.dumps(m).encode() + b"\n")
+        await writer.drain()
+        writer.write_eof()
+        replies = [json.loads(line) async for line in reader]
+        writer.close()
+        return replies
+    
+    async def test_same_session_serialized_other_sessions_concurrent(self, monkeypatch):
+        """测试同一会话串行、不同会话并发"""
+        srv, events = await self._start(monkeypatch)
+        replies = await self._call(srv.port, [
+            {"id": 1, "thread_id": "a", "request": "a1"},
+            {"id": 2, "thread_id": "a", "request": "a2"},
+            {"id": 3, "thread_id": "b", "request": "b1"},
+        ])
+        await srv.shutdown()
+        
+        assert {r["id"] for r in replies} == {1, 2, 3}
+        assert all(r["ok"] for r in replies)
+        assert events.index(("end", "a1")) < events.index(("start", "a2"))
+        assert events.index(("start", "b1")) < events.index(("end", "a1"))
+        assert srv.stats()["sessions"] == 0
+    
+    async def test_shutdown_drains_in_flight_requests(self, monkeypatch):
+        """测试关闭时等待在途请求完成"""
+        srv, events = await self._start(monkeypatch, delay=0.1)
+        reader, writer = await asyncio.open_connection("127.0.0.1", srv.port)
+        writer.write(json.dumps({"id": 1, "request": "x"}).encode() + b"\n")
+        await writer.drain()
+        await asyncio.sleep(0.02)
+        
+        await srv.shutdown()
+        reply = json.loads(await reader.readline())
+        writer.close()
+        assert reply["ok"] and reply["result"]["execution_result"] == "X"
+    
+    async def test_invalid_request_rejected(self, monkeypatch):
+        """测试格式错误和空请求"""
+        srv, _ = await self._start(monkeypatch)
+        reader, writer = await asyncio.open_connection("127.0.0.1", srv.port)
+        writer.write(b"not json\n" + json.dumps({"id": 2, "request": ""}).encode() + b"\n")
+        await writer.drain()
+        writer.write_eof()
+        replies = [json.loads(line) async for line in reader]
+        writer.close()
+        await srv.shutdown()
+        assert [r["ok"] for r in replies] == [False, False]
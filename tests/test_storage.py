@@ -0,0 +1,413 @@
+"""存储层测试用例"""
+
+import asyncio
+import fnmatch
+import json
+from src.infra.config import config
+from src.storage.blob_store import BlobStore
+from src.storage.llm_cache import LLMResponseCache
+from src.storage.negative_cache import NegativeCache
+from src.storage.registry import ToolRegistry
+from src.storage.result_cache import ToolResultCache
+from src.storage.singleflight import GenerationSingleflight
+from src.storage.tool_index import ToolIndex
+
+
+class TestLLMCache:
+    """LLM 响应缓存测试"""
+    
+    def _make_cache(self, monkeypatch, max_entries=2):
+        cache = LLMResponseCache(max_entries=max_entries)
+        monkeypatch.setattr(cache, "_get_client", lambda: None)
+        return cache
+    
+    def test_key_depends_on_model_and_temperature(self):
+        """测试缓存键包含模型和温度"""
+        a = LLMResponseCache.make_key("qwen-plus", 0.2, "现在几点了")
+        b = LLMResponseCache.make_key("qwen-plus", 0.7, "现在几点了")
+        assert a != b
+        assert a == LLMResponseCache.make_key("qwen-plus", 0.2, "现在几点了")
+    
+    def test_memory_hit_and_lru_eviction(self, monkeypatch):
+        """测试内存命中与 LRU 淘汰"""
+        cache = self._make_cache(monkeypatch)
+        for i in range(3):
+            cache.set("analyze", f"k{i}", f"v{i}")
+        
+        assert cache.get("analyze", "k0") is None
+        assert cache.get("analyze", "k2") == "v2"
+        stats = cache.stats()["analyze"]
+        assert stats["memory_hit"] == 1
+        assert stats["miss"] == 1
+    
+    def test_bypass_node(self, monkeypatch):
+        """测试跳过缓存的节点"""
+        cache = self._make_cache(monkeypatch)
+        assert cache.set("should_continue", "k", "v") is False
+        assert cache.get("should_continue", "k") is None
+        assert cache.stats()["should_continue"]["bypass"] == 1
+
+
+class TestToolResultCache:
+    """纯工具结果缓存测试"""
+    
+    def test_hit_by_code_hash_and_category_ttl(self, monkeypatch):
+        """测试按代码哈希命中，TTL 为 0 的分类不缓存"""
+        cache = ToolResultCache()
+        monkeypatch.setattr(cache, "_get_client", lambda: None)
+        monkeypatch.setattr(config, "TOOL_RESULT_CACHE_TTL", {"datetime": 0})
+        key = cache.make_key("def f() -> str:\n    return str(123 * 456)")
+        
+        assert cache.get(key, "math") is None
+        cache.set(key, "56088", "math")
+        assert cache.get(key, "math") == "56088"
+        assert cache.set(key, "x", "datetime") is False
+        assert cache.get(key, "datetime") is None
+        assert cache.stats()["hit"] == 1
+
+
+class TestToolIndex:
+    """工具相似度索引测试"""
+    
+    def _make_index(self):
+        index = ToolIndex()
+        index.add({"name": "get_current_timestamp", "description": "获取当前日期和时间的字符串表示", "category": "datetime"})
+        index.add({"name": "generate_password", "description": "生成随机密码", "category": "text"})
+        return index
+    
+    def test_search_ranks_similar_tool_first(self):
+        """测试相似工具排在首位，且不受分类限制"""
+        results = self._make_index().search("获取当前时间", top_k=2, min_score=0.05)
+        assert results[0][0]["name"] == "get_current_timestamp"
+    
+    def test_identical_description_scores_high(self):
+        """测试查询与已存储描述完全一致时达到直接复用阈值"""
+        results = self._make_index().search("生成随机密码", top_k=1)
+        assert results[0][0]["name"] == "generate_password"
+        assert results[0][1] >= config.TOOL_MATCH_THRESHOLD
+    
+    def test_similar_description_below_threshold(self):
+        """测试功能不同的近似描述不会达到直接复用阈值"""
+        index = ToolIndex()
+        index.add({"name": "get_current_time", "description": "获取当前时间"})
+        index.add({"name": "get_pi", "description": "获取圆周率"})
+        index.add({"name": "random_number", "description": "生成一个随机数"})
+        for query in ("获取当前时间戳", "获取当前日期和时间", "生成一个随机密码"):
+            assert index.search(query, top_k=1)[0][1] < config.TOOL_MATCH_THRESHOLD
+    
+    def test_incremental_update(self):
+        """测试同名工具更新时覆盖旧描述"""
+        index = self._make_index()
+        index.add({"name": "generate_password", "description": "计算数学表达式", "category": "math"})
+        assert len(index) == 2
+        assert index.search("生成随机密码", top_k=1, min_score=0.3) == []
+        assert index.search("计算数学表达式", top_k=1)[0][0]["name"] == "generate_password"
+
+
+class TestToolSummary:
+    """工具摘要构建测试"""
+    
+    def _make_registry(self, monkeypatch):
+        registry = ToolRegistry()
+        monkeypatch.setattr(registry, "_get_collection", lambda: None)
+        return registry
+    
+    def test_usage_breaks_ties(self, monkeypatch):
+        """测试相关度相同时使用次数多的工具排在前面"""
+        registry = self._make_registry(monkeypatch)
+        registry.record_usage("b")
+        tools, summary = registry.build_summary([({"name": "a"}, 0.5), ({"name": "b"}, 0.5)])
+        assert [t["name"] for t in tools] == ["b", "a"]
+        assert summary.splitlines()[0] == "- b: 无描述"
+    
+    def test_top_k_and_token_budget(self, monkeypatch):
+        """测试摘要受 top-k 和 Token 预算约束"""
+        registry = self._make_registry(monkeypatch)
+        monkeypatch.setattr(config, "TOOL_SUMMARY_TOKEN_BUDGET", 20)
+        candidates = [({"name": f"tool_{i}", "description": "描述" * 10}, 1 - i / 10) for i in range(8)]
+        tools, summary = registry.build_summary(candidates)
+        assert len(tools) < config.TOOL_SUMMARY_TOP_K
+        assert len(summary) <= 20 * config.LLM_CHARS_PER_TOKEN
+    
+    def test_fragment_invalidated_on_register(self, monkeypatch):
+        """测试注册工具后摘要片段失效"""
+        registry = self._make_registry(monkeypatch)
+        registry.register({"name": "t", "description": "旧描述", "category": "text", "code": ""})
+        assert registry.get_tools_summary("text") == "- t: 旧描述"
+        registry.register({"name": "t", "description": "新描述", "category": "text", "code": ""})
+        assert registry.get_tools_summary("text") == "- t: 新描述"
+
+
+class FakeRedis:
+    """最小的 Redis 替身 (仅支持去重、负缓存和工具缓存用到的命令)"""
+    
+    def __init__(self):
+        self.data = {}
+    
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+    
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+    
+    def get(self, key):
+        return self.data.get(key)
+    
+    def ttl(self, key):
+        return -1
+    
+    def exists(self, key):
+        return int(key in self.data)
+    
+    def delete(self, key):
+        self.data.pop(key, None)
+    
+    def keys(self, pattern):
+        return [key for key in self.data if fnmatch.fnmatch(key, pattern)]
+    
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key) or 0) + 1
+        return self.data[key]
+
+
+class FakeCollection:
+    """最小的 MongoDB 集合替身 (仅支持工具注册和索引加载用到的查询)"""
+    
+    def __init__(self):
+        self.docs = {}
+    
+    def find(self, query=None, projection=None):
+        docs = [dict(doc) for doc in self.docs.values()]
+        for field, condition in (query or {}).items():
+            docs = [doc for doc in docs if doc.get(field, 0) > condition["$gt"]]
+        return docs
+    
+    def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["name"], {})
+        doc.update(update.get("$set", {}))
+
+
+class TestRegistryIndex:
+    """注册表相似度索引的加载与刷新测试"""
+    
+    TIME_TOOL = {"name": "get_current_time", "description": "获取当前时间", "category": "datetime", "code": ""}
+    
+    def _make_registry(self, monkeypatch, collection, client):
+        from src.storage import registry as registry_module
+        registry = ToolRegistry()
+        monkeypatch.setattr(registry, "_get_collection", lambda: collection)
+        monkeypatch.setattr(registry_module.tool_cache, "_get_client", lambda: client)
+        return registry
+    
+    def test_redis_fallback_when_mongo_down(self, monkeypatch):
+        """测试 MongoDB 不可用时从 Redis 缓存的工具构建索引，恢复后改从 MongoDB 加载"""
+        client = FakeRedis()
+        client.setex("tool:get_current_time", 60, json.dumps(self.TIME_TOOL, ensure_ascii=False))
+        client.incr("registry:version")
+        registry = self._make_registry(monkeypatch, None, client)
+        monkeypatch.setattr(config, "TOOL_INDEX_REFRESH_INTERVAL", 0)
+        
+        assert registry.search_similar("获取当前时间")[0][0]["name"] == "get_current_time"
+        assert not registry._index_loaded
+        
+        collection = FakeCollection()
+        collection.docs["generate_password"] = {"name": "generate_password", "description": "生成随机密码", "category": "text"}
+        monkeypatch.setattr(registry, "_get_collection", lambda: collection)
+        assert registry.search_similar("生成随机密码")[0][0]["name"] == "generate_password"
+        assert registry._index_loaded
+    
+    def test_refresh_after_other_process_registers(self, monkeypatch):
+        """测试其他进程注册工具后按注册版本号增量刷新索引"""
+        collection, client = FakeCollection(), FakeRedis()
+        reader = self._make_registry(monkeypatch, collection, client)
+        writer = ToolRegistry()
+        monkeypatch.setattr(writer, "_get_collection", lambda: collection)
+        monkeypatch.setattr(config, "TOOL_INDEX_REFRESH_INTERVAL", 60)
+        
+        assert reader.search_similar("获取当前时间") == []
+        writer.register(dict(self.TIME_TOOL))
+        assert collection.docs["get_current_time"]["registry_version"] == 1
+        assert reader.search_similar("获取当前时间") == []  # 未到检查间隔
+        
+        monkeypatch.setattr(config, "TOOL_INDEX_REFRESH_INTERVAL", 0)
+        monkeypatch.setattr(reader._index, "add", lambda spec, add=reader._index.add: added.append(spec["name"]) or add(spec))
+        added = []
+        assert reader.search_similar("获取当前时间")[0][0]["name"] == "get_current_time"
+        assert added == ["get_current_time"] and reader._index_version == 1
+        reader.search_similar("获取当前时间")
+        assert added == ["get_current_time"]
+    
+    def test_list_tools_without_collection_scan(self, monkeypatch):
+        """测试索引加载后列出工具名直接取自索引，不再扫描集合"""
+        collection = FakeCollection()
+        collection.docs["get_current_time"] = dict(self.TIME_TOOL)
+        registry = self._make_registry(monkeypatch, collection, None)
+        assert registry.list_tools() == ["get_current_time"]
+        
+        monkeypatch.setattr(collection, "find", None)
+        registry.register({"name": "generate_password", "description": "生成随机密码", "category": "text", "code": ""})
+        assert registry.list_tools() == ["get_current_time", "generate_password"]
+    
+    def test_category_fallback_for_paraphrase(self, monkeypatch):
+        """测试没有字面相似的工具时退回同分类的工具交给 LLM 判断"""
+        collection = FakeCollection()
+        collection.docs["get_current_time"] = dict(self.TIME_TOOL)
+        registry = self._make_registry(monkeypatch, collection, None)
+        
+        assert registry.search_similar("现在几点了") == []
+        assert registry.find_candidates("现在几点了", "datetime") == [(self.TIME_TOOL, 0.0)]
+        assert registry.find_candidates("现在几点了", "math") == []
+
+
+class TestSingleflight:
+    """生成去重测试"""
+    
+    def _make_flight(self, monkeypatch, client=None):
+        flight = GenerationSingleflight()
+        monkeypatch.setattr(flight, "_get_client", lambda: client)
+        return flight
+    
+    def test_key_requires_identical_description(self):
+        """测试只有描述相同 (忽略首尾空白) 的请求合并，运算符、标点、大小写不同的请求各自生成"""
+        a = GenerationSingleflight.make_key("计算 7+5", "math")
+        assert a == GenerationSingleflight.make_key(" 计算 7+5\n", "math")
+        assert a != GenerationSingleflight.make_key("计算 7-5", "math")
+        assert a != GenerationSingleflight.make_key("计算 7+5", "text")
+        assert GenerationSingleflight.make_key("计算 123*456", "math") != GenerationSingleflight.make_key("计算 1234*56", "math")
+        assert GenerationSingleflight.make_key("转大写 abc", "text") != GenerationSingleflight.make_key("转大写 ABC", "text")
+    
+    async def test_concurrent_calls_share_one_generation(self, monkeypatch):
+        """测试进程内并发请求只生成一次"""
+        flight = self._make_flight(monkeypatch)
+        calls = []
+        
+        async def factory():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"generated_spec": {"name": "calc"}}
+        
+        results = await asyncio.gather(*(flight.run("k", factory) for _ in range(3)))
+        assert len(calls) == 1
+        assert all(r["generated_spec"]["name"] == "calc" for r in results)
+        assert flight.stats() == {"leader": 1, "local_follower": 2}
+    
+    async def test_follower_takes_over_cancelled_leader(self, monkeypatch):
+        """测试 leader 被取消后 follower 接手生成"""
+        flight = self._make_flight(monkeypatch)
+        
+        async def factory():
+            await asyncio.sleep(0.05)
+            return {"generated_spec": {"name": "calc"}}
+        
+        leader = asyncio.create_task(flight.run("k", factory))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.run("k", factory))
+        await asyncio.sleep(0)
+        leader.cancel()
+        assert (await follower)["generated_spec"]["name"] == "calc"
+    
+    async def test_remote_leader_result_reused(self, monkeypatch):
+        """测试其他进程持有锁时等待并复用其结果"""
+        client = FakeRedis()
+        client.set(GenerationSingleflight.LOCK_PREFIX + "k", "other")
+        flight = self._make_flight(monkeypatch, client)
+        monkeypatch.setattr(config, "SINGLEFLIGHT_POLL_INTERVAL", 0.01)
+        
+        async def remote_leader():
+            await asyncio.sleep(0.03)
+            client.setex(GenerationSingleflight.RESULT_PREFIX + "k", 60, json.dumps({"generated_spec": {"name": "remote"}}))
+            client.delete(GenerationSingleflight.LOCK_PREFIX + "k")
+        
+        async def factory():
+            raise AssertionError("不应自行生成")
+        
+        _, result = await asyncio.gather(remote_leader(), flight.run("k", factory))
+        assert result["generated_spec"]["name"] == "remote"
+        assert flight.stats() == {"remote_follower": 1}
+
+
+class TestNegativeCache:
+    """生成失败负缓存测试"""
+    
+    def _make_cache(self, monkeypatch, client=None):
+        cache = NegativeCache()
+        monkeypatch.setattr(cache, "_get_client", lambda: client)
+        return cache
+    
+    def test_record_and_normalized_lookup(self, monkeypatch):
+        """测试记录失败后相同任务 (忽略空白和句末标点) 命中，不同分类不命中"""
+        cache = self._make_cache(monkeypatch)
+        assert cache.get("读取系统文件", "other") is None
+        cache.record("读取系统文件", "other", "禁止导入: os", "reject")
+        
+        record = cache.get("读取 系统文件。", "other")
+        assert record["reason"] == "禁止导入: os" and record["stage"] == "reject"
+        assert cache.get("读取系统文件", "text") is None
+        
+        cache.clear("读取系统文件", "other")
+        assert cache.get("读取系统文件", "other") is None
+    
+    def test_operators_distinguish_tasks(self, monkeypatch):
+        """测试只差运算符或句中标点的任务不共享失败记录"""
+        cache = self._make_cache(monkeypatch)
+        cache.record("计算 7+5", "math", "禁止导入: os", "reject")
+        assert cache.peek("计算7+5。", "math") is not None
+        assert cache.peek("计算 7-5", "math") is None
+        assert cache.peek("计算 7*5", "math") is None
+    
+    def test_expired_record_is_ignored(self, monkeypatch):
+        """测试过期记录不再拒绝"""
+        monkeypatch.setattr(config, "NEGATIVE_CACHE_TTL", -1)
+        cache = self._make_cache(monkeypatch)
+        cache.record("读取系统文件", "other", "禁止导入: os", "reject")
+        assert cache.get("读取系统文件", "other") is None
+    
+    def test_shared_through_redis(self, monkeypatch):
+        """测试失败记录通过 Redis 跨进程共享"""
+        client = FakeRedis()
+        self._make_cache(monkeypatch, client).record("读取系统文件", "other", "禁止导入: os", "reject")
+        assert self._make_cache(monkeypatch, client).get("读取系统文件", "other")["reason"] == "禁止导入: os"
+    
+    def test_disabled(self, monkeypatch):
+        """测试关闭负缓存"""
+        monkeypatch.setattr(config, "NEGATIVE_CACHE_ENABLED", False)
+        cache = self._make_cache(monkeypatch)
+        cache.record("读取系统文件", "other", "禁止导入: os", "reject")
+        assert cache.get("读取系统文件", "other") is None
+
+
+class TestBlobStore:
+    """大结果外置存储测试"""
+    
+    def _make_store(self, monkeypatch, tmp_path, threshold=100):
+        store = BlobStore(local_dir=tmp_path)
+        monkeypatch.setattr(store, "_get_bucket", lambda: None)
+        monkeypatch.setattr(config, "RESULT_BLOB_THRESHOLD", threshold)
+        monkeypatch.setattr(config, "RESULT_PREVIEW_CHARS", 10)
+        return store
+    
+    def test_small_result_kept_inline(self, monkeypatch, tmp_path):
+        """测试未超过阈值的结果原样保留"""
+        store = self._make_store(monkeypatch, tmp_path)
+        assert store.offload("42") == ("42", None)
+        assert store.stats() == {}
+    
+    def test_large_result_offloaded_once(self, monkeypatch, tmp_path):
+        """测试大结果按内容哈希写入本地存储，相同内容只写一次"""
+        store = self._make_store(monkeypatch, tmp_path)
+        value = "x" * 1000
+        preview, ref = store.offload(value)
+        assert ref == BlobStore.make_ref(value)
+        assert preview.startswith("x" * 10) and len(preview) < 100
+        assert store.offload(value) == (preview, ref)
+        assert store.stats() == {"stored": 1, "dedup": 1}
+        assert store.resolve(preview, ref) == value
+    
+    def test_missing_blob_falls_back_to_preview(self, monkeypatch, tmp_path):
+        """测试引用的内容丢失时退回预览"""
+        store = self._make_store(monkeypatch, tmp_path)
+        assert store.resolve("预览", "0" * 64) == "预览"
+        assert store.stats()["missing"] == 1
@@ -0,0 +1,795 @@
+"""工作流测试用例"""
+
+import asyncio
+import gc
+import json
+import random
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.types import Send
+from src.infra.config import config
+from src.workflow.state import merge_task_results
+from src.workflow.routing import route_after_analyze, route_after_dispatch, route_after_prepare, route_after_search
+from src.workflow import nodes
+from src.workflow.nodes import _normalize_tasks
+from src.storage.negative_cache import NegativeCache
+from src.execution.safety import CodeSafetyChecker
+from src.workflow.speculation import SpeculationStats
+from src.workflow import memory as memory_module
+from src.workflow.memory import ConversationMemory
+from src.workflow.json_stream import StreamingJSONParser, parse_json
+
+
+class ScriptedLLM:
+    """按 Prompt 关键字返回预设响应的 LLM 替身
+    
+    tasks: 用户请求 -> 子任务描述列表；specs: 任务描述 -> 依次返回的代码生成响应 (最后一个重复使用)
+    """
+    
+    def __init__(self):
+        self.tasks = {}
+        self.specs = {}
+        self.calls = []  # 按顺序记录调用 LLM 的节点
+        self.prompts = []
+        self.graph = None
+    
+    @staticmethod
+    def _field(prompt: str, label: str) -> str:
+        return prompt.split(label, 1)[1].split("\n", 1)[0].strip()
+    
+    def respond(self, prompt: str) -> str:
+        if "判断是否需要执行工具" in prompt:
+            request = self._field(prompt, "当前请求:")
+            return json.dumps({"need_tool": True, "task_description": request, "task_category": "other", "direct_answer": ""})
+        if "拆分为独立的可执行子任务" in prompt:
+            request = self._field(prompt, "用户请求:")
+            tasks = [{"id": i, "description": d, "category": "other", "depends_on": []} for i, d in enumerate(self.tasks[request], 1)]
+            return json.dumps({"tasks": tasks})
+        if "生成 Python 工具函数" in prompt:
+            responses = self.specs[self._field(prompt, "任务描述:")]
+            return responses.pop(0) if len(responses) > 1 else responses[0]
+        if "判断已有工具是否可以完成当前任务" in prompt:
+            return json.dumps({"use_existing": False, "tool_name": "", "reason": "无合适工具"})
+        if "判断当前任务是否已完成" in prompt:
+            return json.dumps({"is_complete": True, "reasoning": "已完成", "next_task": ""})
+        return "好的，已为您完成。"
+    
+    async def astream(self, node, prompt, **kwargs):
+        self.calls.append(node)
+        self.prompts.append(prompt)
+        text = self.respond(prompt)
+        for i in range(0, len(text), 16):
+            yield text[i:i + 16]
+
+
+def tool_spec(name: str, code: str, description: str = "") -> str:
+    """代码生成响应"""
+    return json.dumps({"name": name, "description": description or name, "parameters": {}, "arguments": {},
+                       "return_type": "str", "category": "other", "code": code})
+
+
+@pytest.fixture
+def offline_graph(monkeypatch):
+    """离线运行完整图: 内存 checkpoint、空的内存工具索引、预设 LLM 响应，不连接 MongoDB/Redis"""
+    from langgraph.checkpoint.memory import MemorySaver
+    from src.infra.connection_manager import connection_manager
+    from src.storage.tool_index import ToolIndex
+    from src.workflow import graph
+    
+    monkeypatch.setattr(connection_manager.db, "get_collection", lambda *args, **kwargs: None)
+    monkeypatch.setattr(connection_manager.db, "get_database", lambda *args, **kwargs: None)
+    monkeypatch.setattr(connection_manager.cache, "get_client", lambda *args, **kwargs: None)
+    monkeypatch.setattr(nodes.tool_registry, "_index", ToolIndex())
+    monkeypatch.setattr(nodes.tool_registry, "_index_loaded", True)
+    monkeypatch.setattr(nodes.tool_registry, "save_as_file", lambda spec: None)
+    monkeypatch.setattr(nodes, "negative_cache", NegativeCache())
+    monkeypatch.setattr(nodes, "conversation_memory", ConversationMemory())
+    monkeypatch.setattr(nodes.tool_result_cache, "ttl_for", lambda category: 0)
+    monkeypatch.setattr(config, "SANDBOX_BACKEND", "inline")
+    monkeypatch.setattr(config, "BATCH_GENERATION", False)
+    monkeypatch.setattr(config, "COMBINED_ANALYZE_PLAN", False)
+    monkeypatch.setattr(config, "SPECULATIVE_GENERATION", False)
+    
+    llm = ScriptedLLM()
+    monkeypatch.setattr(nodes, "_astream_llm", llm.astream)
+    monkeypatch.setattr(graph, "checkpointer", MemorySaver())
+    llm.graph = graph.create_self_tool_graph()
+    return llm
+
+
+class TestParallelTasks:
+    """多任务并行调度测试"""
+    
+    def test_merge_task_results_sorted(self):
+        """测试并行结果按 task_id 有序合并"""
+        merged = merge_task_results([{"task_id": 2, "result": "b"}], [{"task_id": 1, "result": "a"}])
+        assert [r["task_id"] for r in merged] == [1, 2]
+    
+    def test_merge_task_results_reset(self):
+        """测试空列表重置结果"""
+        assert merge_task_results([{"task_id": 1}], []) == []
+    
+    def test_normalize_tasks_drops_forward_deps(self):
+        """测试依赖只保留更早的任务"""
+        tasks = _normalize_tasks([
+            {"id": 1, "description": "a", "depends_on": [2]},
+            {"id": 2, "description": "b", "depends_on": [1]},
+        ])
+        assert tasks[0]["depends_on"] == []
+        assert tasks[1]["depends_on"] == [1]
+    
+    def test_dispatch_independent_tasks_in_parallel(self):
+        """测试互不依赖的任务在同一波次分发"""
+        state = {
+            "task_list": [
+                {"id": 1, "description": "a", "category": "math", "depends_on": []},
+                {"id": 2, "description": "b", "category": "math", "depends_on": []},
+                {"id": 3, "description": "c", "category": "math", "depends_on": [1]},
+            ],
+            "task_results": [],
+        }
+        sends = route_after_dispatch(state)
+        assert all(isinstance(s, Send) for s in sends)
+        assert [s.arg["task_id"] for s in sends] == [1, 2]
+        
+        state["task_results"] = [{"task_id": 1, "result": "x"}, {"task_id": 2, "result": "y"}]
+        sends = route_after_dispatch(state)
+        assert [s.arg["task_id"] for s in sends] == [3]
+        assert sends[0].arg["dependency_results"][0]["result"] == "x"
+        
+        state["task_results"].append({"task_id": 3, "result": "z"})
+        assert route_after_dispatch(state) == "aggregate"
+
+
+class TestBatchGeneration:
+    """批量生成测试"""
+    
+    async def test_batch_specs_matched_by_task_id(self, monkeypatch):
+        """测试批量响应按 task_id 分配，无效或多余的规格被丢弃"""
+        response = {"tools": [
+            {"task_id": 2, "name": "b", "code": "def b() -> str:\n    return 'b'"},
+            {"task_id": 1, "name": "a"},
+            {"task_id": 9, "name": "z", "code": "def z() -> str:\n    return 'z'"},
+        ]}
+        
+        async def fake_llm(node, prompt, on_field=None, bypass_cache=False):
+            assert node == "generate_batch"
+            return response
+        
+        monkeypatch.setattr(nodes, "_ainvoke_json", fake_llm)
+        tasks = [{"id": 1, "description": "a"}, {"id": 2, "description": "b"}]
+        specs = await nodes._generate_batch({"task_results": []}, tasks)
+        assert [b["task_id"] for b in specs] == [2]
+        assert specs[0]["spec"]["version"] == 1
+        assert "task_id" not in specs[0]["spec"]
+    
+    async def test_low_score_candidates_left_to_selection(self, monkeypatch):
+        """测试与已注册的带参数工具相似度较低的任务不批量生成，只有没有候选的任务批量生成"""
+        from src.storage.tool_index import ToolIndex
+        index = ToolIndex()
+        index.add({"name": "multiply_numbers", "description": "计算两个整数的乘积", "parameters": {"a": "int", "b": "int"}})
+        monkeypatch.setattr(nodes.tool_registry, "_index", index)
+        monkeypatch.setattr(nodes.tool_registry, "_index_loaded", True)
+        monkeypatch.setattr(nodes, "negative_cache", NegativeCache())
+        monkeypatch.setattr(nodes.negative_cache, "_get_client", lambda: None)
+        monkeypatch.setattr(config, "BATCH_EXECUTION", False)
+        monkeypatch.setattr(config, "BATCH_GENERATION", True)
+        batched = []
+        
+        async def fake_batch(state, tasks):
+            batched.extend(t["description"] for t in tasks)
+            return []
+        
+        monkeypatch.setattr(nodes, "_generate_batch", fake_batch)
+        descriptions = ["计算 789*12", "计算 45*6", "生成随机密码", "获取当前时间"]
+        state = {
+            "task_list": [{"id": i, "description": d, "depends_on": []} for i, d in enumerate(descriptions, 1)],
+            "task_results": [],
+        }
+        assert 0 < index.search("计算 789*12")[0][1] < 0.3
+        await nodes.dispatch_tasks_node(state, lambda event: None)
+        assert batched == ["生成随机密码", "获取当前时间"]
+    
+    def test_batched_spec_skips_search(self):
+        """测试批量规格随 Send 下发，任务分支跳过检索"""
+        spec = {"name": "a", "code": "def a() -> str:\n    return 'a'"}
+        state = {
+            "task_list": [
+                {"id": 1, "description": "a", "depends_on": []},
+                {"id": 2, "description": "b", "depends_on": []},
+            ],
+            "task_results": [],
+            "batch_specs": [{"task_id": 1, "spec": spec}],
+        }
+        sends = route_after_dispatch(state)
+        assert sends[0].arg["generated_spec"] == spec
+        assert "generated_spec" not in sends[1].arg
+        
+        assert route_after_prepare(nodes.prepare_current_task_node(sends[0].arg)) == "batched"
+        assert route_after_prepare(nodes.prepare_current_task_node(sends[1].arg)) == "search"
+
+
+class TestNegativeCache:
+    """生成失败快速拒绝测试"""
+    
+    TASK = {"task_id": 1, "task_description": "读取系统文件", "task_category": "other", "dependency_results": []}
+    
+    @pytest.fixture
+    def cache(self, monkeypatch):
+        cache = NegativeCache()
+        monkeypatch.setattr(cache, "_get_client", lambda: None)
+        monkeypatch.setattr(nodes, "negative_cache", cache)
+        monkeypatch.setattr(nodes.tool_registry, "list_tools", lambda: [])
+        return cache
+    
+    async def test_failed_task_is_rejected_fast(self, cache, monkeypatch):
+        """测试被安全检查拒绝后，相同任务检索未命中时跳过生成直接拒绝，每个任务只计一次命中"""
+        monkeypatch.setattr(nodes.tool_registry, "search_similar", lambda description: [])
+        nodes.reject_node({**self.TASK, "safety_issues": ["禁止导入模块: os"]})
+        
+        state = {**self.TASK, **nodes.prepare_current_task_node(self.TASK)}
+        assert route_after_prepare(state) == "search"
+        state.update(await nodes.search_tool_node(state))
+        assert route_after_search(state) == "known_failure"
+        assert "禁止导入模块: os" in nodes.known_failure_node(state)["error"]
+        assert cache.stats()["hit"] == 1
+    
+    async def test_registered_tool_overrides_known_failure(self, cache, monkeypatch):
+        """测试失败记录存在时，检索命中其他描述下注册的工具仍直接复用"""
+        tool = {"name": "read_config", "description": "读取配置文件", "code": "def read_config() -> str:\n    return ''"}
+        monkeypatch.setattr(nodes.tool_registry, "search_similar", lambda description: [(tool, 0.95)])
+        nodes.reject_node({**self.TASK, "safety_issues": ["禁止导入模块: os"]})
+        
+        state = {**self.TASK, **nodes.prepare_current_task_node(self.TASK)}
+        state.update(await nodes.search_tool_node(state))
+        assert route_after_search(state) == "use_existing"
+        assert cache.stats().get("hit", 0) == 0
+    
+    def test_transient_failures_not_recorded(self, cache):
+        """测试未生成有效规格和执行失败 (如超时) 不写入负缓存"""
+        nodes.reject_node({**self.TASK, "safety_issues": [nodes._NO_SPEC_ISSUE]})
+        nodes.fail_node({**self.TASK, "execution_error": "执行超时 (超过 5 秒)"})
+        assert cache.peek("读取系统文件", "other") is None
+    
+    def test_dependent_task_failure_not_recorded(self, cache):
+        """测试依赖前置结果的任务失败不写入负缓存"""
+        task = {"task_id": 2, "task_description": "转换结果", "task_category": "other",
+                "dependency_results": [{"task_id": 1, "description": "a", "result": "1"}]}
+        
+        nodes.reject_node({**task, "safety_issues": ["禁止导入模块: os"]})
+        assert cache.get("转换结果", "other") is None
+
+
+class TestSafetyRepair:
+    """安全检查自动修复测试"""
+    
+    def test_repaired_code_passes_without_regeneration(self):
+        """测试可修复的问题直接通过安全检查，规格代码替换为修复后的代码"""
+        spec = {"name": "f", "code": "import os\ndef f() -> str:\n    return 'ok'"}
+        update = nodes.safety_check_node({"generated_spec": spec, "generation_attempt": 1})
+        assert update["safety_status"] == "passed"
+        assert "import os" not in update["generated_spec"]["code"]
+        assert spec["code"].startswith("import os")
+
+
+class TestGenerationCache:
+    """生成结果的 LLM 缓存测试"""
+    
+    @pytest.fixture
+    def gateway(self, monkeypatch):
+        """真实的 _astream_llm 与独立的 LLM 缓存，LLM 网关返回预设的代码生成响应"""
+        from src.storage.llm_cache import LLMResponseCache
+        
+        cache = LLMResponseCache()
+        monkeypatch.setattr(cache, "_get_client", lambda: None)
+        monkeypatch.setattr(nodes, "llm_cache", cache)
+        monkeypatch.setattr(config, "GENERATION_SINGLEFLIGHT", False)
+        monkeypatch.setattr(config, "SANDBOX_BACKEND", "inline")
+        calls = []
+        
+        async def fake_astream(messages, **kwargs):
+            calls.append(messages)
+            yield AIMessage(content=tool_spec("broken", "def broken() -> str:\n    return str(1 / 0)"))
+        
+        monkeypatch.setattr(nodes.llm_gateway, "astream", fake_astream)
+        return calls
+    
+    async def test_failed_tool_evicted_from_cache(self, gateway):
+        """测试执行失败的生成结果从缓存删除，相同请求重新调用 LLM 而不是重放失败的代码"""
+        state = {"task_id": 1, "task_description": "计算除法", "task_category": "other",
+                 "generation_attempt": 0, "generation_feedback": "", "tool_arguments": {}}
+        
+        update = await nodes.generate_code_node(state)
+        assert update["generation_cache_entry"]["node"] == "generate"
+        await nodes.generate_code_node(state)
+        assert len(gateway) == 1  # 第二次命中缓存
+        
+        update = await nodes.execute_node({**state, **update}, lambda event: None)
+        assert update["execution_error"]
+        assert nodes.llm_cache.stats()["generate"]["evicted"] == 1
+        
+        await nodes.generate_code_node(state)
+        assert len(gateway) == 2
+
+
+class TestExecutionRouting:
+    """按执行成本选择执行方式测试"""
+    
+    async def test_only_trivial_tools_run_inline(self, monkeypatch):
+        """测试 auto 模式下 trivial 工具进程内执行，其余交给进程池"""
+        isolated = []
+        
+        async def fake_execute(code, func_name, args=None):
+            isolated.append(func_name)
+            return "isolated"
+        
+        monkeypatch.setattr(config, "SANDBOX_BACKEND", "auto")
+        monkeypatch.setattr(nodes.process_sandbox, "execute", fake_execute)
+        trivial = {"name": "f", "code": "def f() -> str:\n    return 'inline'"}
+        looping = {"name": "g", "code": "def g() -> str:\n    while True:\n        pass"}
+        
+        assert await nodes._run_tool(trivial["code"], "f", {}, nodes._tool_cost_class(trivial)) == "inline"
+        assert await nodes._run_tool(looping["code"], "g", {}, nodes._tool_cost_class(looping)) == "isolated"
+        assert isolated == ["g"]
+        
+        update = nodes.safety_check_node({"generated_spec": looping, "generation_attempt": 1})
+        assert update["generated_spec"]["cost_class"] == "unknown"
+
+
+class TestBatchExecution:
+    """直接命中已有工具的任务批量执行测试"""
+    
+    TOOLS = [
+        {"name": "get_pi", "description": "获取圆周率", "parameters": {}, "category": "math", "code": "import math\ndef get_pi() -> str:\n    return str(math.pi)"},
+        {"name": "boom", "description": "触发错误", "parameters": {}, "category": "math", "code": "def boom() -> str:\n    return str(1 / 0)"},
+        {"name": "multiply", "description": "计算乘积", "parameters": {"a": {"type": "int"}}, "category": "math", "code": "def multiply(a: int) -> str:\n    return str(a)"},
+        {"name": "get_current_time", "description": "获取当前时间", "parameters": {}, "category": "datetime", "code": "def get_current_time() -> str:\n    return 'now'"},
+    ]
+    
+    async def test_direct_matches_executed_in_dispatch(self, monkeypatch):
+        """测试多个直接命中的任务在分发阶段一次批量执行，带参数的工具和近似描述的任务仍进入任务分支"""
+        from src.storage.tool_index import ToolIndex
+        batches = []
+        
+        def fake_batch(calls):
+            batches.append([name for _, name, _ in calls])
+            return nodes.SafeExecutor().execute_batch(calls)
+        
+        index = ToolIndex()
+        for tool in self.TOOLS:
+            index.add(tool)
+        monkeypatch.setattr(config, "SANDBOX_BACKEND", "inline")
+        monkeypatch.setattr(config, "BATCH_GENERATION", False)
+        monkeypatch.setattr(nodes.tool_registry, "_index", index)
+        monkeypatch.setattr(nodes.tool_registry, "_index_loaded", True)
+        monkeypatch.setattr(nodes.tool_registry, "record_usage", lambda name: None)
+        monkeypatch.setattr(nodes.tool_registry, "_get_collection", lambda: None)
+        monkeypatch.setattr(nodes.tool_result_cache, "ttl_for", lambda category: 0)
+        monkeypatch.setattr(nodes.safe_executor, "execute_batch", fake_batch)
+        events = []
+        state = {"task_list": [
+            {"id": 1, "description": "获取圆周率", "depends_on": []},
+            {"id": 2, "description": "触发错误", "depends_on": []},
+            {"id": 3, "description": "计算乘积", "depends_on": []},
+            {"id": 4, "description": "获取当前时间戳", "depends_on": []},
+        ], "task_results": []}
+        
+        update = await nodes.dispatch_tasks_node(state, events.append)
+        assert batches == [["get_pi", "boom"]]
+        results = {r["task_id"]: r for r in update["task_results"]}
+        assert results[1]["result"].startswith("3.14") and results[1]["error"] is None
+        assert results[2]["error"] == "division by zero"
+        assert [e["task_id"] for e in events] == [1]
+        
+        state["task_results"] = merge_task_results([], update["task_results"])
+        assert [s.arg["task_id"] for s in route_after_dispatch(state)] == [3, 4]
+    
+    async def test_repeated_request_reuses_registered_tools(self, offline_graph, monkeypatch):
+        """测试首轮生成并注册的工具在再次请求时由分发阶段直接批量执行，不再调用代码生成"""
+        batches = []
+        execute_batch = nodes.safe_executor.execute_batch
+        monkeypatch.setattr(nodes.safe_executor, "execute_batch", lambda calls: batches.append(calls) or execute_batch(calls))
+        offline_graph.tasks = {"圆周率和时间": ["获取圆周率", "获取当前年份"]}
+        offline_graph.specs = {
+            "获取圆周率": [tool_spec("get_pi", "import math\ndef get_pi() -> str:\n    return str(math.pi)", "获取圆周率")],
+            "获取当前年份": [tool_spec("get_year", "def get_year() -> str:\n    return '2026'", "获取当前年份")],
+        }
+        run_config = {"configurable": {"thread_id": "test-batch-reuse"}}
+        from src.workflow.runner import build_input_state
+        
+        await offline_graph.graph.ainvoke(build_input_state("圆周率和时间"), run_config)
+        assert offline_graph.calls.count("generate") == 2
+        
+        offline_graph.calls.clear()
+        final = await offline_graph.graph.ainvoke(build_input_state("圆周率和时间"), run_config)
+        assert "generate" not in offline_graph.calls and "search" not in offline_graph.calls
+        assert [[name for _, name, _ in calls] for calls in batches] == [["get_pi", "get_year"]]
+        assert [r["result"][:4] for r in final["task_results"]] == ["3.14", "2026"]
+
+
+class TestTurnErrorReset:
+    """多轮会话错误状态测试"""
+    
+    async def test_failed_turn_does_not_leak_into_next(self, offline_graph):
+        """测试同一会话中失败的一轮不影响下一轮，生成重试成功后任务不再带有格式错误"""
+        offline_graph.tasks = {"读取配置": ["读取配置文件"], "计算乘积": ["计算 6 乘 7"]}
+        offline_graph.specs = {
+            "读取配置文件": [tool_spec("read_config", "import os\ndef read_config() -> str:\n    return os.getcwd()")],
+            "计算 6 乘 7": ["不是 JSON", tool_spec("multiply_six_seven", "def multiply_six_seven() -> str:\n    return str(6 * 7)")],
+        }
+        run_config = {"configurable": {"thread_id": "test-turns"}}
+        from src.workflow.runner import build_input_state
+        
+        first = await offline_graph.graph.ainvoke(build_input_state("读取配置"), run_config)
+        assert first["error"] and first["current_node"] == "aggregate"
+        
+        second = await offline_graph.graph.ainvoke(build_input_state("计算乘积"), run_config)
+        assert second["error"] is None
+        assert second["task_results"][0]["error"] is None and second["task_results"][0]["result"] == "42"
+        assert second["current_node"] == "should_continue"
+
+
+class TestOneShotRequest:
+    """一次性请求测试"""
+    
+    async def test_oneshot_request_not_checkpointed(self, offline_graph, monkeypatch):
+        """测试未指定会话的请求不写入 checkpoint，指定会话的请求正常保存"""
+        from src.workflow import graph, runner
+        offline_graph.tasks = {"计算乘积": ["计算 6 乘 7"]}
+        offline_graph.specs = {"计算 6 乘 7": [tool_spec("multiply_six_seven", "def multiply_six_seven() -> str:\n    return str(6 * 7)")]}
+        monkeypatch.setattr(runner, "self_tool_graph", offline_graph.graph)
+        monkeypatch.setattr(runner, "oneshot_graph", graph.create_self_tool_graph(persistent=False))
+        
+        result = await runner.run_request("计算乘积")
+        assert result["task_results"][0]["result"] == "42"
+        assert not graph.checkpointer.storage
+        
+        await runner.run_request("计算乘积", "session-1")
+        assert list(graph.checkpointer.storage) == ["session-1"]
+
+
+class TestStreamEvents:
+    """流式事件测试"""
+    
+    async def test_tool_result_streamed_before_tokens(self, offline_graph):
+        """测试子图中的工具原始结果经 custom 流先于润色 token 推送，最终状态经 values 流返回"""
+        from src.workflow.runner import build_input_state
+        offline_graph.tasks = {"计算乘积": ["计算 6 乘 7"]}
+        offline_graph.specs = {"计算 6 乘 7": [tool_spec("multiply_six_seven", "def multiply_six_seven() -> str:\n    return str(6 * 7)")]}
+        
+        events, final = [], None
+        async for mode, chunk in offline_graph.graph.astream(
+            build_input_state("计算乘积"),
+            config={"configurable": {"thread_id": "test-stream"}},
+            stream_mode=["custom", "values"],
+        ):
+            if mode == "custom":
+                events.append(chunk)
+            else:
+                final = chunk
+        
+        kinds = [e["type"] for e in events]
+        assert kinds[0] == "tool_result" and kinds.count("tool_result") == 1
+        assert events[0]["tool"] == "multiply_six_seven" and events[0]["result"] == "42"
+        assert kinds[1:] and set(kinds[1:]) == {"token"}
+        assert "".join(e["content"] for e in events[1:]) == "好的，已为您完成。"
+        assert final["task_results"][0]["result"] == "42"
+
+
+class TestRegisteredToolVerdict:
+    """已注册工具安全判定复用测试"""
+    
+    def test_current_verdict_skips_analysis(self, monkeypatch):
+        """测试判定与规则版本一致时直接使用，过期时重新检查并更新工具文档"""
+        checker = CodeSafetyChecker()
+        updated = []
+        monkeypatch.setattr(nodes, "safety_checker", checker)
+        monkeypatch.setattr(nodes.tool_registry, "update_safety_verdict", lambda tool, verdict: updated.append(verdict))
+        code = "def f() -> str:\n    return open('x').read()"
+        
+        stale = {"name": "f", "code": code, "safety_verdict": {"code_hash": checker.code_hash(code), "ruleset": "old", "issues": []}}
+        assert nodes._registered_tool_issues(stale) == ["禁止使用函数: open (第 2 行)"]
+        assert updated[0]["ruleset"] == checker.ruleset and checker.stats()["check"] == 1
+        
+        current = {"name": "f", "code": code, "safety_verdict": updated[0]}
+        assert nodes._registered_tool_issues(current) == updated[0]["issues"]
+        assert checker.stats()["check"] == 1 and len(updated) == 1
+
+
+class TestResultOffload:
+    """大结果外置存储测试"""
+    
+    async def test_state_keeps_preview_and_format_reads_full(self, monkeypatch, tmp_path):
+        """测试状态中只保留预览和引用，润色时读取完整结果"""
+        prompts = []
+        
+        async def fake_stream(node, prompt, **kwargs):
+            prompts.append(prompt)
+            yield "好的"
+        
+        monkeypatch.setattr(config, "SANDBOX_BACKEND", "inline")
+        monkeypatch.setattr(config, "RESULT_BLOB_THRESHOLD", 1000)
+        monkeypatch.setattr(nodes.blob_store, "local_dir", tmp_path)
+        monkeypatch.setattr(nodes.blob_store, "_get_bucket", lambda: None)
+        monkeypatch.setattr(nodes.tool_registry, "record_usage", lambda name: None)
+        monkeypatch.setattr(nodes.tool_registry, "_get_collection", lambda: None)
+        monkeypatch.setattr(nodes.tool_result_cache, "ttl_for", lambda category: 0)
+        monkeypatch.setattr(nodes, "_astream_llm", fake_stream)
+        tool = {"name": "big", "parameters": {}, "code": "def big() -> str:\n    return 'ab' * 5000"}
+        
+        state = {"task_id": 1, "task_description": "生成长文本", "matched_tool": tool}
+        state.update(await nodes.use_existing_tool_node(state, lambda event: None))
+        assert state["result_ref"] and len(state["execution_result"]) < 1000
+        
+        entry = nodes.save_task_result_node(state)["task_result"]
+        state = {"task_results": [entry]}
+        state.update(nodes.aggregate_results_node(state))
+        assert "ab" * 5000 not in state["execution_result"]
+        
+        await nodes.format_response_node(state, lambda event: None)
+        assert "ab" * 5000 in prompts[0]
+
+
+class TestAnalyzeRouting:
+    """需求分析路由测试"""
+    
+    def test_combined_mode_skips_planning(self):
+        """测试合并模式已规划任务时直接分发"""
+        state = {"need_tool": True, "task_list": [{"id": 1, "description": "a"}]}
+        assert route_after_analyze(state) == "planned"
+    
+    def test_two_step_fallback(self):
+        """测试未规划任务时走 plan_tasks"""
+        assert route_after_analyze({"need_tool": True, "task_list": []}) == "need_tool"
+        assert route_after_analyze({"need_tool": False}) == "direct_answer"
+    
+    @pytest.mark.parametrize("response, analyze_calls", [
+        ("不是 JSON", ["analyze_plan", "analyze"]),  # JSON 无法解析: 回退到两步模式
+        (json.dumps({"need_tool": True, "task_description": "计算乘积", "task_category": "math"}), ["analyze_plan"]),
+        (json.dumps({"need_tool": True, "task_description": "计算乘积", "task_category": "math",
+                     "tasks": [{"id": 1, "category": "math"}]}), ["analyze_plan"]),
+    ])
+    async def test_combined_mode_falls_back_to_planning(self, offline_graph, monkeypatch, response, analyze_calls):
+        """测试合并模式输出格式错误或缺少任务列表时由 plan_tasks 补做规划，任务正常完成"""
+        monkeypatch.setattr(config, "COMBINED_ANALYZE_PLAN", True)
+        scripted = offline_graph.astream
+        
+        async def astream(node, prompt, **kwargs):
+            if node != "analyze_plan":
+                async for chunk in scripted(node, prompt, **kwargs):
+                    yield chunk
+                return
+            offline_graph.calls.append(node)
+            yield response
+        
+        monkeypatch.setattr(nodes, "_astream_llm", astream)
+        offline_graph.tasks = {"计算乘积": ["计算 6 乘 7"]}
+        offline_graph.specs = {"计算 6 乘 7": [tool_spec("multiply_six_seven", "def multiply_six_seven() -> str:\n    return str(6 * 7)")]}
+        from src.workflow.runner import build_input_state
+        
+        result = await offline_graph.graph.ainvoke(build_input_state("计算乘积"), {"configurable": {"thread_id": "test-combined"}})
+        assert offline_graph.calls[:len(analyze_calls) + 1] == analyze_calls + ["plan_tasks"]
+        assert result["error"] is None
+        assert result["task_results"][0]["result"] == "42"
+
+
+class TestSpeculation:
+    """推测生成统计测试"""
+    
+    def test_disabled_by_default(self):
+        """测试默认不启用推测"""
+        assert SpeculationStats().should_speculate("math") is False
+    
+    def test_low_payoff_category_disabled(self, monkeypatch):
+        """测试命中率过低的分类自动停止推测"""
+        monkeypatch.setattr(config, "SPECULATIVE_GENERATION", True)
+        monkeypatch.setattr(config, "SPECULATION_MIN_SAMPLES", 4)
+        monkeypatch.setattr(config, "SPECULATION_EXPLORE_RATE", 0)
+        stats = SpeculationStats()
+        for _ in range(4):
+            stats.record("math", paid_off=False)
+        stats.record("datetime", paid_off=True)
+        
+        assert stats.should_speculate("math") is False
+        assert stats.should_speculate("datetime") is True
+        assert stats.stats()["math"]["wasted"] == 4
+    
+    def test_disabled_category_recovers(self, monkeypatch):
+        """测试停止推测的分类按探索概率继续采样，近期命中率回升后恢复推测"""
+        monkeypatch.setattr(config, "SPECULATIVE_GENERATION", True)
+        monkeypatch.setattr(config, "SPECULATION_MIN_SAMPLES", 4)
+        monkeypatch.setattr(config, "SPECULATION_WINDOW", 4)
+        monkeypatch.setattr(config, "SPECULATION_EXPLORE_RATE", 0.5)
+        stats = SpeculationStats()
+        for _ in range(4):
+            stats.record("math", paid_off=False)
+        
+        monkeypatch.setattr(random, "random", lambda: 0.9)
+        assert stats.should_speculate("math") is False
+        monkeypatch.setattr(random, "random", lambda: 0.1)
+        assert stats.should_speculate("math") is True
+        
+        for _ in range(2):
+            stats.record("math", paid_off=True)
+        monkeypatch.setattr(random, "random", lambda: 0.9)
+        assert stats.should_speculate("math") is True
+        assert stats.stats()["math"]["recent_payoff_rate"] == 0.5
+        assert stats.stats()["math"]["payoff_rate"] == 0.333
+    
+    @pytest.fixture
+    def search(self, monkeypatch):
+        """检索节点的推测执行环境: 一个需要 LLM 选择的候选工具，工具选择与推测生成的行为由各测试设定"""
+        tool = {"name": "multiply_numbers", "description": "计算两个整数的乘积", "parameters": {"a": "int", "b": "int"}}
+        monkeypatch.setattr(nodes.tool_registry, "list_tools", lambda: [tool["name"]])
+        monkeypatch.setattr(nodes.tool_registry, "find_candidates", lambda query, category: [(tool, 0.5)])
+        monkeypatch.setattr(nodes.tool_registry, "build_summary", lambda candidates: ([tool], tool["name"]))
+        monkeypatch.setattr(nodes, "negative_cache", NegativeCache())
+        monkeypatch.setattr(nodes.negative_cache, "_get_client", lambda: None)
+        monkeypatch.setattr(nodes.speculation_stats, "should_speculate", lambda category: True)
+        recorded = []
+        monkeypatch.setattr(nodes.speculation_stats, "record", lambda category, paid_off: recorded.append(paid_off))
+        
+        def run(selection: dict, generate):
+            async def fake_llm(node, prompt, on_field=None, bypass_cache=False):
+                await asyncio.sleep(0.01)  # 推测生成在选择期间运行
+                return selection
+            
+            monkeypatch.setattr(nodes, "_ainvoke_json", fake_llm)
+            monkeypatch.setattr(nodes, "generate_code_node", generate)
+            state = {"task_id": 1, "task_description": "计算 7 乘 5", "task_category": "math", "generation_attempt": 0}
+            return nodes.search_tool_node(state)
+        
+        run.recorded = recorded
+        return run
+    
+    async def test_match_cancels_speculation(self, search):
+        """测试选中已有工具时取消推测生成，已失败的推测异常被读取"""
+        unhandled = []
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda loop, context: unhandled.append(context))
+        started = []
+        
+        async def failing_generate(state):
+            started.append(True)
+            raise RuntimeError("LLM 调用失败")
+        
+        selection = {"use_existing": True, "tool_name": "multiply_numbers", "arguments": {"a": 7, "b": 5}}
+        update = await search(selection, failing_generate)
+        gc.collect()
+        loop.set_exception_handler(None)
+        
+        assert route_after_search(update) == "use_existing"
+        assert update["tool_arguments"] == {"a": 7, "b": 5}
+        assert started and not unhandled
+        assert search.recorded == [False]
+    
+    async def test_failed_speculation_falls_back_to_generate(self, search):
+        """测试推测生成失败时不影响检索结果，按正常流程生成"""
+        async def failing_generate(state):
+            raise RuntimeError("LLM 调用失败")
+        
+        update = await search({"use_existing": False, "tool_name": ""}, failing_generate)
+        assert route_after_search(update) == "generate"
+        assert search.recorded == [False]
+    
+    async def test_speculated_spec_adopted(self, search):
+        """测试未命中已有工具时采用推测生成的规格，直接进入安全检查"""
+        spec = {"name": "multiply", "code": "def multiply(a: int, b: int) -> int:\n    return a * b"}
+        
+        async def generate(state):
+            return {"generated_spec": spec, "generation_attempt": 1, "current_node": "generate"}
+        
+        update = await search({"use_existing": False, "tool_name": ""}, generate)
+        assert route_after_search(update) == "speculated"
+        assert update["generated_spec"] == spec
+        assert update["current_node"] == "search"
+        assert search.recorded == [True]
+
+
+class TestConversationMemory:
+    """会话滚动摘要测试"""
+    
+    def _messages(self, n):
+        return [
+            (HumanMessage if i % 2 == 0 else AIMessage)(content=f"消息{i}", id=f"m{i}")
+            for i in range(n)
+        ]
+    
+    async def test_context_keeps_only_tail_without_thread(self, monkeypatch):
+        """测试无会话 ID 时只保留尾部原文"""
+        monkeypatch.setattr(config, "CONVERSATION_TAIL_MESSAGES", 2)
+        context, removable, _ = await ConversationMemory().build_context(None, self._messages(6), None)
+        assert "消息3" not in context
+        assert "消息4" in context and "消息5" in context
+        assert removable == []
+    
+    async def test_covered_messages_replaced_by_summary(self, monkeypatch):
+        """测试已被摘要覆盖的旧消息以摘要代替并可移除"""
+        monkeypatch.setattr(config, "CONVERSATION_TAIL_MESSAGES", 2)
+        record = {"summary": "用户叫小五", "covered_ids": ["m0", "m1"]}
+        
+        context, removable, record = await ConversationMemory().build_context("t1", self._messages(6), record)
+        assert context.startswith("对话摘要:\n用户叫小五")
+        assert "消息0" not in context and "消息2" in context
+        assert removable == ["m0", "m1"]
+        assert record == {"summary": "用户叫小五", "covered_ids": []}
+    
+    async def test_pending_updates_bounded(self, monkeypatch):
+        """测试后台合并任务数量有上限，超出时丢弃最早的任务"""
+        async def slow_summary(messages):
+            await asyncio.sleep(10)
+        
+        monkeypatch.setattr(config, "CONVERSATION_TAIL_MESSAGES", 2)
+        monkeypatch.setattr(memory_module.llm_gateway, "ainvoke", slow_summary)
+        memory = ConversationMemory(max_pending=2)
+        for thread_id in ("t1", "t2", "t3"):
+            memory.schedule_update(thread_id, self._messages(4), {"summary": "", "covered_ids": []})
+        await asyncio.sleep(0)
+        assert list(memory._pending) == ["t2", "t3"]
+        for task in memory._pending.values():
+            task.cancel()
+    
+    async def test_summary_survives_restart(self, offline_graph, monkeypatch):
+        """测试摘要随 checkpoint 持久化: 旧消息被移除后，新的进程 (空的进程内记忆) 仍能读到摘要"""
+        async def fake_summary(messages):
+            return AIMessage(content="用户在计算乘积")
+        
+        monkeypatch.setattr(config, "CONVERSATION_TAIL_MESSAGES", 2)
+        monkeypatch.setattr(memory_module.llm_gateway, "ainvoke", fake_summary)
+        offline_graph.tasks = {f"请求{i}": ["计算 6 乘 7"] for i in range(4)}
+        offline_graph.specs = {"计算 6 乘 7": [tool_spec("multiply_six_seven", "def multiply_six_seven() -> str:\n    return str(6 * 7)")]}
+        run_config = {"configurable": {"thread_id": "test-memory"}}
+        from src.workflow.runner import build_input_state
+        
+        for i in range(3):
+            state = await offline_graph.graph.ainvoke(build_input_state(f"请求{i}"), run_config)
+        assert state["conversation_summary"]["summary"] == "用户在计算乘积"
+        assert "请求0" not in [m.content for m in state["messages"]]
+        
+        monkeypatch.setattr(nodes, "conversation_memory", ConversationMemory())
+        offline_graph.prompts.clear()
+        await offline_graph.graph.ainvoke(build_input_state("请求3"), run_config)
+        assert "对话摘要:\n用户在计算乘积" in offline_graph.prompts[0]
+    
+    async def test_messages_folded_once(self, offline_graph, monkeypatch):
+        """测试连续多轮中每条消息只合并进摘要一次 (本轮移除的已覆盖消息不再重新合并)"""
+        folded = []
+        
+        async def fake_summary(messages):
+            new_lines = messages[0].content.split("新增对话:\n", 1)[1].split("\n\n要求:", 1)[0]
+            folded.extend(new_lines.splitlines())
+            return AIMessage(content="用户在计算乘积")
+        
+        monkeypatch.setattr(config, "CONVERSATION_TAIL_MESSAGES", 2)
+        monkeypatch.setattr(memory_module.llm_gateway, "ainvoke", fake_summary)
+        offline_graph.tasks = {f"请求{i}": ["计算 6 乘 7"] for i in range(5)}
+        offline_graph.specs = {"计算 6 乘 7": [tool_spec("multiply_six_seven", "def multiply_six_seven() -> str:\n    return str(6 * 7)")]}
+        run_config = {"configurable": {"thread_id": "test-fold-once"}}
+        from src.workflow.runner import build_input_state
+        
+        for i in range(5):
+            await offline_graph.graph.ainvoke(build_input_state(f"请求{i}"), run_config)
+            await asyncio.sleep(0)
+        assert [line for line in folded if line.startswith("用户")] == [f"用户: 请求{i}" for i in range(4)]
+        assert len(folded) == len(set(folded)) == 8
+
+
+class TestStreamingJSONParser:
+    """流式 JSON 解析测试"""
+    
+    def test_fields_available_before_object_ends(self):
+        """测试顶层字段完整后立即可用"""
+        parser = StreamingJSONParser()
+        assert parser.feed('{"need_tool": tr') == []
+        assert parser.feed('ue, "task_description": "计') == [("need_tool", True)]
+        assert parser.feed('算"}') == [("task_description", "计算")]
+        assert parser.done
+    
+    def test_skips_prose_and_braces_in_strings(self):
+        """测试跳过说明文字中的花括号，字符串内的花括号不影响解析"""
+        text = '格式 {key} 如下:\n```json\n{"code": "d = {\\"a\\": 1}"}\n```\n形如 {x}'
+        assert parse_json(text) == {"code": 'd = {"a": 1}'}
+    
+    def test_truncated_keeps_complete_fields(self):
+        """测试响应截断时保留已完整的字段"""
+        assert parse_json('{"need_tool": false, "direct_answer": "你') == {"need_tool": False}